@@ -0,0 +1,74 @@
+'''
+Import-time benchmark for the CLI and each pipeline stage.
+
+Every target is imported in a fresh interpreter, timed, and checked against the heavy modules it must not pull in.
+Exits with a non-zero status when a target loads a module it shouldn't or goes over its time budget.
+
+Usage: python benchmarks/import_time.py [--repeat 3] [--budget-scale 1.0]
+'''
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that mean a model or plotting backend was pulled in at import time
+HEAVY_MODULES = ["spacy", "sentence_transformers", "torch", "matplotlib", "seaborn", "wordcloud"]
+
+# target: (import statement, heavy modules it's allowed to load, time budget in seconds)
+TARGETS = {
+    "cli": ("import main", [], 3.0),
+    "ingest": ("from src import ingest", [], 3.0),
+    "preprocess": ("from src import preprocess", [], 3.0),
+    "features": ("from src import feature_engineering", [], 4.0),
+    "visualise": ("from src import visualise", ["matplotlib", "seaborn", "wordcloud"], 6.0),
+}
+
+PROBE = '''
+import json, sys, time
+t1 = time.perf_counter()
+{statement}
+t2 = time.perf_counter()
+print(json.dumps({{"seconds": t2 - t1, "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+'''
+
+def time_import(statement):
+    '''
+    Import in a fresh interpreter and return (seconds, heavy modules loaded).
+    '''
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE.format(statement=statement, heavy=HEAVY_MODULES)],
+        cwd=REPO_ROOT, capture_output=True, text=True, check=True
+    )
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    return report["seconds"], report["loaded"]
+
+def run_benchmark(repeat=3, budget_scale=1.0):
+    failures = []
+    for name, (statement, allowed, budget) in TARGETS.items():
+        runs = [time_import(statement) for _ in range(repeat)]
+        best = min(seconds for seconds, _ in runs)
+        unexpected = sorted(set(runs[0][1]) - set(allowed))
+        print(f"{name:<12} {best:6.2f}s (budget {budget * budget_scale:.1f}s)"
+              + (f"  loaded {', '.join(unexpected)}" if unexpected else ""))
+        if unexpected:
+            failures.append(f"{name} imports {', '.join(unexpected)}")
+        if best > budget * budget_scale:
+            failures.append(f"{name} took {best:.2f}s")
+    return failures
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the import time of the CLI and pipeline stages.")
+    parser.add_argument("--repeat", type=int, default=3, help="Fresh imports per target, the fastest is reported")
+    parser.add_argument("--budget-scale", type=float, default=1.0, help="Multiplier for the time budgets on slow machines")
+    args = parser.parse_args()
+
+    failures = run_benchmark(repeat=args.repeat, budget_scale=args.budget_scale)
+    if failures:
+        print("Import-time regressions:")
+        for failure in failures:
+            print(f"- {failure}")
+        sys.exit(1)
+    print("All import times within budget.")
@@ -0,0 +1,263 @@
+'''
+Throughput and memory benchmarks for each pipeline stage on synthetic corpora.
+
+Every (stage, size) pair runs in a fresh interpreter: the synthetic corpus and the stage inputs are
+built first, then only the stage itself is timed and its peak RSS measured. Results (docs/s, seconds,
+peak RSS per size, i.e. a scaling curve per stage) are written to JSON and compared against a stored
+baseline, and the script exits with a non-zero status when a stage got slower or heavier than the
+tolerance allows. Models are loaded from the local install only and everything runs on CPU.
+
+Usage: python benchmarks/stages.py [--sizes 1000 10000] [--stages mask kmeans] [--save-baseline]
+'''
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARKS_DIR = os.path.join(REPO_ROOT, "benchmarks")
+DEFAULT_RESULTS_PATH = os.path.join(BENCHMARKS_DIR, "results.json")
+DEFAULT_BASELINE_PATH = os.path.join(BENCHMARKS_DIR, "baseline.json")
+DEFAULT_SIZES = [1000, 10_000]
+# Allowed slowdown in docs/s and growth in peak RSS before a stage is flagged
+DEFAULT_TOLERANCE = 0.2
+
+# Offline, CPU-only settings for the worker processes
+WORKER_ENV = {
+    "HF_HUB_OFFLINE": "1",
+    "TRANSFORMERS_OFFLINE": "1",
+    "CUDA_VISIBLE_DEVICES": "",
+    "TOKENIZERS_PARALLELISM": "false",
+}
+
+def setup_quality_filter(df):
+    from src import preprocess
+    return lambda: preprocess.initial_quality_filter(df.copy())
+
+def setup_clean(df):
+    from src import preprocess
+    texts = df["company_description"].tolist()
+    return lambda: [preprocess.clean_company_description(text) for text in texts]
+
+def setup_dedup(df):
+    from src import preprocess, dedup
+    texts = [preprocess.clean_company_description(text) for text in df["company_description"]]
+    return lambda: dedup.near_duplicate_groups(texts)
+
+def setup_mask(df):
+    from src import preprocess, preprocess_utils
+    texts = [preprocess.clean_company_description(text) for text in df["company_description"]]
+    return lambda: [preprocess_utils.mask_and_extract_all(text) for text in texts]
+
+def setup_lemmatize(df):
+    from src import preprocess, preprocess_utils, models
+    texts = [preprocess.clean_company_description(text) for text in df["company_description"]]
+    models.get_nlp()
+    return lambda: preprocess_utils.lemmatize_texts(texts)
+
+def setup_ner(df):
+    from src import preprocess, feature_engineering, models
+    texts = [preprocess.clean_company_description(text) for text in df["company_description"]]
+    models.get_nlp()
+    return lambda: feature_engineering.extract_entities_batch(texts)
+
+def setup_embedding(df, quantise=False):
+    from src import preprocess, models
+    texts = [preprocess.clean_company_description(text).lower() for text in df["company_description"]]
+    engine = models.get_embedding_engine(quantise)
+    return lambda: engine.encode(texts)
+
+def setup_embedding_int8(df):
+    return setup_embedding(df, quantise=True)
+
+def setup_keybert(df):
+    from src import preprocess, feature_engineering, models
+    texts = [preprocess.clean_company_description(text).lower() for text in df["company_description"]]
+    embeddings = models.get_embedding_engine().encode(texts)
+    return lambda: feature_engineering.extract_keywords_batch(texts, embeddings)
+
+def setup_kmeans(df):
+    from src import clustering
+    embeddings = synthetic_embeddings(len(df))
+    return lambda: clustering.fit_assign(embeddings)
+
+def setup_visualise(df):
+    import tempfile
+    from src import visualise, clustering
+    embeddings = synthetic_embeddings(len(df))
+    _, cluster_ids, distances = clustering.fit_assign(embeddings)
+    plot_df = df[["id"]].copy()
+    plot_df["cluster_id"] = cluster_ids
+    plot_df["distance_to_centroid"] = distances
+    plot_df["lemmatized_description"] = df["company_description"].str.lower()
+    plots_dir = tempfile.mkdtemp(prefix="benchmark_plots_")
+    return lambda: visualise.generate_visualisations(plot_df, embeddings, plots_dir, preset="preview")
+
+# stage: function building the timed call from the synthetic ingested corpus (not timed itself)
+STAGES = {
+    "quality_filter": setup_quality_filter,
+    "clean": setup_clean,
+    "dedup": setup_dedup,
+    "mask": setup_mask,
+    "lemmatize": setup_lemmatize,
+    "ner": setup_ner,
+    "keybert": setup_keybert,
+    "embedding": setup_embedding,
+    "embedding_int8": setup_embedding_int8,
+    "kmeans": setup_kmeans,
+    "visualise": setup_visualise,
+}
+
+def synthetic_embeddings(n_rows, dim=384, n_topics=20, seed=42):
+    '''
+    Unit-length vectors scattered around n_topics directions, standing in for sentence embeddings.
+    '''
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(n_topics, dim))
+    vectors = centres[rng.integers(0, n_topics, size=n_rows)] + 0.5 * rng.normal(size=(n_rows, dim))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+def reset_peak_rss():
+    '''
+    Reset the kernel's peak RSS counter (Linux), so the peak only covers the timed call.
+    '''
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+def peak_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    # Linux reports kilobytes, macOS bytes
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def run_worker(stage, n_rows, seed):
+    '''
+    Build the inputs, then time the stage once. Prints the measurement as JSON.
+    '''
+    sys.path.insert(0, REPO_ROOT)
+    sys.path.insert(0, BENCHMARKS_DIR)
+    import synthetic
+    df = synthetic.make_ingested(n_rows, seed=seed)
+    call = STAGES[stage](df)
+    reset = reset_peak_rss()
+    t1 = time.perf_counter()
+    call()
+    seconds = time.perf_counter() - t1
+    print(json.dumps({
+        "stage": stage, "rows": n_rows, "seconds": seconds, "docs_per_second": n_rows / seconds,
+        "peak_rss_mb": peak_rss_mb(), "peak_rss_includes_setup": not reset,
+    }))
+
+def measure(stage, n_rows, seed=42, timeout=None):
+    try:
+        result = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--worker", stage, str(n_rows), "--seed", str(seed)],
+            cwd=REPO_ROOT, capture_output=True, text=True, env={**os.environ, **WORKER_ENV}, timeout=timeout
+        )
+    except subprocess.TimeoutExpired:
+        return {"stage": stage, "rows": n_rows, "error": [f"timed out after {timeout}s"]}
+    if result.returncode != 0:
+        return {"stage": stage, "rows": n_rows, "error": result.stderr.strip().splitlines()[-1:]}
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def run_benchmarks(stages, sizes, seed=42, timeout=None):
+    '''
+    Measure every stage at every size. Returns {stage: [measurement per size]}.
+    '''
+    results = {}
+    for stage in stages:
+        results[stage] = []
+        for n_rows in sizes:
+            measurement = measure(stage, n_rows, seed=seed, timeout=timeout)
+            results[stage].append(measurement)
+            if "error" in measurement:
+                print(f"{stage:<15} {n_rows:>9} rows  failed: {measurement['error']}")
+            else:
+                print(f"{stage:<15} {n_rows:>9} rows  {measurement['seconds']:8.2f}s  "
+                      f"{measurement['docs_per_second']:10.1f} docs/s  {measurement['peak_rss_mb']:8.1f} MB")
+    return results
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    '''
+    Regressions against the baseline: stages and sizes whose docs/s fell, or whose peak RSS grew,
+    by more than tolerance.
+    '''
+    regressions = []
+    for stage, measurements in results.items():
+        previous = {m["rows"]: m for m in baseline.get("stages", {}).get(stage, []) if "error" not in m}
+        for m in measurements:
+            if "error" in m:
+                regressions.append(f"{stage} at {m['rows']} rows failed")
+                continue
+            if m["rows"] not in previous:
+                continue
+            old = previous[m["rows"]]
+            if m["docs_per_second"] < old["docs_per_second"] * (1 - tolerance):
+                regressions.append(f"{stage} at {m['rows']} rows: {m['docs_per_second']:.1f} docs/s "
+                                   f"(baseline {old['docs_per_second']:.1f})")
+            if m["peak_rss_mb"] > old["peak_rss_mb"] * (1 + tolerance):
+                regressions.append(f"{stage} at {m['rows']} rows: {m['peak_rss_mb']:.1f} MB peak RSS "
+                                   f"(baseline {old['peak_rss_mb']:.1f})")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark each pipeline stage on synthetic corpora.")
+    parser.add_argument("--stages", type=str, nargs="+", choices=list(STAGES), default=list(STAGES),
+                        help="Stages to benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Corpus sizes in rows (1k to 1M)")
+    parser.add_argument("--seed", type=int, default=42, help="Seed for the synthetic corpus")
+    parser.add_argument("--timeout", type=float, default=None, help="Seconds before a single measurement is abandoned")
+    parser.add_argument("--output", type=str, default=DEFAULT_RESULTS_PATH, help="Where to write the results JSON")
+    parser.add_argument("--baseline", type=str, default=DEFAULT_BASELINE_PATH, help="Baseline results to compare against")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Allowed relative drop in docs/s or growth in peak RSS")
+    parser.add_argument("--save-baseline", action="store_true", help="Also save the results as the new baseline")
+    parser.add_argument("--worker", nargs=2, metavar=("STAGE", "ROWS"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker[0], int(args.worker[1]), args.seed)
+        sys.exit(0)
+
+    results = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "machine": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+        "seed": args.seed,
+        "stages": run_benchmarks(args.stages, args.sizes, seed=args.seed, timeout=args.timeout),
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to {args.output}.")
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {args.baseline}.")
+        sys.exit(0)
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, run with --save-baseline to create one.")
+        sys.exit(0)
+    with open(args.baseline, encoding="utf-8") as f:
+        regressions = compare(results, json.load(f), tolerance=args.tolerance)
+    if regressions:
+        print("Stage regressions:")
+        for regression in regressions:
+            print(f"- {regression}")
+        sys.exit(1)
+    print("All stages within tolerance of the baseline.")
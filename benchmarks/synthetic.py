@@ -0,0 +1,161 @@
+'''
+Synthetic company descriptions for benchmarking, shaped like data/2025_data_to_explore.csv.
+
+Descriptions are built from templated sentences with a log-normal number of sentences per description,
+and a configurable share of descriptions mentioning URLs, emails, money and dates. A share of the rows
+is non-English, garbled or duplicated, so the quality filter has something to do. Output is seeded
+and reproducible, and large corpora are written in chunks.
+
+Usage: python benchmarks/synthetic.py --rows 100000 --output data/synthetic_100k.csv
+'''
+import argparse
+import os
+import numpy as np
+import pandas as pd
+
+# Share of descriptions containing each kind of value the masking stage handles
+DEFAULT_DENSITY = {"url": 0.25, "email": 0.1, "money": 0.3, "date": 0.4}
+NON_ENGLISH_FRACTION = 0.05
+GARBLED_FRACTION = 0.02
+DUPLICATE_FRACTION = 0.01
+# Median and spread of the number of sentences per description
+SENTENCES_MEDIAN = 4
+SENTENCES_SIGMA = 0.6
+WRITE_CHUNK_SIZE = 100_000
+
+NAME_PARTS = ["Nova", "Blue", "Apex", "Green", "Quantum", "Bright", "Iron", "Silver", "North", "Vertex",
+              "Cedar", "Pulse", "Orbit", "Harbor", "Summit", "Atlas", "Lumen", "Crest", "Delta", "Forge"]
+NAME_SUFFIXES = ["Labs", "Systems", "Solutions", "Group", "Technologies", "Partners", "Works", "Analytics",
+                 "Energy", "Health", "Capital", "Logistics", "Foods", "Robotics", "Media"]
+INDUSTRIES = ["software", "fintech", "renewable energy", "healthcare", "logistics", "e-commerce", "biotech",
+              "cybersecurity", "construction", "education", "agritech", "insurance", "manufacturing", "retail"]
+ADJECTIVES = ["leading", "fast-growing", "innovative", "independent", "award-winning", "family-owned",
+              "venture-backed", "specialist", "global", "regional"]
+PRODUCTS = ["cloud platform", "analytics dashboard", "mobile app", "payment gateway", "supply chain software",
+            "solar panels", "diagnostic tools", "training programmes", "consulting services", "data pipelines",
+            "marketing automation", "electric vehicle chargers", "warehouse robots", "claims management software"]
+CUSTOMERS = ["small businesses", "enterprise clients", "hospitals", "local councils", "retailers", "banks",
+             "manufacturers", "universities", "logistics providers", "consumers"]
+CITIES = ["London", "Manchester", "Berlin", "Paris", "New York", "Austin", "Dublin", "Edinburgh", "Amsterdam",
+          "Toronto", "Singapore", "Bristol", "Leeds", "Madrid"]
+PEOPLE = ["Sarah Jones", "David Chen", "Amina Patel", "James Miller", "Laura Schmidt", "Tom Okafor"]
+MONTHS = ["January", "February", "March", "April", "May", "June", "July", "August", "September", "October",
+          "November", "December"]
+SOURCES = ["web", "api", "manual", "partner"]
+
+ENGLISH_SENTENCES = [
+    "{name} is a {adjective} {industry} company based in {city}.",
+    "We provide {product} for {customers} across the {region}.",
+    "The company was founded by {person} and employs over {employees} people.",
+    "Our {product} helps {customers} cut costs and grow faster.",
+    "{name} works with {customers} in {city} and {city2}.",
+    "The team builds {product} and offers {product2} to {customers}.",
+    "Customers include {customers} and {customers2} in more than {countries} countries.",
+    "{name} is headquartered in {city} with offices in {city2}.",
+]
+VALUE_SENTENCES = {
+    "url": ["Find out more at https://www.{slug}.com.", "Visit www.{slug}.co.uk for details.",
+            "See https://{slug}.io/about for our story."],
+    "email": ["Contact us at info@{slug}.com.", "Email hello@{slug}.co.uk for a demo."],
+    "money": ["The company raised £{amount}m in its latest funding round.",
+              "Revenue reached ${amount} million last year.", "It secured a €{amount}m contract."],
+    "date": ["The business was established in {month} {year}.", "It launched its first product on {day}/{month_num}/{year}.",
+             "In {year} the company expanded into {city}."],
+}
+NON_ENGLISH_SENTENCES = [
+    "{name} est une entreprise de {industry} basée à {city}.",
+    "Nous proposons des solutions innovantes pour nos clients en Europe.",
+    "{name} ist ein führendes Unternehmen mit Sitz in {city}.",
+    "Wir entwickeln Software für mittelständische Unternehmen.",
+    "{name} es una empresa líder con sede en {city}.",
+    "Ofrecemos servicios de consultoría para empresas de todo el mundo.",
+]
+
+def fill(template, rng, name, slug):
+    return template.format(
+        name=name, slug=slug, adjective=rng.choice(ADJECTIVES), industry=rng.choice(INDUSTRIES),
+        city=rng.choice(CITIES), city2=rng.choice(CITIES), region=rng.choice(["UK", "EU", "US", "world"]),
+        product=rng.choice(PRODUCTS), product2=rng.choice(PRODUCTS), customers=rng.choice(CUSTOMERS),
+        customers2=rng.choice(CUSTOMERS), person=rng.choice(PEOPLE), employees=int(rng.integers(5, 5000)),
+        countries=int(rng.integers(2, 60)), amount=round(float(rng.uniform(0.5, 250)), 1),
+        month=rng.choice(MONTHS), month_num=f"{int(rng.integers(1, 13)):02d}", day=f"{int(rng.integers(1, 29)):02d}",
+        year=int(rng.integers(1990, 2025)),
+    )
+
+def make_description(rng, density, non_english=False, garbled=False):
+    name = f"{rng.choice(NAME_PARTS)} {rng.choice(NAME_SUFFIXES)}"
+    slug = name.lower().replace(" ", "")
+    if garbled:
+        symbols = list("#@!$%^&*()[]{}<>~|0123456789")
+        return "".join(rng.choice(symbols, size=int(rng.integers(5, 80))))
+    n_sentences = max(1, int(round(rng.lognormal(np.log(SENTENCES_MEDIAN), SENTENCES_SIGMA))))
+    pool = NON_ENGLISH_SENTENCES if non_english else ENGLISH_SENTENCES
+    sentences = [fill(pool[i], rng, name, slug) for i in rng.integers(0, len(pool), size=n_sentences)]
+    if not non_english:
+        for kind, share in density.items():
+            if rng.random() < share:
+                templates = VALUE_SENTENCES[kind]
+                position = int(rng.integers(0, len(sentences) + 1))
+                sentences.insert(position, fill(templates[int(rng.integers(0, len(templates)))], rng, name, slug))
+    return " ".join(sentences)
+
+def make_corpus(n_rows, seed=42, density=None, non_english_fraction=NON_ENGLISH_FRACTION,
+                garbled_fraction=GARBLED_FRACTION, duplicate_fraction=DUPLICATE_FRACTION, start_id=100_000):
+    '''
+    A DataFrame of n_rows synthetic raw rows with the columns of the raw CSV.
+    '''
+    rng = np.random.default_rng(seed)
+    density = {**DEFAULT_DENSITY, **(density or {})}
+    kinds = rng.random(n_rows)
+    descriptions = [
+        make_description(rng, density, non_english=k < non_english_fraction,
+                         garbled=non_english_fraction <= k < non_english_fraction + garbled_fraction)
+        for k in kinds
+    ]
+    # Some rows repeat an earlier description under a new id
+    duplicates = np.flatnonzero(rng.random(n_rows) < duplicate_fraction)
+    for row in duplicates[duplicates > 0]:
+        descriptions[row] = descriptions[int(rng.integers(0, row))]
+
+    created_at = pd.Timestamp("2015-01-01") + pd.to_timedelta(rng.integers(0, 10 * 365 * 86400, size=n_rows), unit="s")
+    return pd.DataFrame({
+        "Unnamed: 0": np.arange(n_rows),
+        "id": start_id + np.arange(n_rows),
+        "company_description": descriptions,
+        "source": rng.choice(SOURCES, size=n_rows),
+        "is_edited": (rng.random(n_rows) < 0.1).astype(int),
+        "created_at": created_at.strftime("%Y-%m-%d %H:%M:%S"),
+    })
+
+def make_ingested(n_rows, seed=42, **kwargs):
+    '''
+    A synthetic corpus typed like the output of ingest.initial_ingest.
+    '''
+    df = make_corpus(n_rows, seed=seed, **kwargs).drop(columns=["Unnamed: 0"])
+    df["created_at"] = pd.to_datetime(df["created_at"])
+    return df
+
+def write_corpus(path, n_rows, seed=42, chunk_size=WRITE_CHUNK_SIZE, **kwargs):
+    '''
+    Write a synthetic raw CSV in chunks, so corpora of millions of rows don't have to fit in memory.
+    '''
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    for i, start in enumerate(range(0, n_rows, chunk_size)):
+        chunk = make_corpus(min(chunk_size, n_rows - start), seed=seed + i, start_id=100_000 + start, **kwargs)
+        chunk["Unnamed: 0"] += start
+        chunk.to_csv(path, mode="w" if i == 0 else "a", header=i == 0, index=False)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic raw company descriptions CSV.")
+    parser.add_argument("--rows", type=int, default=10_000, help="Number of rows (1k to 1M)")
+    parser.add_argument("--output", type=str, required=True, help="CSV path to write")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--non-english", type=float, default=NON_ENGLISH_FRACTION, help="Share of non-English rows")
+    for kind, share in DEFAULT_DENSITY.items():
+        parser.add_argument(f"--{kind}-density", type=float, default=share, help=f"Share of rows mentioning a {kind}")
+    args = parser.parse_args()
+
+    density = {kind: getattr(args, f"{kind}_density") for kind in DEFAULT_DENSITY}
+    write_corpus(args.output, args.rows, seed=args.seed, density=density, non_english_fraction=args.non_english)
+    print(f"Wrote {args.rows} rows to {args.output}.")
@@ -1,92 +1,444 @@
 
 import os
 import argparse
-import time
-from src import ingest, preprocess, feature_engineering, structure, visualise
+from src import ingest, structure, cache, incremental, streaming, storage, similarity, clustering, pipeline, entities
+from src import embedding_store, dedup, profiling
+
+# The NLP and plotting stages are imported by the steps that use them, so light stages start quickly
 
 OUTPUT_DIR = "output"
 DATA_PATH = "data/2025_data_to_explore.csv"
 PLOTS_DIR = os.path.join(OUTPUT_DIR, "plots")
-PREPROCESSED_PATH = os.path.join(OUTPUT_DIR, "preprocessed_data.csv")
-PROCESSED_PATH = os.path.join(OUTPUT_DIR, "processed_data.csv")
+ARTIFACT_FORMAT = "parquet"
+PREPROCESSED_PATH = os.path.join(OUTPUT_DIR, f"preprocessed_data.{ARTIFACT_FORMAT}")
+PROCESSED_PATH = os.path.join(OUTPUT_DIR, f"processed_data.{ARTIFACT_FORMAT}")
 TFIDF_MATRIX_PATH = os.path.join(OUTPUT_DIR, "tfidf_matrix.npz")
 TFIDF_TERMS_PATH = os.path.join(OUTPUT_DIR, "tfidf_terms.csv")
+CLUSTER_TERMS_PATH = os.path.join(OUTPUT_DIR, "cluster_terms.csv")
 EMBEDDINGS_PATH = os.path.join(OUTPUT_DIR, "sentence_embeddings.npy")
+ENTITY_SPANS_PATH = os.path.join(OUTPUT_DIR, "entity_spans.npz")
+CACHE_PATH = os.path.join(OUTPUT_DIR, "nlp_cache.sqlite")
+MODELS_DIR = os.path.join(OUTPUT_DIR, "models")
+TFIDF_MODEL_PATH = os.path.join(MODELS_DIR, "tfidf_vectorizer.joblib")
+KMEANS_MODEL_PATH = os.path.join(MODELS_DIR, "kmeans.joblib")
+SIMILARITY_INDEX_PATH = os.path.join(MODELS_DIR, "similarity_index.npz")
+SNAPSHOT_PATH = os.path.join(OUTPUT_DIR, "ingest_snapshot.csv")
+STREAM_DIR = os.path.join(OUTPUT_DIR, "stream")
+MANIFEST_PATH = os.path.join(OUTPUT_DIR, "pipeline_manifest.json")
+RUN_REPORT_PATH = os.path.join(OUTPUT_DIR, "run_report.json")
+# Where --profile saves its capture unless --profile-path is given
+PROFILE_PATHS = {"cprofile": os.path.join(OUTPUT_DIR, "profile.prof"), "py-spy": os.path.join(OUTPUT_DIR, "profile.speedscope.json")}
+
+# Stages each --run option targets, anything upstream they need is run too if it isn't fresh
+STAGE_TARGETS = {
+    "all": ["ingest", "preprocess", "features", "structure", "visualise"],
+    "ingest": ["ingest"],
+    "preprocess": ["preprocess"],
+    "features": ["features"],
+    "features_structure": ["structure"],
+    "visualise": ["visualise"],
+}
+
+def ingest_stage(inputs, config):
+    print("Step 1: Ingesting raw data...")
+    df = ingest.initial_ingest(inputs["raw_data"])
+    return {"ingested": df, "snapshot_keys": incremental.snapshot_keys(df)}
+
+def preprocess_stage(inputs, config):
+    from src import preprocess
+    print("Step 2: Preprocessing text...")
+    df = preprocess.preprocess_data(
+        inputs["ingested"], batch_size=config["spacy_batch_size"], n_process=config["spacy_n_process"],
+        dedup_threshold=config["dedup_threshold"]
+    )
+    # Save the preprocessed data
+    storage.write_table(df, PREPROCESSED_PATH)
+    print(f"Preprocessed data saved to {PREPROCESSED_PATH}.")
+    return {"preprocessed": df}
+
+def features_stage(inputs, config):
+    from src import feature_engineering
+    print("Step 3: Feature engineering...")
+    # Reuse the saved cluster model so cluster ids stay the same between runs
+    kmeans = ingest.read_model(KMEANS_MODEL_PATH) if config["freeze_clusters"] else None
+    if config["freeze_clusters"] and kmeans is None:
+        print(f"No saved cluster model found at {KMEANS_MODEL_PATH}, fitting a new one.")
+    features = feature_engineering.feature_engineering(
+        inputs["preprocessed"], kmeans=kmeans, tfidf_mode=config["tfidf_mode"], n_clusters=config["n_clusters"],
+        cluster_method=config["cluster_method"], batch_size=config["spacy_batch_size"], n_process=config["spacy_n_process"],
+        extractor_jobs=config["extractor_jobs"], ner_labels=config["ner_labels"],
+        quantise_embeddings=config["quantise_embeddings"]
+    )
+    return {"features": features}
+
+def structure_stage(inputs, config):
+    print("Step 4: Structuring & saving final datasets...")
+    features = inputs["features"]
+    structure.save_structured_data(
+                features=features,
+                processed_path=PROCESSED_PATH,
+                tfidf_matrix_path=TFIDF_MATRIX_PATH,
+                tfidf_terms_path=TFIDF_TERMS_PATH,
+                embeddings_path=EMBEDDINGS_PATH,
+                cluster_terms_path=CLUSTER_TERMS_PATH,
+                tfidf_model_path=TFIDF_MODEL_PATH,
+                kmeans_model_path=KMEANS_MODEL_PATH,
+                similarity_index_path=SIMILARITY_INDEX_PATH,
+                entity_spans_path=ENTITY_SPANS_PATH,
+                embedding_dtype=config["embedding_dtype"]
+    )
+    incremental.save_snapshot(inputs["snapshot_keys"], SNAPSHOT_PATH)
+    return {"processed": features["df"], "embeddings": features["embeddings"]}
 
-def run_pipeline(run_stage="all"):
-    df = None
-    embeddings = None
-    tfidf_matrix = None
-    tfidf_terms = None
-
-    if run_stage in ["all", "ingest"]:
-        print("Step 1: Ingesting raw data...")
-        df = ingest.initial_ingest(DATA_PATH)
-
-    if run_stage in ["all", "preprocess"]:
-        print("Step 2: Preprocessing text...")
-        if df is None:
-            df = ingest.initial_ingest(DATA_PATH)
-            print("Ingested data from CSV file as the DataFrame was not found.")
-        t1 = time.time()
-        df = preprocess.preprocess_data(df)
-        t2 = time.time()
-        print(f"Preprocessing took {t2 - t1:.2f} seconds.")
-        # Save the preprocessed data to a CSV file
-        df.to_csv(PREPROCESSED_PATH, index=False)
-        print(f"Preprocessed data saved to {PREPROCESSED_PATH}.")
-
-    if run_stage in ["all", "features", "features_structure"]:
-        print("Step 3: Feature engineering...")
-        # Check if preprocessed data exists, if not, get or generate it
-        if df is None:
-            df = ingest.read_preprocessed_data(PREPROCESSED_PATH)
-            if df is None:
-                print("Step 1: Ingesting raw data...")
-                df = ingest.initial_ingest(DATA_PATH)
-                print("Step 2: Preprocessing text...")
-                df = preprocess.preprocess_data(df)
-
-        t1 = time.time()
-        features = feature_engineering.feature_engineering(df)
-        t2 = time.time()
-        print(f"Feature Engineering took {t2 - t1:.2f} seconds.")
-
-    if run_stage in ["all", "features_structure"]:
-        if features is None:
-            print("Pipeline aborted: No features to structure.")
-            return
-        print("Step 4: Structuring & saving final datasets...")
-        structure.save_structured_data(
-                    features=features,
-                    processed_path=PROCESSED_PATH,
-                    tfidf_matrix_path=TFIDF_MATRIX_PATH,
-                    tfidf_terms_path=TFIDF_TERMS_PATH,
-                    embeddings_path=EMBEDDINGS_PATH
-        )
-
-    if run_stage in ["all", "visualise"]:
-        print("Step 5: Generating visualisations...")
-        features = {}
-        features["df"] = ingest.read_processed_data(PROCESSED_PATH)
-        features["embeddings"] = ingest.read_embeddings(EMBEDDINGS_PATH)
-        t1 = time.time()
-        visualise.generate_visualisations(
-            df=features["df"],
-            embeddings=features["embeddings"],
-            PLOTS_DIR=PLOTS_DIR
-        )
-        t2 = time.time()
-        print(f"Visualisation generation and saving took {t2 - t1:.2f} seconds.")
+def read_plot_data(path):
+    from src import visualise
+    return ingest.read_processed_data(path, columns=visualise.REQUIRED_COLUMNS)
+
+def visualise_stage(inputs, config):
+    from src import visualise
+    print("Step 5: Generating visualisations...")
+    visualise.generate_visualisations(
+        df=inputs["processed"],
+        embeddings=inputs["embeddings"],
+        PLOTS_DIR=PLOTS_DIR,
+        preset=config["plot_preset"],
+        n_jobs=config["plot_jobs"],
+        projection_cache_dir=MODELS_DIR
+    )
+    return {}
+
+def build_pipeline(spacy_batch_size=256, spacy_n_process=1,
+                   n_clusters=clustering.DEFAULT_N_CLUSTERS, cluster_method="auto", freeze_clusters=False,
+                   tfidf_mode="vocabulary", plot_preset="final", plot_jobs=None, extractor_jobs=None,
+                   ner_labels=entities.NER_LABELS, embedding_dtype="float32", quantise_embeddings=False,
+                   dedup_threshold=dedup.DEFAULT_THRESHOLD):
+    '''
+    The stage graph, with the artifacts each stage reads and writes and the settings its outputs depend on.
+    '''
+    from src.models import SPACY_MODEL_VERSION, BERT_MODEL_NAME
+    config = {
+        "spacy_batch_size": spacy_batch_size,
+        "spacy_n_process": spacy_n_process,
+        "dedup_threshold": dedup_threshold,
+        "extractor_jobs": extractor_jobs,
+        "n_clusters": n_clusters,
+        "cluster_method": cluster_method,
+        "freeze_clusters": freeze_clusters,
+        # With frozen clusters the features depend on the saved model
+        "frozen_kmeans": pipeline.file_digest(KMEANS_MODEL_PATH) if freeze_clusters else None,
+        "tfidf_mode": tfidf_mode,
+        "ner_labels": list(ner_labels),
+        "quantise_embeddings": quantise_embeddings,
+        "embedding_dtype": embedding_dtype,
+        "plot_preset": plot_preset,
+        "plot_jobs": plot_jobs,
+    }
+    artifacts = [
+        pipeline.Artifact("raw_data", DATA_PATH),
+        pipeline.Artifact("ingested"),
+        pipeline.Artifact("snapshot_keys"),
+        pipeline.Artifact("preprocessed", PREPROCESSED_PATH, ingest.read_preprocessed_data),
+        pipeline.Artifact("features"),
+        pipeline.Artifact("processed", PROCESSED_PATH, ingest.read_processed_data),
+        pipeline.Artifact("tfidf_matrix", TFIDF_MATRIX_PATH, ingest.read_tfidf_matrix),
+        pipeline.Artifact("tfidf_terms", TFIDF_TERMS_PATH),
+        pipeline.Artifact("embeddings", EMBEDDINGS_PATH, ingest.read_embedding_store),
+        pipeline.Artifact("cluster_terms", CLUSTER_TERMS_PATH),
+        pipeline.Artifact("tfidf_model", TFIDF_MODEL_PATH, ingest.read_model),
+        pipeline.Artifact("kmeans_model", KMEANS_MODEL_PATH, ingest.read_model),
+        pipeline.Artifact("similarity_index", SIMILARITY_INDEX_PATH, similarity.read_index),
+        pipeline.Artifact("entity_spans", ENTITY_SPANS_PATH, entities.read_spans),
+        pipeline.Artifact("ingest_snapshot", SNAPSHOT_PATH, incremental.read_snapshot),
+        pipeline.Artifact("plots", PLOTS_DIR),
+    ]
+    stages = [
+        pipeline.Stage("ingest", ingest_stage, inputs=["raw_data"], outputs=["ingested", "snapshot_keys"],
+                       modules=["ingest", "raw_reader"]),
+        pipeline.Stage("preprocess", preprocess_stage, inputs=["ingested"], outputs=["preprocessed"],
+                       modules=["preprocess", "preprocess_utils", "masking", "quality", "language", "storage", "dedup"],
+                       config_keys=["dedup_threshold"], models=[SPACY_MODEL_VERSION]),
+        pipeline.Stage("features", features_stage, inputs=["preprocessed"], outputs=["features"],
+                       modules=["feature_engineering", "tfidf", "clustering", "cluster_terms", "similarity", "preprocess_utils",
+                                "embedding_engine", "dedup", "extractors", "entities"],
+                       config_keys=["n_clusters", "cluster_method", "freeze_clusters", "frozen_kmeans", "tfidf_mode",
+                                    "ner_labels", "quantise_embeddings"],
+                       models=[SPACY_MODEL_VERSION, BERT_MODEL_NAME]),
+        pipeline.Stage("structure", structure_stage, inputs=["features", "snapshot_keys"],
+                       outputs=["processed", "tfidf_matrix", "tfidf_terms", "embeddings", "cluster_terms",
+                                "tfidf_model", "kmeans_model", "similarity_index", "entity_spans", "ingest_snapshot"],
+                       modules=["structure", "storage", "incremental", "embedding_store", "entities"],
+                       config_keys=["embedding_dtype"]),
+        pipeline.Stage("visualise", visualise_stage, inputs=["processed", "embeddings"], outputs=["plots"],
+                       modules=["visualise", "embedding_store"], config_keys=["plot_preset"], load={"processed": read_plot_data}),
+    ]
+    return pipeline.Pipeline(stages, artifacts, MANIFEST_PATH, config=config)
+
+def run_pipeline(run_stage="all", spacy_batch_size=256, spacy_n_process=1,
+                 n_clusters=clustering.DEFAULT_N_CLUSTERS, cluster_method="auto", freeze_clusters=False,
+                 tfidf_mode="vocabulary", plot_preset="final", plot_jobs=None, force=False, max_workers=None,
+                 extractor_jobs=None, ner_labels=entities.NER_LABELS, embedding_dtype="float32",
+                 quantise_embeddings=False, dedup_threshold=dedup.DEFAULT_THRESHOLD):
+    '''
+    Run the stages behind run_stage, skipping any whose outputs are fresh unless force is set.
+    '''
+    stages = build_pipeline(
+        spacy_batch_size=spacy_batch_size, spacy_n_process=spacy_n_process, n_clusters=n_clusters,
+        cluster_method=cluster_method, freeze_clusters=freeze_clusters, tfidf_mode=tfidf_mode,
+        plot_preset=plot_preset, plot_jobs=plot_jobs, extractor_jobs=extractor_jobs, ner_labels=ner_labels,
+        embedding_dtype=embedding_dtype, quantise_embeddings=quantise_embeddings, dedup_threshold=dedup_threshold
+    )
+    stages.run(STAGE_TARGETS[run_stage], max_workers=max_workers, force=force)
+
+    if cache.get_cache() is not None:
+        cache.get_cache().report()
 
     print("Pipeline completed successfully!")
 
+def run_incremental_pipeline(spacy_batch_size=256, spacy_n_process=1, n_clusters=clustering.DEFAULT_N_CLUSTERS,
+                             cluster_method="auto", freeze_clusters=False, tfidf_mode="vocabulary",
+                             extractor_jobs=None, ner_labels=entities.NER_LABELS, quantise_embeddings=False,
+                             dedup_threshold=dedup.DEFAULT_THRESHOLD):
+    '''
+    Only process rows that are new or edited since the last run and merge them into the existing artifacts.
+    The TF-IDF vocabulary and KMeans centroids stay frozen until the full pipeline is run again.
+    '''
+    from src import preprocess, feature_engineering
+    # Settings of the stages this run stands in for, for the full run fallback and the recorded fingerprints
+    stage_config = dict(
+        spacy_batch_size=spacy_batch_size, spacy_n_process=spacy_n_process, n_clusters=n_clusters,
+        cluster_method=cluster_method, freeze_clusters=freeze_clusters, tfidf_mode=tfidf_mode,
+        extractor_jobs=extractor_jobs, ner_labels=ner_labels, quantise_embeddings=quantise_embeddings,
+        dedup_threshold=dedup_threshold
+    )
+    print("Step 1: Ingesting raw data...")
+    incoming = ingest.initial_ingest(DATA_PATH)
+    snapshot_keys = incremental.snapshot_keys(incoming)
+
+    snapshot = incremental.read_snapshot(SNAPSHOT_PATH)
+    old_df = ingest.read_processed_data(PROCESSED_PATH)
+    old_tfidf_matrix = ingest.read_tfidf_matrix(TFIDF_MATRIX_PATH)
+    old_embeddings = ingest.read_embeddings(EMBEDDINGS_PATH)
+    # Merged embeddings are saved with the dtype of the existing store
+    old_store = ingest.read_embedding_store(EMBEDDINGS_PATH)
+    embedding_dtype = old_store.dtype if old_store is not None else "float32"
+    old_entity_spans = entities.read_spans(ENTITY_SPANS_PATH)
+    tfidf_vectorizer = ingest.read_model(TFIDF_MODEL_PATH)
+    kmeans = ingest.read_model(KMEANS_MODEL_PATH)
+    if any(x is None for x in [snapshot, old_df, old_tfidf_matrix, old_embeddings, old_entity_spans, tfidf_vectorizer, kmeans]):
+        print("No complete previous run found, running the full pipeline instead.")
+        run_pipeline("all", force=True, **stage_config)
+        return
+
+    delta, stale_ids = incremental.diff_against_snapshot(incoming, snapshot)
+    print(f"Found {len(delta)} new or edited rows, {len(stale_ids)} existing rows are stale.")
+
+    # Stale rows leave the similarity index, new and edited rows are added back during feature engineering
+    similarity_index = similarity.read_index(SIMILARITY_INDEX_PATH)
+    if similarity_index is None:
+        similarity_index = similarity.build_index(old_df["id"], old_embeddings)
+    similarity_index.remove(stale_ids)
+
+    new_features = None
+    if len(delta) > 0:
+        print("Step 2: Preprocessing new and edited rows...")
+        with profiling.span("incremental.preprocess", n_docs=len(delta)) as timing:
+            delta = preprocess.preprocess_data(delta.reset_index(drop=True), batch_size=spacy_batch_size,
+                                               n_process=spacy_n_process, dedup_threshold=dedup_threshold)
+        print(f"Preprocessing took {timing.seconds:.2f} seconds.")
+
+    if len(delta) > 0:
+        print("Step 3: Feature engineering with frozen TF-IDF and KMeans models...")
+        with profiling.span("incremental.features", n_docs=len(delta)) as timing:
+            new_features = feature_engineering.feature_engineering(
+                delta, tfidf_vectorizer=tfidf_vectorizer, kmeans=kmeans, similarity_index=similarity_index,
+                batch_size=spacy_batch_size, n_process=spacy_n_process, extractor_jobs=extractor_jobs,
+                ner_labels=ner_labels, quantise_embeddings=quantise_embeddings
+            )
+        print(f"Feature Engineering took {timing.seconds:.2f} seconds.")
+
+    print("Step 4: Merging into the existing datasets...")
+    features = incremental.merge_artifacts(
+        old_df, old_tfidf_matrix, old_embeddings, old_entity_spans, stale_ids, new_features
+    )
+    features["tfidf_terms"] = tfidf_vectorizer.get_feature_names_out()
+    features["df"], features["cluster_terms"] = feature_engineering.add_cluster_terms(
+        features["df"], features["tfidf_matrix"], features["tfidf_terms"]
+    )
+    changed_ids = new_features["df"]["id"] if new_features is not None else []
+    features["df"] = similarity.update_most_similar(features["df"], similarity_index, changed_ids, stale_ids)
+    features["similarity_index"] = similarity_index
+    structure.save_structured_data(
+                features=features,
+                processed_path=PROCESSED_PATH,
+                tfidf_matrix_path=TFIDF_MATRIX_PATH,
+                tfidf_terms_path=TFIDF_TERMS_PATH,
+                embeddings_path=EMBEDDINGS_PATH,
+                cluster_terms_path=CLUSTER_TERMS_PATH,
+                similarity_index_path=SIMILARITY_INDEX_PATH,
+                entity_spans_path=ENTITY_SPANS_PATH,
+                embedding_dtype=embedding_dtype
+    )
+    incremental.save_snapshot(snapshot_keys, SNAPSHOT_PATH)
+    # The merged outputs stand in for a full rebuild, so later runs don't redo the stages that wrote them
+    build_pipeline(embedding_dtype=embedding_dtype, **stage_config).mark_fresh(["ingest", "structure"])
+
+    if cache.get_cache() is not None:
+        cache.get_cache().report()
+
+    print("Incremental run completed successfully!")
+
+def run_similarity_query(ids=None, texts=None, k=10):
+    '''
+    Print the k most similar companies to each company id or raw text, using the saved similarity index.
+    '''
+    similarity_index = similarity.read_index(SIMILARITY_INDEX_PATH)
+    if similarity_index is None:
+        print(f"No similarity index found at {SIMILARITY_INDEX_PATH}, run the features_structure stage first.")
+        return
+    results = []
+    if ids:
+        unknown = [id_ for id_ in ids if id_ not in similarity_index.id_to_row]
+        if unknown:
+            print(f"Ids not in the index: {unknown}")
+        results.append(similarity_index.query_ids([id_ for id_ in ids if id_ in similarity_index.id_to_row], k=k))
+    if texts:
+        results.append(similarity_index.query_texts(texts, k=k))
+    for result in results:
+        for query, matches in result.groupby("query", sort=False):
+            print(f"Most similar to {query!r}:")
+            print(matches[["rank", "id", "score"]].to_string(index=False))
+
+def n_clusters_arg(value):
+    return value if value == "auto" else int(value)
+
+def extractor_jobs_arg(value):
+    name, _, n_jobs = value.partition("=")
+    if not n_jobs:
+        raise argparse.ArgumentTypeError(f"expected NAME=N, got {value!r}")
+    return name, int(n_jobs)
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Run pipeline stages for the NLP technical assessment.")
     parser.add_argument("--run", type=str, choices=["all", "ingest", "preprocess", "features", "features_structure", "visualise"],
                         default="all", help="Pipeline stage to run")
+    parser.add_argument("--spacy-batch-size", type=int, default=256, help="Batch size for spaCy's nlp.pipe")
+    parser.add_argument("--spacy-n-process", type=int, default=1, help="Number of worker processes the spaCy parse is spread over")
+    parser.add_argument("--cache-path", type=str, default=CACHE_PATH, help="On-disk cache for per-document NLP results")
+    parser.add_argument("--cache-max-mb", type=float, default=cache.DEFAULT_MAX_SIZE_MB, help="Size limit for the NLP cache")
+    parser.add_argument("--no-cache", action="store_true", help="Recompute every per-document NLP result")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only process new or edited rows and merge them into the existing outputs")
+    parser.add_argument("--refit", action="store_true",
+                        help="With --incremental, rebuild everything and refit the TF-IDF and KMeans models")
+    parser.add_argument("--format", type=str, choices=["parquet", "csv"], default=ARTIFACT_FORMAT,
+                        help="File format for the preprocessed and processed datasets")
+    parser.add_argument("--stream", action="store_true",
+                        help="Process the input in chunks and write partitioned outputs, with memory bounded by the chunk size")
+    parser.add_argument("--chunk-size", type=int, default=streaming.STREAM_CHUNK_SIZE, help="Rows per chunk with --stream")
+    parser.add_argument("--sample-size", type=int, default=streaming.STREAM_SAMPLE_SIZE,
+                        help="Rows sampled to fit the TF-IDF and KMeans models with --stream")
+    parser.add_argument("--tfidf-mode", type=str, choices=["vocabulary", "hashing"], default="vocabulary",
+                        help="Build the TF-IDF vocabulary in memory, or hash terms chunk by chunk for large corpora")
+    parser.add_argument("--n-clusters", type=n_clusters_arg, default=clustering.DEFAULT_N_CLUSTERS,
+                        help="Number of KMeans clusters, or auto to pick k by silhouette score")
+    parser.add_argument("--cluster-method", type=str, choices=["auto", "kmeans", "minibatch"], default="auto",
+                        help="Full-batch KMeans, MiniBatchKMeans, or auto (mini-batch for large corpora)")
+    parser.add_argument("--freeze-clusters", action="store_true",
+                        help="Assign clusters with the saved cluster model instead of refitting it")
+    parser.add_argument("--similar-to", type=int, nargs="+", help="Company ids to find the most similar companies for")
+    parser.add_argument("--similar-text", type=str, nargs="+", help="Raw texts to find the most similar companies for")
+    parser.add_argument("--top-k", type=int, default=10, help="Number of similar companies to return per query")
+    parser.add_argument("--plot-preset", type=str, choices=["final", "preview", "vector"], default="final",
+                        help="Plot output settings: 300 dpi PNG, 72 dpi PNG for quick previews, or SVG")
+    parser.add_argument("--plot-jobs", type=int, default=None,
+                        help="Worker processes for rendering plots (all cores by default, 1 to render in-process)")
+    parser.add_argument("--extractor-jobs", type=extractor_jobs_arg, nargs="+", default=[],
+                        help="Core budget per feature extractor, e.g. ner=4 embeddings=2 (ner defaults to --spacy-n-process)")
+    parser.add_argument("--ner-labels", type=str, nargs="+", default=entities.NER_LABELS,
+                        help="spaCy entity labels that get has_/num_/first_ feature columns")
+    parser.add_argument("--embedding-dtype", type=str, choices=embedding_store.STORE_DTYPES, default="float32",
+                        help="Storage dtype of the saved sentence embeddings (int8 uses per-dimension scales)")
+    parser.add_argument("--quantise-embeddings", action="store_true",
+                        help="Encode sentence embeddings with dynamic int8 quantisation of the model's linear layers")
+    parser.add_argument("--dedup-threshold", type=float, default=dedup.DEFAULT_THRESHOLD,
+                        help="Estimated Jaccard similarity from which descriptions are near-duplicates and share features")
+    parser.add_argument("--no-dedup", action="store_true", help="Compute features for every row, even near-duplicates")
+    parser.add_argument("--force", action="store_true",
+                        help="Run the requested stages even if their outputs are up to date")
+    parser.add_argument("--stage-workers", type=int, default=None,
+                        help="Maximum number of independent stages run at the same time")
+    parser.add_argument("--profile", type=str, choices=profiling.PROFILERS, default=None,
+                        help="Capture a cProfile (.prof) or py-spy (speedscope JSON) profile of the run")
+    parser.add_argument("--profile-path", type=str, default=None,
+                        help="Where to save the --profile capture (output/profile.prof or output/profile.speedscope.json)")
+    parser.add_argument("--report-path", type=str, default=RUN_REPORT_PATH,
+                        help="Where to save the JSON run report with per-step timings, docs/s and peak memory")
     args = parser.parse_args()
+    extractor_jobs = dict(args.extractor_jobs)
+    dedup_threshold = None if args.no_dedup else args.dedup_threshold
+
+    ARTIFACT_FORMAT = args.format
+    PREPROCESSED_PATH = os.path.join(OUTPUT_DIR, f"preprocessed_data.{ARTIFACT_FORMAT}")
+    PROCESSED_PATH = os.path.join(OUTPUT_DIR, f"processed_data.{ARTIFACT_FORMAT}")
 
     os.makedirs(OUTPUT_DIR, exist_ok=True)
     print("Step 0: Setting up...")
-    run_pipeline(args.run)
+    if not args.no_cache:
+        cache.configure_cache(args.cache_path, max_size_mb=args.cache_max_mb)
+    profile_path = args.profile_path or PROFILE_PATHS.get(args.profile)
+    with profiling.capture_profile(args.profile, profile_path):
+        if args.similar_to or args.similar_text:
+            run_similarity_query(ids=args.similar_to, texts=args.similar_text, k=args.top_k)
+        elif args.stream:
+            with profiling.span("stream") as timing:
+                streaming.run_streaming_pipeline(
+                    data_path=DATA_PATH,
+                    stream_dir=STREAM_DIR,
+                    tfidf_terms_path=os.path.join(STREAM_DIR, "tfidf_terms.csv"),
+                    tfidf_model_path=os.path.join(STREAM_DIR, "models", "tfidf_vectorizer.joblib"),
+                    kmeans_model_path=os.path.join(STREAM_DIR, "models", "kmeans.joblib"),
+                    chunk_size=args.chunk_size,
+                    sample_size=args.sample_size,
+                    batch_size=args.spacy_batch_size,
+                    n_process=args.spacy_n_process,
+                    artifact_format=args.format,
+                    n_clusters=args.n_clusters,
+                    cluster_method=args.cluster_method,
+                    tfidf_mode=args.tfidf_mode,
+                    extractor_jobs=extractor_jobs,
+                    ner_labels=args.ner_labels,
+                    quantise_embeddings=args.quantise_embeddings,
+                    dedup_threshold=dedup_threshold
+                )
+            print(f"Streaming run took {timing.seconds:.2f} seconds.")
+            if cache.get_cache() is not None:
+                cache.get_cache().report()
+        elif args.incremental and not args.refit:
+            run_incremental_pipeline(spacy_batch_size=args.spacy_batch_size, spacy_n_process=args.spacy_n_process,
+                                     n_clusters=args.n_clusters, cluster_method=args.cluster_method,
+                                     freeze_clusters=args.freeze_clusters, tfidf_mode=args.tfidf_mode,
+                                     extractor_jobs=extractor_jobs, ner_labels=args.ner_labels,
+                                     quantise_embeddings=args.quantise_embeddings, dedup_threshold=dedup_threshold)
+        elif args.incremental:
+            run_pipeline("all", spacy_batch_size=args.spacy_batch_size, spacy_n_process=args.spacy_n_process,
+                         n_clusters=args.n_clusters, cluster_method=args.cluster_method, tfidf_mode=args.tfidf_mode,
+                         force=True, max_workers=args.stage_workers, extractor_jobs=extractor_jobs,
+                         ner_labels=args.ner_labels, embedding_dtype=args.embedding_dtype,
+                         quantise_embeddings=args.quantise_embeddings, dedup_threshold=dedup_threshold)
+        else:
+            run_pipeline(args.run, spacy_batch_size=args.spacy_batch_size, spacy_n_process=args.spacy_n_process,
+                         n_clusters=args.n_clusters, cluster_method=args.cluster_method,
+                         freeze_clusters=args.freeze_clusters, tfidf_mode=args.tfidf_mode,
+                         plot_preset=args.plot_preset, plot_jobs=args.plot_jobs,
+                         force=args.force, max_workers=args.stage_workers, extractor_jobs=extractor_jobs,
+                         ner_labels=args.ner_labels, embedding_dtype=args.embedding_dtype,
+                         quantise_embeddings=args.quantise_embeddings, dedup_threshold=dedup_threshold)
+
+    # Per-step timings of this run, machine-readable for tracking throughput across releases
+    recorder = profiling.get_recorder()
+    recorder.print_summary()
+    recorder.write_report(
+        args.report_path, options=vars(args),
+        cache=cache.get_cache().stats() if cache.get_cache() is not None else None
+    )
+    print(f"Run report saved to {args.report_path}.")
@@ -0,0 +1,185 @@
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+DEFAULT_MAX_SIZE_MB = 2048
+
+# SQLite limits the number of bound parameters per statement
+QUERY_CHUNK_SIZE = 500
+
+class NLPCache:
+    '''
+    On-disk cache for expensive per-document NLP results, backed by SQLite.
+    Entries are keyed by a hash of the input text plus the model/pattern version that produced them,
+    and the least recently used entries are evicted once the cache grows past max_size_mb.
+    '''
+    def __init__(self, path, max_size_mb=DEFAULT_MAX_SIZE_MB):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.max_size_bytes = int(max_size_mb * 1024 * 1024)
+        self.hits = Counter()
+        self.misses = Counter()
+        # Feature extractors share the cache from several threads, the lock serialises access to the connection
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, namespace TEXT, value BLOB, size INTEGER, last_used REAL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_results_last_used ON results(last_used)")
+        self.conn.commit()
+
+    def get_many(self, keys):
+        '''
+        Look up the keys, returning a dict of key -> value for the ones found.
+        '''
+        with self.lock:
+            return self._get_many(keys)
+
+    def _get_many(self, keys):
+        found = {}
+        now = time.time()
+        for i in range(0, len(keys), QUERY_CHUNK_SIZE):
+            chunk = keys[i:i + QUERY_CHUNK_SIZE]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.conn.execute(
+                f"SELECT key, value FROM results WHERE key IN ({placeholders})", chunk
+            ).fetchall()
+            for key, value in rows:
+                found[key] = pickle.loads(value)
+            if rows:
+                hit_keys = [key for key, _ in rows]
+                self.conn.execute(
+                    f"UPDATE results SET last_used = ? WHERE key IN ({','.join('?' * len(hit_keys))})",
+                    [now, *hit_keys]
+                )
+        self.conn.commit()
+        return found
+
+    def put_many(self, namespace, items):
+        '''
+        Store a dict of key -> value, then evict old entries if the cache is over its size limit.
+        '''
+        with self.lock:
+            self._put_many(namespace, items)
+
+    def _put_many(self, namespace, items):
+        now = time.time()
+        rows = []
+        for key, value in items.items():
+            blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            rows.append((key, namespace, blob, len(blob), now))
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO results (key, namespace, value, size, last_used) VALUES (?, ?, ?, ?, ?)",
+            rows
+        )
+        self.conn.commit()
+        self.evict()
+
+    def evict(self):
+        '''
+        Drop the least recently used entries until the cache fits in max_size_bytes.
+        '''
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_size_bytes:
+            return
+        to_free = total - self.max_size_bytes
+        freed = 0
+        stale = []
+        for key, size in self.conn.execute("SELECT key, size FROM results ORDER BY last_used"):
+            stale.append(key)
+            freed += size
+            if freed >= to_free:
+                break
+        for i in range(0, len(stale), QUERY_CHUNK_SIZE):
+            chunk = stale[i:i + QUERY_CHUNK_SIZE]
+            self.conn.execute(f"DELETE FROM results WHERE key IN ({','.join('?' * len(chunk))})", chunk)
+        self.conn.commit()
+
+    def count(self, namespace, hits, misses):
+        with self.lock:
+            self.hits[namespace] += hits
+            self.misses[namespace] += misses
+
+    def stats(self):
+        '''
+        Hit/miss counts for each namespace used during this run.
+        '''
+        namespaces = sorted(set(self.hits) | set(self.misses))
+        return {namespace: {"hits": self.hits[namespace], "misses": self.misses[namespace]} for namespace in namespaces}
+
+    def report(self):
+        '''
+        Print hit/miss counts for each namespace used during this run.
+        '''
+        stats = self.stats()
+        if not stats:
+            return
+        print(f"NLP cache ({self.path}):")
+        for namespace, counts in stats.items():
+            hits, misses = counts["hits"], counts["misses"]
+            total = hits + misses
+            rate = hits / total if total else 0.0
+            print(f"- {namespace}: {hits} hits, {misses} misses ({rate:.1%} hit rate)")
+
+    def close(self):
+        self.conn.close()
+
+# The cache used by the pipeline, None when caching is disabled
+_cache = None
+
+def configure_cache(path, max_size_mb=DEFAULT_MAX_SIZE_MB):
+    '''
+    Open the on-disk cache used by cached_map.
+    '''
+    global _cache
+    close_cache()
+    _cache = NLPCache(path, max_size_mb=max_size_mb)
+    return _cache
+
+def close_cache():
+    global _cache
+    if _cache is not None:
+        _cache.close()
+        _cache = None
+
+def get_cache():
+    return _cache
+
+def make_key(namespace, version, text):
+    '''
+    Hash the input text together with the namespace and model/pattern version.
+    '''
+    return hashlib.sha256(f"{namespace}\0{version}\0{text}".encode("utf-8", "surrogatepass")).hexdigest()
+
+def cached_map(namespace, version, texts, compute):
+    '''
+    Apply compute to the texts, only paying for texts that aren't already cached.
+    compute takes a list of texts and returns a list of results in the same order.
+    '''
+    texts = list(texts)
+    if _cache is None:
+        return list(compute(texts))
+
+    keys = [make_key(namespace, version, text) for text in texts]
+    found = _cache.get_many(keys)
+
+    # Each missing text only needs computing once, even if it appears more than once
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key not in found and key not in missing:
+            missing[key] = text
+
+    if missing:
+        results = dict(zip(missing.keys(), compute(list(missing.values()))))
+        _cache.put_many(namespace, results)
+        found.update(results)
+
+    _cache.count(namespace, hits=len(texts) - len(missing), misses=len(missing))
+
+    return [found[key] for key in keys]
@@ -0,0 +1,104 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# Terms kept per cluster and method in the cluster terms table
+TOP_TERMS_PER_CLUSTER = 10
+
+def keyword_counts(cluster_ids, keyword_lists):
+    '''
+    How often each keyword occurs in each cluster, from one pass over the exploded keyword lists.
+    Returns a DataFrame of cluster_id, term and count, sorted by cluster then count, with ties kept
+    in order of first appearance like value_counts.
+    '''
+    exploded = pd.DataFrame({
+        "cluster_id": np.asarray(cluster_ids),
+        "term": list(keyword_lists),
+    }).explode("term").dropna(subset=["term"])
+    counts = exploded.groupby(["cluster_id", "term"], sort=False).size().reset_index(name="count")
+    return counts.sort_values(["cluster_id", "count"], ascending=[True, False], kind="stable").reset_index(drop=True)
+
+def top_keywords_by_cluster(counts, all_cluster_ids, n=5):
+    '''
+    The n most common keywords of every cluster, clusters without any keywords get an empty list.
+    '''
+    top = counts.groupby("cluster_id", sort=False).head(n).groupby("cluster_id")["term"].agg(list).to_dict()
+    return {cluster_id: top.get(cluster_id, []) for cluster_id in pd.unique(np.asarray(all_cluster_ids))}
+
+def cluster_term_sums(cluster_ids, tfidf_matrix, n_clusters):
+    '''
+    Summed TF-IDF weights and document frequencies of every term per cluster, plus the cluster sizes,
+    each from one sparse product with a cluster indicator matrix. Sums from several chunks can be added up.
+    '''
+    cluster_ids = np.asarray(cluster_ids)
+    indicator = sparse.csr_matrix(
+        (np.ones(len(cluster_ids)), (cluster_ids, np.arange(len(cluster_ids)))),
+        shape=(n_clusters, len(cluster_ids))
+    )
+    presence = sparse.csr_matrix(tfidf_matrix, copy=True)
+    presence.data = np.ones_like(presence.data)
+    return (
+        (indicator @ tfidf_matrix).toarray(),
+        (indicator @ presence).toarray(),
+        np.bincount(cluster_ids, minlength=n_clusters),
+    )
+
+def c_tf_idf(doc_freq):
+    '''
+    Class-based TF-IDF: each cluster is treated as one document made of its members' terms.
+    tf is a term's share of the cluster's term occurrences, idf is log(1 + average occurrences per cluster
+    / occurrences of the term across all clusters), so terms common to every cluster score low.
+    '''
+    tf = doc_freq / np.maximum(doc_freq.sum(axis=1, keepdims=True), 1)
+    idf = np.log(1 + doc_freq.sum(axis=1).mean() / np.maximum(doc_freq.sum(axis=0), 1))
+    return tf * idf
+
+def top_terms(scores, terms, method, n=TOP_TERMS_PER_CLUSTER):
+    '''
+    Long-format top n terms with a positive score for every cluster (row of scores).
+    '''
+    terms = np.asarray(terms)
+    rows = []
+    for cluster_id, cluster_scores in enumerate(scores):
+        order = np.argsort(-cluster_scores, kind="stable")[:n]
+        order = order[cluster_scores[order] > 0]
+        rows.append(pd.DataFrame({
+            "cluster_id": cluster_id,
+            "method": method,
+            "rank": np.arange(1, len(order) + 1),
+            "term": terms[order],
+            "score": cluster_scores[order],
+        }))
+    return pd.concat(rows, ignore_index=True) if rows else pd.DataFrame(
+        columns=["cluster_id", "method", "rank", "term", "score"]
+    )
+
+def cluster_term_table(weights, doc_freq, sizes, terms, counts=None, n=TOP_TERMS_PER_CLUSTER):
+    '''
+    Top terms per cluster by three measures, as one long table of cluster_id, method, rank, term and score:
+    "keywords" (most common KeyBERT keywords, score is the count), "tfidf" (highest mean TF-IDF weight)
+    and "ctfidf" (class-based TF-IDF).
+    '''
+    tables = []
+    if counts is not None:
+        keywords = counts.groupby("cluster_id", sort=False).head(n).copy()
+        keywords["rank"] = keywords.groupby("cluster_id").cumcount() + 1
+        keywords["method"] = "keywords"
+        tables.append(keywords.rename(columns={"count": "score"})[["cluster_id", "method", "rank", "term", "score"]])
+    tables.append(top_terms(weights / np.maximum(sizes, 1)[:, None], terms, "tfidf", n))
+    tables.append(top_terms(c_tf_idf(doc_freq), terms, "ctfidf", n))
+    return pd.concat(tables, ignore_index=True)
+
+def cluster_terms(cluster_ids, keyword_lists, tfidf_matrix, terms, n=TOP_TERMS_PER_CLUSTER):
+    '''
+    Cluster term statistics for a whole dataset.
+    Returns the most common keywords of each cluster (dict of cluster_id to list) and the cluster term table.
+    '''
+    cluster_ids = np.asarray(cluster_ids)
+    counts = keyword_counts(cluster_ids, keyword_lists)
+    n_clusters = int(cluster_ids.max()) + 1 if len(cluster_ids) else 0
+    weights, doc_freq, sizes = cluster_term_sums(cluster_ids, tfidf_matrix, n_clusters)
+    return (
+        top_keywords_by_cluster(counts, cluster_ids),
+        cluster_term_table(weights, doc_freq, sizes, terms, counts=counts, n=n),
+    )
@@ -0,0 +1,109 @@
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+
+DEFAULT_N_CLUSTERS = 7
+RANDOM_STATE = 42
+
+# From this many rows "auto" fits with MiniBatchKMeans, which only looks at a batch of rows per step
+MINIBATCH_MIN_ROWS = 200_000
+MINIBATCH_BATCH_SIZE = 4096
+
+# Values of k tried when picking k automatically, each fitted on a sample and scored by silhouette
+K_RANGE = range(4, 16)
+K_SELECTION_SAMPLE_SIZE = 50_000
+SILHOUETTE_SAMPLE_SIZE = 10_000
+
+# Rows assigned to clusters at a time, bounds the rows x clusters distance block
+ASSIGN_CHUNK_SIZE = 100_000
+
+def resolve_method(method, n_rows):
+    if method == "auto":
+        return "minibatch" if n_rows >= MINIBATCH_MIN_ROWS else "kmeans"
+    return method
+
+def make_clusterer(n_clusters=DEFAULT_N_CLUSTERS, method="kmeans"):
+    # sklearn is imported on use so the CLI can read the clustering defaults without loading it
+    from sklearn.cluster import KMeans, MiniBatchKMeans
+    if method == "minibatch":
+        return MiniBatchKMeans(n_clusters=n_clusters, random_state=RANDOM_STATE,
+                               batch_size=MINIBATCH_BATCH_SIZE, n_init=3)
+    return KMeans(n_clusters=n_clusters, random_state=RANDOM_STATE)
+
+def score_k(embeddings, k, method, silhouette_rows):
+    '''
+    Fit k clusters and score them by inertia and a sampled silhouette score.
+    '''
+    from sklearn.metrics import silhouette_score
+    model = make_clusterer(k, method).fit(embeddings)
+    labels = model.labels_[silhouette_rows]
+    silhouette = silhouette_score(embeddings[silhouette_rows], labels) if len(np.unique(labels)) > 1 else -1.0
+    return {"k": k, "inertia": model.inertia_, "silhouette": silhouette}
+
+def select_k(embeddings, k_range=K_RANGE, method="auto", sample_size=K_SELECTION_SAMPLE_SIZE,
+             silhouette_sample_size=SILHOUETTE_SAMPLE_SIZE, n_jobs=-1):
+    '''
+    Pick the number of clusters with the best silhouette score. Every k in k_range is fitted on the same
+    sample of the embeddings, in parallel. Returns the chosen k and the scores for every k.
+    '''
+    rng = np.random.default_rng(RANDOM_STATE)
+    embeddings = np.asarray(embeddings)
+    if len(embeddings) > sample_size:
+        embeddings = embeddings[rng.choice(len(embeddings), sample_size, replace=False)]
+    k_range = [k for k in k_range if k < len(embeddings)]
+    if not k_range:
+        return min(DEFAULT_N_CLUSTERS, len(embeddings)), pd.DataFrame(columns=["k", "inertia", "silhouette"])
+    silhouette_rows = rng.choice(len(embeddings), min(len(embeddings), silhouette_sample_size), replace=False)
+    method = resolve_method(method, len(embeddings))
+
+    scores = pd.DataFrame(Parallel(n_jobs=n_jobs)(
+        delayed(score_k)(embeddings, k, method, silhouette_rows) for k in k_range
+    ))
+    best_k = int(scores.loc[scores["silhouette"].idxmax(), "k"])
+    print(scores.to_string(index=False))
+    print(f"Selected k={best_k} by silhouette score.")
+    return best_k, scores
+
+def assign(model, embeddings, chunk_size=ASSIGN_CHUNK_SIZE):
+    '''
+    Closest cluster and the distance to its centroid for each row, in one pass over the distances.
+    '''
+    labels = np.empty(len(embeddings), dtype=np.int32)
+    distances = np.empty(len(embeddings), dtype=embeddings.dtype)
+    for start in range(0, len(embeddings), chunk_size):
+        block = model.transform(embeddings[start:start + chunk_size])
+        labels[start:start + chunk_size] = block.argmin(axis=1)
+        distances[start:start + chunk_size] = block.min(axis=1)
+    return labels, distances
+
+def centroid_distances(model, embeddings, labels, chunk_size=ASSIGN_CHUNK_SIZE):
+    '''
+    Distance from each row to the centroid of its own cluster, without computing the distances to the others.
+    '''
+    distances = np.empty(len(embeddings), dtype=embeddings.dtype)
+    for start in range(0, len(embeddings), chunk_size):
+        block = slice(start, start + chunk_size)
+        distances[block] = np.linalg.norm(embeddings[block] - model.cluster_centers_[labels[block]], axis=1)
+    return distances
+
+def fit_clusters(embeddings, n_clusters=DEFAULT_N_CLUSTERS, method="auto"):
+    '''
+    Fit a clustering model. n_clusters can be "auto" to pick k with select_k,
+    method is "kmeans", "minibatch" or "auto" (mini-batch for large inputs).
+    '''
+    if n_clusters == "auto":
+        n_clusters, _ = select_k(embeddings, method=method)
+    method = resolve_method(method, len(embeddings))
+    return make_clusterer(n_clusters, method).fit(embeddings)
+
+def fit_assign(embeddings, model=None, n_clusters=DEFAULT_N_CLUSTERS, method="auto"):
+    '''
+    Cluster ids and distances to the closest centroid. A fitted model is kept frozen and only assigns,
+    otherwise a new model is fitted and its final labels are reused. Returns (model, cluster_ids, distances).
+    '''
+    if model is not None:
+        cluster_ids, distances = assign(model, embeddings)
+        return model, cluster_ids, distances
+    model = fit_clusters(embeddings, n_clusters=n_clusters, method=method)
+    cluster_ids = model.labels_.astype(np.int32)
+    return model, cluster_ids, centroid_distances(model, embeddings, cluster_ids)
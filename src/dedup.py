@@ -0,0 +1,180 @@
+import re
+import zlib
+import numpy as np
+import pandas as pd
+
+# Estimated Jaccard similarity of word shingles from which two descriptions count as near-duplicates
+DEFAULT_THRESHOLD = 0.8
+# Hash functions per MinHash signature, the Jaccard estimate has a standard error of ~0.04 at 128
+NUM_PERM = 128
+# Words per shingle
+SHINGLE_SIZE = 3
+# Chance that a pair right at the threshold shares at least one LSH band, the banding is picked to reach it
+LSH_RECALL = 0.95
+# Texts hashed together, and hash functions applied at a time, bounds the shingles x hashes block
+SIGNATURE_BATCH_SIZE = 5000
+PERM_CHUNK_SIZE = 16
+# Candidate pairs compared at a time
+VERIFY_CHUNK_SIZE = 100_000
+# Buckets with up to this many rows compare every pair, larger ones (usually boilerplate) only link each
+# row to the previous and first row of the bucket
+BUCKET_PAIR_CAP = 64
+SEED = 42
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+def shingle_hashes(text, shingle_size=SHINGLE_SIZE):
+    '''
+    32-bit hashes of the distinct word shingles of a text. Texts shorter than one shingle are a single shingle,
+    texts without any words have none.
+    '''
+    words = TOKEN_RE.findall(str(text).lower())
+    if not words:
+        return np.empty(0, dtype=np.uint64)
+    shingles = {" ".join(words[i:i + shingle_size]) for i in range(max(len(words) - shingle_size + 1, 1))}
+    return np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in shingles), dtype=np.uint64)
+
+def minhash_signatures(texts, num_perm=NUM_PERM, shingle_size=SHINGLE_SIZE, seed=SEED):
+    '''
+    MinHash signatures, one row of num_perm uint32 minimums per text.
+    Each hash function is a multiply-shift hash (a * x + b mod 2^64, top 32 bits) of the shingle hashes.
+    Texts without shingles get the maximum value throughout.
+    '''
+    rng = np.random.default_rng(seed)
+    a = rng.integers(0, 2**63, size=num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    b = rng.integers(0, 2**63, size=num_perm, dtype=np.uint64)
+    texts = list(texts)
+    signatures = np.empty((len(texts), num_perm), dtype=np.uint32)
+    for start in range(0, len(texts), SIGNATURE_BATCH_SIZE):
+        hashes = [shingle_hashes(text, shingle_size) for text in texts[start:start + SIGNATURE_BATCH_SIZE]]
+        empty = np.array([len(h) == 0 for h in hashes])
+        # reduceat needs every segment to be non-empty, empty ones are overwritten below
+        hashes = [h if len(h) else np.zeros(1, dtype=np.uint64) for h in hashes]
+        offsets = np.cumsum([0] + [len(h) for h in hashes[:-1]])
+        flat = np.concatenate(hashes)
+        for p in range(0, num_perm, PERM_CHUNK_SIZE):
+            permuted = (a[p:p + PERM_CHUNK_SIZE, None] * flat + b[p:p + PERM_CHUNK_SIZE, None]) >> np.uint64(32)
+            signatures[start:start + len(hashes), p:p + PERM_CHUNK_SIZE] = np.minimum.reduceat(permuted, offsets, axis=1).T
+        signatures[start + np.flatnonzero(empty)] = np.iinfo(np.uint32).max
+    return signatures
+
+def lsh_bands(threshold, num_perm=NUM_PERM, recall=LSH_RECALL):
+    '''
+    (n_bands, rows_per_band) for LSH banding: the most rows per band (fewest false candidates) for which
+    a pair with Jaccard similarity threshold still shares a band with probability recall.
+    '''
+    for rows in range(num_perm, 0, -1):
+        n_bands = num_perm // rows
+        if 1 - (1 - threshold ** rows) ** n_bands >= recall:
+            return n_bands, rows
+    return num_perm, 1
+
+def candidate_pairs(signatures, n_bands, rows_per_band, bucket_pair_cap=BUCKET_PAIR_CAP):
+    '''
+    Pairs of rows that share at least one band of their signatures. Rows of a bucket with up to
+    bucket_pair_cap rows are all paired with each other. In larger buckets each row is only linked to the
+    previous row and the first row of the bucket, so a band adds at most two pairs per row there.
+    '''
+    pairs = []
+    for band in range(n_bands):
+        values = np.ascontiguousarray(signatures[:, band * rows_per_band:(band + 1) * rows_per_band])
+        _, buckets = np.unique(values.view(np.dtype((np.void, values.dtype.itemsize * rows_per_band))),
+                               return_inverse=True)
+        order = np.argsort(buckets.ravel(), kind="stable")
+        sorted_buckets = buckets.ravel()[order]
+        bucket_starts = np.flatnonzero(np.r_[True, sorted_buckets[1:] != sorted_buckets[:-1]])
+        sizes = np.diff(np.r_[bucket_starts, len(order)])
+        # Bucket size and first position of every sorted position, only shared buckets matter
+        size_of = np.repeat(sizes, sizes)
+        start_of = np.repeat(bucket_starts, sizes)
+        shared = np.flatnonzero(size_of > 1)
+        if len(shared) == 0:
+            continue
+        small = shared[size_of[shared] <= bucket_pair_cap]
+        if len(small):
+            offset_in_bucket = small - start_of[small]
+            # Pair every position with the ones k places further on in its bucket
+            for k in range(1, int(size_of[small].max())):
+                ahead = small[offset_in_bucket + k < size_of[small]]
+                pairs.append(np.stack([order[ahead], order[ahead + k]], axis=1))
+        large = shared[(size_of[shared] > bucket_pair_cap) & (shared != start_of[shared])]
+        if len(large):
+            pairs.append(np.stack([order[large - 1], order[large]], axis=1))
+            pairs.append(np.stack([order[start_of[large]], order[large]], axis=1))
+    if not pairs:
+        return np.empty((0, 2), dtype=np.int64)
+    pairs = np.sort(np.concatenate(pairs), axis=1)
+    pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+    return np.unique(pairs, axis=0)
+
+def estimated_jaccard(signatures, pairs):
+    similarity = np.empty(len(pairs), dtype=np.float32)
+    for start in range(0, len(pairs), VERIFY_CHUNK_SIZE):
+        chunk = pairs[start:start + VERIFY_CHUNK_SIZE]
+        similarity[start:start + VERIFY_CHUNK_SIZE] = (signatures[chunk[:, 0]] == signatures[chunk[:, 1]]).mean(axis=1)
+    return similarity
+
+def near_duplicate_groups(texts, threshold=DEFAULT_THRESHOLD, num_perm=NUM_PERM, shingle_size=SHINGLE_SIZE):
+    '''
+    The position of each text's group representative (the group's first text), grouping texts whose
+    estimated Jaccard similarity reaches threshold, directly or through other texts of the group.
+    MinHash + LSH only compares texts that share a band, so the cost grows with the number of
+    candidates rather than the square of the number of texts. Texts without any words stay on their own.
+    '''
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+    signatures = minhash_signatures(texts, num_perm=num_perm, shingle_size=shingle_size)
+    n_rows = len(signatures)
+    if n_rows == 0:
+        return np.empty(0, dtype=np.int64)
+    pairs = candidate_pairs(signatures, *lsh_bands(threshold, num_perm))
+    # Signatures without shingles are all equal, those rows must not be grouped with each other
+    no_shingles = (signatures == np.iinfo(np.uint32).max).all(axis=1)
+    pairs = pairs[~(no_shingles[pairs[:, 0]] | no_shingles[pairs[:, 1]])]
+    pairs = pairs[estimated_jaccard(signatures, pairs) >= threshold]
+    graph = coo_matrix((np.ones(len(pairs), dtype=np.int8), (pairs[:, 0], pairs[:, 1])), shape=(n_rows, n_rows))
+    _, labels = connected_components(graph, directed=False)
+    # np.unique's first occurrence of each label is the lowest row of the group
+    _, first = np.unique(labels, return_index=True)
+    return first[labels].astype(np.int64)
+
+def mark_duplicates(df, threshold=DEFAULT_THRESHOLD, column="cleaned_description"):
+    '''
+    The id of each row's group representative, equal to the row's own id for representatives.
+    '''
+    groups = near_duplicate_groups(df[column].tolist(), threshold=threshold)
+    return pd.Series(df["id"].to_numpy()[groups], index=df.index, name="duplicate_of")
+
+def representatives(df):
+    '''
+    The representative rows of df and, for every row, the position of its representative among them.
+    Returns (df, None) when df has no duplicate_of column or a representative is missing.
+    '''
+    if "duplicate_of" not in df.columns:
+        return df, None
+    is_representative = (df["duplicate_of"] == df["id"]).to_numpy()
+    unique = df[is_representative]
+    members = pd.Index(unique["id"]).get_indexer(df["duplicate_of"])
+    if (members < 0).any():
+        return df, None
+    return unique, members
+
+def fan_out(processed, df):
+    '''
+    Copy the columns computed for the representatives (processed) to every member of their group in df.
+    '''
+    positions = pd.Index(processed["id"]).get_indexer(df["duplicate_of"])
+    if (positions < 0).any():
+        raise ValueError("Every duplicate_of id must be a processed representative")
+    new_columns = [col for col in processed.columns if col not in df.columns]
+    return pd.concat([df, processed[new_columns].iloc[positions].set_index(df.index)], axis=1)
+
+def own_entities(entity_lists, texts):
+    '''
+    The (label, text) entities of each row that occur in the row's own text. Group members share their
+    representative's parse, this drops the entities only the representative's description mentions.
+    '''
+    return [
+        [(label, entity) for label, entity in entities if entity in str(text)]
+        for entities, text in zip(entity_lists, texts)
+    ]
@@ -0,0 +1,122 @@
+import numpy as np
+
+# Token length bounds of the buckets, texts are batched with others of a similar length so little of
+# each batch is padding. MiniLM truncates at 256 tokens, longer texts fall in the last bucket
+LENGTH_BUCKETS = [16, 32, 64, 128, 256]
+# Tokens per batch, so short texts go through in large batches and long texts in small ones
+BATCH_TOKENS = 8192
+# Texts encoded with both the quantised and the float32 model to measure the drift between them
+DRIFT_SAMPLE_SIZE = 256
+
+class EmbeddingEngine:
+    '''
+    CPU sentence embeddings from a SentenceTransformer, batched by token length.
+
+    Texts are tokenised once, grouped into LENGTH_BUCKETS by token length, and each bucket is encoded
+    in batches of about batch_tokens tokens (sorted by length, so each batch pads to its own longest
+    text). Embeddings come back in the order of the input texts.
+    With quantise the linear layers run with dynamic int8 quantisation, use measure_drift to check
+    how far the embeddings move from the float32 model. drift holds the first measurement reported.
+    '''
+    def __init__(self, model, quantise=False, n_threads=None, batch_tokens=BATCH_TOKENS, buckets=LENGTH_BUCKETS):
+        import torch
+        self.reference = model
+        self.quantise = quantise
+        self.n_threads = n_threads
+        self.batch_tokens = batch_tokens
+        self.buckets = list(buckets)
+        self.drift = None
+        if quantise:
+            import copy
+            # Quantise a copy, the float32 model is still shared with the rest of the pipeline
+            model = torch.ao.quantization.quantize_dynamic(copy.deepcopy(model), {torch.nn.Linear}, dtype=torch.qint8)
+        self.model = model.eval()
+
+    @property
+    def version(self):
+        '''
+        Identifies the embeddings this engine produces, for cache keys.
+        '''
+        from src.models import BERT_MODEL_NAME
+        return f"{BERT_MODEL_NAME}-int8" if self.quantise else BERT_MODEL_NAME
+
+    @property
+    def dimension(self):
+        return self.model.get_sentence_embedding_dimension()
+
+    def tokenize(self, texts):
+        '''
+        Unpadded token ids of the texts, truncated as the model's own tokenize does.
+        '''
+        return self.model.tokenizer(
+            [text.strip() for text in texts], truncation="longest_first", max_length=self.model.max_seq_length
+        )
+
+    def pad(self, encoded, rows):
+        '''
+        Model inputs for a batch of rows of tokenize's output, padded to the batch's longest text.
+        '''
+        batch = {key: [values[i] for i in rows] for key, values in encoded.items()}
+        return dict(self.model.tokenizer.pad(batch, return_tensors="pt"))
+
+    def batches(self, lengths):
+        '''
+        Row positions of each batch: rows bucketed by token length, sorted within the bucket,
+        and cut so each batch holds about batch_tokens tokens.
+        '''
+        order = np.argsort(lengths, kind="stable")
+        bucket_of = np.searchsorted(self.buckets, lengths[order])
+        for bucket in np.unique(bucket_of):
+            rows = order[bucket_of == bucket]
+            width = self.buckets[min(bucket, len(self.buckets) - 1)]
+            batch_size = max(self.batch_tokens // width, 1)
+            for start in range(0, len(rows), batch_size):
+                yield rows[start:start + batch_size]
+
+    def encode(self, texts, n_threads=None):
+        '''
+        float32 embeddings of the texts, one row per text in input order.
+        n_threads sets torch's intra-op threads for this call (defaults to the engine's n_threads),
+        the previous setting is restored afterwards.
+        '''
+        import torch
+        texts = [str(text) for text in texts]
+        out = np.empty((len(texts), self.dimension), dtype=np.float32)
+        if not texts:
+            return out
+        encoded = self.tokenize(texts)
+        lengths = np.array([len(ids) for ids in encoded["input_ids"]], dtype=np.int64)
+        n_threads = n_threads or self.n_threads
+        previous_threads = torch.get_num_threads()
+        if n_threads:
+            torch.set_num_threads(n_threads)
+        try:
+            with torch.inference_mode():
+                for rows in self.batches(lengths):
+                    embeddings = self.model(self.pad(encoded, rows))["sentence_embedding"]
+                    # Scattering back by position restores the input order
+                    out[rows] = embeddings.float().cpu().numpy()
+        finally:
+            torch.set_num_threads(previous_threads)
+        return out
+
+    def measure_drift(self, texts, sample_size=DRIFT_SAMPLE_SIZE, seed=42):
+        '''
+        Cosine similarity between this engine's embeddings and the float32 model's on a sample of the texts.
+        Returns a dict with the mean, min and 1st percentile similarity and the number of texts compared.
+        '''
+        texts = list(texts)
+        if len(texts) > sample_size:
+            rng = np.random.default_rng(seed)
+            texts = [texts[i] for i in rng.choice(len(texts), size=sample_size, replace=False)]
+        if not texts:
+            return {"mean": 1.0, "min": 1.0, "p01": 1.0, "n_texts": 0}
+        reference = EmbeddingEngine(self.reference, batch_tokens=self.batch_tokens, buckets=self.buckets)
+        ours, theirs = self.encode(texts), reference.encode(texts)
+        similarity = np.einsum("ij,ij->i", ours, theirs) / np.maximum(
+            np.linalg.norm(ours, axis=1) * np.linalg.norm(theirs, axis=1), 1e-12
+        )
+        return {
+            "mean": float(similarity.mean()), "min": float(similarity.min()),
+            "p01": float(np.percentile(similarity, 1)), "n_texts": len(texts),
+        }
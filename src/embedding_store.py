@@ -0,0 +1,143 @@
+import os
+import numpy as np
+
+# Storage dtypes, float16 halves the file and int8 quarters it (with a float32 scale per dimension)
+STORE_DTYPES = ["float32", "float16", "int8"]
+# Rows copied or dequantised together, bounds the memory used by appends and full reads
+STORE_BLOCK_SIZE = 65_536
+
+def sidecar_path(path, name):
+    '''
+    Path of a file stored next to the embeddings, e.g. sentence_embeddings.ids.npy.
+    '''
+    stem, _ = os.path.splitext(path)
+    return f"{stem}.{name}.npy"
+
+def quantise(vectors, dtype="float32", scales=None):
+    '''
+    Convert float vectors to the storage dtype. int8 uses symmetric per-dimension scales,
+    fitted on vectors unless existing scales are passed in (values outside their range are clipped).
+    Returns the stored values and the scales (None unless int8).
+    '''
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if dtype != "int8":
+        return vectors.astype(dtype), None
+    if scales is None:
+        scales = np.maximum(np.abs(vectors).max(axis=0) if len(vectors) else np.ones(vectors.shape[1]), 1e-12) / 127
+        scales = scales.astype(np.float32)
+    return np.clip(np.rint(vectors / scales), -127, 127).astype(np.int8), scales
+
+class EmbeddingStore:
+    '''
+    Sentence embeddings in a .npy file opened with mmap_mode, with the company id of each row next to it.
+
+    The file holds float32, float16 or int8 values, and rows are only converted back to float32 when
+    they are read, so several processes can share one copy through the page cache.
+    store[rows] and store.get(ids) return float32 arrays, store.values is the raw memory-mapped array.
+    '''
+    def __init__(self, path, mmap_mode="r"):
+        self.path = path
+        self.mmap_mode = mmap_mode
+        self.values = np.load(path, mmap_mode=mmap_mode)
+        self.ids = np.load(sidecar_path(path, "ids"))
+        self.scales = np.load(sidecar_path(path, "scales")) if self.values.dtype == np.int8 else None
+        # Sorted ids for vectorised id -> row lookups
+        self.order = np.argsort(self.ids, kind="stable")
+        self.sorted_ids = self.ids[self.order]
+
+    def __len__(self):
+        return len(self.values)
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    @property
+    def dtype(self):
+        return str(self.values.dtype)
+
+    def dequantise(self, values):
+        values = np.asarray(values, dtype=np.float32)
+        return values * self.scales if self.scales is not None else values
+
+    def __getitem__(self, rows):
+        return self.dequantise(self.values[rows])
+
+    def lookup(self, ids):
+        '''
+        Row positions of the given company ids, raising KeyError for unknown ids.
+        '''
+        ids = np.asarray(ids)
+        positions = np.searchsorted(self.sorted_ids, ids)
+        positions = np.minimum(positions, max(len(self.sorted_ids) - 1, 0))
+        found = (self.sorted_ids[positions] == ids) if len(self.sorted_ids) else np.zeros(len(ids), dtype=bool)
+        if not found.all():
+            raise KeyError(f"Ids not in the embedding store: {ids[~found][:10].tolist()}")
+        return self.order[positions]
+
+    def get(self, ids):
+        '''
+        float32 embeddings of the given company ids.
+        '''
+        return self[self.lookup(ids)]
+
+    def to_array(self):
+        '''
+        Every row as float32. For float32 stores this is the memory-mapped array itself, without a copy.
+        '''
+        if self.values.dtype == np.float32:
+            return self.values
+        out = np.empty(self.values.shape, dtype=np.float32)
+        for start in range(0, len(self), STORE_BLOCK_SIZE):
+            out[start:start + STORE_BLOCK_SIZE] = self[start:start + STORE_BLOCK_SIZE]
+        return out
+
+    def append(self, ids, vectors):
+        '''
+        Add rows to the end of the store, quantised like the existing rows.
+        The file is rewritten block by block into a new file, so memory stays bounded, then swapped in.
+        '''
+        values, _ = quantise(vectors, self.dtype, scales=self.scales)
+        n_old = len(self)
+        tmp_path = f"{os.path.splitext(self.path)[0]}.tmp.npy"
+        out = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=self.values.dtype,
+                                        shape=(n_old + len(values), self.values.shape[1]))
+        for start in range(0, n_old, STORE_BLOCK_SIZE):
+            stop = min(start + STORE_BLOCK_SIZE, n_old)
+            out[start:stop] = self.values[start:stop]
+        out[n_old:] = values
+        out.flush()
+        del out
+        self.values = None
+        os.replace(tmp_path, self.path)
+        np.save(sidecar_path(self.path, "ids"), np.concatenate([self.ids, np.asarray(ids, dtype=self.ids.dtype)]))
+        self.__init__(self.path, mmap_mode=self.mmap_mode)
+
+def write_store(path, ids, vectors, dtype="float32"):
+    '''
+    Save embeddings and their company ids as an embedding store, quantised to dtype.
+    The values are written to a new file that replaces any existing one, so stores already open on the
+    path (e.g. the one an incremental run merged from) keep reading the old rows rather than a truncated file.
+    '''
+    if dtype not in STORE_DTYPES:
+        raise ValueError(f"Unknown embedding dtype {dtype!r}, expected one of {STORE_DTYPES}")
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    values, scales = quantise(vectors, dtype)
+    tmp_path = f"{os.path.splitext(path)[0]}.tmp.npy"
+    np.save(tmp_path, values)
+    os.replace(tmp_path, path)
+    np.save(sidecar_path(path, "ids"), np.asarray(ids, dtype=np.int64))
+    if scales is not None:
+        np.save(sidecar_path(path, "scales"), scales)
+    elif os.path.exists(sidecar_path(path, "scales")):
+        os.remove(sidecar_path(path, "scales"))
+
+def open_store(path, mmap_mode="r"):
+    '''
+    Open an embedding store, if it exists
+    '''
+    try:
+        return EmbeddingStore(path, mmap_mode=mmap_mode)
+    except FileNotFoundError:
+        return None
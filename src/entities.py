@@ -0,0 +1,169 @@
+import numpy as np
+import pandas as pd
+
+# Entity labels that get their own feature columns
+NER_LABELS = ["ORG", "MONEY", "DATE", "GPE"]
+
+class EntitySpans:
+    '''
+    The named entities of every document in a flat ragged layout.
+
+    Document i owns entities doc_offsets[i]:doc_offsets[i + 1]. Entity j has the label
+    labels[label_codes[j]] and the text text_pool[text_offsets[j]:text_offsets[j + 1]] (UTF-8 bytes).
+    Every array is a plain numpy array, so the spans save to .npz as is and slices are views.
+    '''
+    def __init__(self, doc_offsets, label_codes, labels, text_offsets, text_pool):
+        self.doc_offsets = np.asarray(doc_offsets, dtype=np.int64)
+        self.label_codes = np.asarray(label_codes, dtype=np.int16)
+        self.labels = [str(label) for label in labels]
+        self.text_offsets = np.asarray(text_offsets, dtype=np.int64)
+        self.text_pool = np.asarray(text_pool, dtype=np.uint8)
+
+    @classmethod
+    def from_lists(cls, label_lists, text_lists):
+        '''
+        Build from one list of labels and one list of entity texts per document.
+        '''
+        labels, codes, encoded, doc_offsets = {}, [], [], [0]
+        for doc_labels, doc_texts in zip(label_lists, text_lists):
+            for label, text in zip(doc_labels, doc_texts):
+                codes.append(labels.setdefault(label, len(labels)))
+                encoded.append(str(text).encode("utf-8"))
+            doc_offsets.append(len(codes))
+        text_offsets = cumulative_offsets(np.array([len(text) for text in encoded], dtype=np.int64))
+        text_pool = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return cls(doc_offsets, codes, list(labels), text_offsets, text_pool)
+
+    @classmethod
+    def from_entities(cls, entity_lists):
+        '''
+        Build from one list of (label, text) pairs per document.
+        '''
+        entity_lists = [list(entities) for entities in entity_lists]
+        return cls.from_lists(
+            [[label for label, _ in entities] for entities in entity_lists],
+            [[text for _, text in entities] for entities in entity_lists]
+        )
+
+    def __len__(self):
+        return len(self.doc_offsets) - 1
+
+    @property
+    def n_entities(self):
+        return len(self.label_codes)
+
+    def doc_index(self):
+        '''
+        The document of each entity.
+        '''
+        return np.repeat(np.arange(len(self)), np.diff(self.doc_offsets))
+
+    def text(self, j):
+        return self.text_pool[self.text_offsets[j]:self.text_offsets[j + 1]].tobytes().decode("utf-8")
+
+    def doc(self, i):
+        '''
+        The (label, text) pairs of document i.
+        '''
+        return [(self.labels[self.label_codes[j]], self.text(j))
+                for j in range(self.doc_offsets[i], self.doc_offsets[i + 1])]
+
+    def slice(self, start, stop):
+        '''
+        Documents start:stop. The label codes and text pool are views into this instance.
+        '''
+        first, last = self.doc_offsets[start], self.doc_offsets[stop]
+        return EntitySpans(
+            self.doc_offsets[start:stop + 1] - first, self.label_codes[first:last], self.labels,
+            self.text_offsets[first:last + 1] - self.text_offsets[first],
+            self.text_pool[self.text_offsets[first]:self.text_offsets[last]]
+        )
+
+    def take(self, rows):
+        '''
+        The given documents, in the given order (a boolean mask or positions).
+        '''
+        rows = np.flatnonzero(rows) if np.asarray(rows).dtype == bool else np.asarray(rows, dtype=np.int64)
+        counts = self.doc_offsets[rows + 1] - self.doc_offsets[rows]
+        entities = concat_ranges(self.doc_offsets[rows], counts)
+        lengths = self.text_offsets[entities + 1] - self.text_offsets[entities]
+        return EntitySpans(
+            cumulative_offsets(counts), self.label_codes[entities], self.labels,
+            cumulative_offsets(lengths), self.text_pool[concat_ranges(self.text_offsets[entities], lengths)]
+        )
+
+    def save(self, path):
+        np.savez(
+            path, doc_offsets=self.doc_offsets, label_codes=self.label_codes, labels=np.array(self.labels, dtype=str),
+            text_offsets=self.text_offsets, text_pool=self.text_pool
+        )
+
+def cumulative_offsets(lengths):
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets
+
+def concat_ranges(starts, lengths):
+    '''
+    np.arange(start, start + length) for each pair, concatenated.
+    '''
+    ends = np.cumsum(lengths, dtype=np.int64)
+    if len(ends) == 0 or ends[-1] == 0:
+        return np.empty(0, dtype=np.int64)
+    return np.arange(ends[-1]) - np.repeat(ends - lengths, lengths) + np.repeat(starts, lengths)
+
+def read_spans(path):
+    '''
+    Read entity spans saved with EntitySpans.save, if they exist
+    '''
+    try:
+        with np.load(path) as data:
+            return EntitySpans(
+                data["doc_offsets"], data["label_codes"], data["labels"].tolist(),
+                data["text_offsets"], data["text_pool"]
+            )
+    except FileNotFoundError:
+        return None
+
+def concat_spans(parts, labels=None):
+    '''
+    Stack the documents of several EntitySpans, remapping their label codes onto one label list.
+    '''
+    labels = list(labels or [])
+    lookup = {label: code for code, label in enumerate(labels)}
+    doc_offsets, codes, text_offsets, pools = [np.zeros(1, dtype=np.int64)], [], [np.zeros(1, dtype=np.int64)], []
+    n_entities, n_bytes = 0, 0
+    for part in parts:
+        remap = np.array([lookup.setdefault(label, len(lookup)) for label in part.labels], dtype=np.int16)
+        doc_offsets.append(part.doc_offsets[1:] + n_entities)
+        codes.append(remap[part.label_codes] if len(remap) else part.label_codes)
+        text_offsets.append(part.text_offsets[1:] + n_bytes)
+        pools.append(part.text_pool)
+        n_entities += part.n_entities
+        n_bytes += len(part.text_pool)
+    return EntitySpans(
+        np.concatenate(doc_offsets), np.concatenate(codes) if codes else np.empty(0, dtype=np.int16), list(lookup),
+        np.concatenate(text_offsets), np.concatenate(pools) if pools else np.empty(0, dtype=np.uint8)
+    )
+
+def ner_features(spans, labels=NER_LABELS, index=None):
+    '''
+    Typed NER feature columns: has_<label> (bool), num_<label> (int32) and first_<label> (categorical)
+    for each label of interest, plus num_entities.
+    '''
+    n_docs = len(spans)
+    doc_index = spans.doc_index()
+    columns = {}
+    for label in labels:
+        code = spans.labels.index(label) if label in spans.labels else -1
+        matches = np.flatnonzero(spans.label_codes == code)
+        counts = np.bincount(doc_index[matches], minlength=n_docs).astype(np.int32)
+        # Entities are in document order, so the first match of each document is its first entity
+        docs, first = np.unique(doc_index[matches], return_index=True)
+        values = np.full(n_docs, None, dtype=object)
+        values[docs] = [spans.text(j) for j in matches[first]]
+        columns[f"has_{label.lower()}"] = counts > 0
+        columns[f"num_{label.lower()}"] = counts
+        columns[f"first_{label.lower()}"] = pd.Categorical(values)
+    columns["num_entities"] = np.diff(spans.doc_offsets).astype(np.int32)
+    return pd.DataFrame(columns, index=index)
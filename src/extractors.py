@@ -0,0 +1,101 @@
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+from src.profiling import span
+
+# Texts per task sent to a worker process
+PROCESS_CHUNK_SIZE = 2000
+
+def spawn_pool(max_workers):
+    '''
+    A ProcessPoolExecutor whose workers are spawned rather than forked. The pipeline runs stages and the
+    memory sampler in threads and may have torch loaded, and forking a process with threads can deadlock
+    the child on a lock some other thread held. Submitted functions must be module-level.
+    '''
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+
+class Extractor:
+    '''
+    A feature extractor. compute(df, upstream, runner) returns a dict with one value per name in outputs
+    (a column, a matrix, a fitted model...), upstream holds the outputs of the extractors it requires.
+
+    executor is "thread" for work that releases the GIL (torch, BLAS) or "process" for GIL-bound work
+    such as spaCy, and n_jobs is its core budget (None leaves it to the library). Either way compute runs
+    in a scheduler thread and hands its per-text work to runner.map, which spreads it over n_jobs worker
+    processes for "process".
+    '''
+    def __init__(self, name, compute, outputs, requires=(), executor="thread", n_jobs=1):
+        self.name = name
+        self.compute = compute
+        self.outputs = list(outputs)
+        self.requires = list(requires)
+        self.executor = executor
+        self.n_jobs = n_jobs
+
+class Runner:
+    '''
+    Runs an extractor's per-text work in-process, or across worker processes.
+    '''
+    def __init__(self, executor="thread", n_jobs=1, chunk_size=PROCESS_CHUNK_SIZE):
+        self.executor = executor
+        self.n_jobs = n_jobs
+        self.chunk_size = chunk_size
+
+    def map(self, func, texts, **kwargs):
+        '''
+        func(texts, **kwargs) for a list of texts, returning one result per text in order.
+        With the process executor func must be a module-level function.
+        '''
+        texts = list(texts)
+        chunks = [texts[i:i + self.chunk_size] for i in range(0, len(texts), self.chunk_size)]
+        if self.executor != "process" or (self.n_jobs or 1) <= 1 or len(chunks) <= 1:
+            return list(func(texts, **kwargs))
+        with spawn_pool(min(self.n_jobs, len(chunks))) as executor:
+            futures = [executor.submit(func, chunk, **kwargs) for chunk in chunks]
+            return [result for future in futures for result in future.result()]
+
+def run_extractors(df, extractors, n_jobs=None):
+    '''
+    Run the extractors concurrently, each as soon as the ones it requires are done.
+    n_jobs overrides the core budget of extractors by name.
+    Returns a dict of every output, in the order the extractors and their outputs are declared,
+    whichever finished first. Each extractor is timed as the span features.<name>.
+    '''
+    n_jobs = n_jobs or {}
+    by_name = {extractor.name: extractor for extractor in extractors}
+    for extractor in extractors:
+        missing = [name for name in extractor.requires if name not in by_name]
+        if missing:
+            raise ValueError(f"Extractor {extractor.name} requires unknown extractors {missing}")
+
+    results = {}
+    pending, running = list(extractors), {}
+
+    def run(extractor):
+        upstream = {}
+        for name in extractor.requires:
+            upstream.update(results[name])
+        runner = Runner(extractor.executor, n_jobs.get(extractor.name, extractor.n_jobs))
+        with span(f"features.{extractor.name}", n_docs=len(df)):
+            outputs = extractor.compute(df, upstream, runner)
+        unexpected = set(outputs) ^ set(extractor.outputs)
+        if unexpected:
+            raise ValueError(f"Extractor {extractor.name} returned {sorted(outputs)}, expected {extractor.outputs}")
+        return outputs
+
+    with ThreadPoolExecutor(max_workers=max(len(extractors), 1)) as executor:
+        while pending or running:
+            ready = [extractor for extractor in pending if all(name in results for name in extractor.requires)]
+            for extractor in ready:
+                pending.remove(extractor)
+                running[executor.submit(run, extractor)] = extractor.name
+            if not running:
+                raise ValueError(f"Extractors {[extractor.name for extractor in pending]} have circular requirements")
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[running.pop(future)] = future.result()
+
+    merged = {}
+    for extractor in extractors:
+        for name in extractor.outputs:
+            merged[name] = results[extractor.name][name]
+    return merged
@@ -1,84 +1,273 @@
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.cluster import KMeans
-from sentence_transformers import SentenceTransformer
-import spacy
+from sklearn.feature_extraction.text import TfidfVectorizer, CountVectorizer
+from sklearn.preprocessing import normalize
 import pandas as pd
-from keybert import KeyBERT
-import json
+import numpy as np
+from src.preprocess_utils import pipe_docs, SPACY_BATCH_SIZE, SPACY_N_PROCESS
+from src.models import get_embedding_engine, SPACY_MODEL_VERSION
+from src.cache import cached_map
+from src import similarity, clustering, cluster_terms, incremental, dedup
+from src.tfidf import HashingTfidfVectorizer, MAX_FEATURES, NGRAM_RANGE, STOP_WORDS
+from src.extractors import Extractor, run_extractors
+from src.entities import EntitySpans, NER_LABELS, ner_features
+from src.profiling import span
 
-# TODO: Analyse, understand and improve the below code
+# Number of documents scored together when ranking keyword candidates
+KEYWORD_SCORING_CHUNK_SIZE = 2048
 
-# Load NLP models
-nlp = spacy.load("en_core_web_sm")
-bert_model = SentenceTransformer("all-MiniLM-L6-v2")
-kw_model = KeyBERT(model=bert_model)
+# Versions used to key cached results, bump these when the extraction settings change.
+# Embeddings and keywords are keyed by the embedding engine's version, which differs when quantised
+KEYWORDS_VERSION = "keybert-{embeddings}-ngram1_2-top5"
 
-def feature_engineering(df):
+def feature_engineering(df, tfidf_vectorizer=None, kmeans=None, similarity_index=None,
+                        tfidf_mode="vocabulary", n_clusters=clustering.DEFAULT_N_CLUSTERS, cluster_method="auto",
+                        batch_size=SPACY_BATCH_SIZE, n_process=SPACY_N_PROCESS, extractor_jobs=None,
+                        ner_labels=NER_LABELS, quantise_embeddings=False):
+    '''
+    Generate the features for the preprocessed data.
+    If a fitted tfidf_vectorizer or kmeans model is passed in it is kept frozen (transform/predict only),
+    otherwise a new one is fitted on df: a tfidf_mode ("vocabulary" or "hashing") vectorizer, and
+    n_clusters clusters ("auto" to pick k) using cluster_method.
+    If a similarity_index is passed in the rows of df are added to it and their most similar companies
+    are searched across the whole index, otherwise a new index is built on df.
+    TF-IDF, NER, embeddings and keywords run concurrently, extractor_jobs sets their core budgets by name.
+    NER adds typed feature columns for each of ner_labels, the entities themselves go to features["entity_spans"].
+    quantise_embeddings encodes with int8 linear layers (see embedding_engine.EmbeddingEngine).
+    Rows marked as near-duplicates in duplicate_of get the TF-IDF, embeddings, keywords and cluster of
+    their group's representative, but keep their own entities.
+    '''
     features = {}
 
-    # TF-IDF - extract keywords and phrases based on counts
-    tfidf_vectorizer = TfidfVectorizer(max_features=1000, stop_words="english", ngram_range=(1, 2))
-    tfidf_matrix = tfidf_vectorizer.fit_transform(df["lemmatized_description"])
-    features["tfidf_matrix"] = tfidf_matrix
-    features["tfidf_terms"] = tfidf_vectorizer.get_feature_names_out()
+    # Features are only computed once per group of near-duplicate descriptions
+    unique, members = dedup.representatives(df)
 
-    # NER-based features - extract named entities
-    ner_df = df["cleaned_description"].apply(extract_ner_features).apply(pd.Series)
+    # TF-IDF and the per-document features (NER, sentence embeddings, keywords) don't depend on each other
+    extractors = [
+        tfidf_extractor(tfidf_vectorizer, tfidf_mode),
+        *document_extractors(batch_size, n_process, ner_labels, quantise_embeddings)
+    ]
+    outputs = run_extractors(unique, extractors, n_jobs=extractor_jobs)
 
-    # KeyBERT keywords - extract keywords and phrases based on semantic similarity
-    df["top_keywords"] = df["lemmatized_description"].apply(lambda x: kw_model.extract_keywords(x, keyphrase_ngram_range=(1, 2), stop_words='english', top_n=5))
-    df["top_keywords"] = df["top_keywords"].apply(lambda x: [kw[0] for kw in x])
-    df["keyword_text"] = df["top_keywords"].apply(lambda x: " ".join(x))
+    # Clustering - apply KMeans clustering to the embeddings to group similar descriptions.
+    # Distances allow for outlier detection or some sort of niche scoring.
+    # Fitted on one row per group, so duplicated descriptions don't pull the centroids towards them
+    with span("features.kmeans", n_docs=len(unique)):
+        kmeans, cluster_ids, distances = clustering.fit_assign(
+            outputs["embeddings"], model=kmeans, n_clusters=n_clusters, method=cluster_method
+        )
+    features["kmeans"] = kmeans
+    outputs = fan_out_outputs({**outputs, "cluster_ids": cluster_ids, "distances": distances}, members, df, ner_labels)
 
-    # Sentence embeddings - extract semantic embeddings for cluster analysis
-    embeddings = bert_model.encode(df["lemmatized_description"], show_progress_bar=False)
+    # TF-IDF - extract keywords and phrases based on counts
+    tfidf_matrix = outputs["tfidf_matrix"]
+    features["tfidf_matrix"] = tfidf_matrix
+    features["tfidf_terms"] = outputs["tfidf_terms"]
+    features["tfidf_vectorizer"] = outputs["tfidf_vectorizer"]
+
+    df, ner_df, features["entity_spans"], embeddings = add_document_features(df, outputs)
     features["embeddings"] = embeddings
 
-    # Clustering - apply KMeans clustering to the embeddings to group similar descriptions
-    kmeans = KMeans(n_clusters=7, random_state=42)
-    cluster_ids = kmeans.fit_predict(embeddings)
-    # Get distances to allow for outlier detection or some sort of niche scoring
-    distances = kmeans.transform(embeddings).min(axis=1)
+    df["cluster_id"] = outputs["cluster_ids"]
+    df["distance_to_centroid"] = outputs["distances"]
 
-    df["cluster_id"] = cluster_ids
-    df["distance_to_centroid"] = distances
+    # Similarity - most similar other company by cosine similarity of the embeddings
+    with span("features.similarity", n_docs=len(df)):
+        if similarity_index is None:
+            similarity_index = similarity.build_index(df["id"], embeddings)
+        else:
+            similarity_index.add(df["id"], embeddings)
+        features["similarity_index"] = similarity_index
+        df = similarity.add_most_similar(df, similarity_index)
 
     # Add on cluster top words for each cluster for filtering/sorting downstream
-    cluster_top_keywords = (
-        df.groupby("cluster_id")["top_keywords"]
-        .apply(lambda lists: pd.Series(lists.sum()).value_counts().head(5).index.tolist())
-        .to_dict()
-    )
-    df["cluster_top_keywords"] = df["cluster_id"].map(cluster_top_keywords)
+    with span("features.cluster_terms", n_docs=len(df)):
+        df, features["cluster_terms"] = add_cluster_terms(df, tfidf_matrix, features["tfidf_terms"])
 
     df = pd.concat([df, ner_df], axis=1)
     features["df"] = df
 
     return features
 
-def extract_ner_features(text):
-    doc = nlp(text)
-    ents = [(ent.label_, ent.text) for ent in doc.ents]
-
-    # Collect presence and first-example features
-    labels_of_interest = ["ORG", "MONEY", "DATE", "GPE"]
-    counts = {label: 0 for label in labels_of_interest}
-    firsts = {label: None for label in labels_of_interest}
-
-    for label, value in ents:
-        if label in counts:
-            counts[label] += 1
-            if firsts[label] is None:
-                firsts[label] = value
-
-    # Assemble final feature set
-    features = {
-        f"has_{label.lower()}": counts[label] > 0 for label in labels_of_interest
-    }
-    features.update({
-        f"first_{label.lower()}": firsts[label] for label in labels_of_interest
-    })
-    features["num_entities"] = len(ents)
-    features["first_10_entities_json"] = json.dumps(ents[:10])
+def make_tfidf_vectorizer(mode="vocabulary"):
+    '''
+    "vocabulary" builds the full n-gram vocabulary in memory, "hashing" hashes terms chunk by chunk
+    and only keeps running per-bucket statistics, for corpora where the vocabulary doesn't fit.
+    '''
+    if mode == "hashing":
+        return HashingTfidfVectorizer(max_features=MAX_FEATURES, ngram_range=NGRAM_RANGE, stop_words=STOP_WORDS)
+    return TfidfVectorizer(max_features=MAX_FEATURES, stop_words=STOP_WORDS, ngram_range=NGRAM_RANGE)
 
-    return features
+def tfidf_extractor(tfidf_vectorizer=None, tfidf_mode="vocabulary"):
+    '''
+    TF-IDF over the lemmatized descriptions, fitting a new tfidf_mode vectorizer unless a fitted one is passed in.
+    '''
+    def compute(df, upstream, runner):
+        if tfidf_vectorizer is None:
+            vectorizer = make_tfidf_vectorizer(tfidf_mode)
+            matrix = vectorizer.fit_transform(df["lemmatized_description"])
+        else:
+            vectorizer = tfidf_vectorizer
+            matrix = vectorizer.transform(df["lemmatized_description"])
+        return {"tfidf_matrix": matrix, "tfidf_terms": vectorizer.get_feature_names_out(), "tfidf_vectorizer": vectorizer}
+    return Extractor("tfidf", compute, outputs=["tfidf_matrix", "tfidf_terms", "tfidf_vectorizer"])
+
+def document_extractors(batch_size=SPACY_BATCH_SIZE, n_process=SPACY_N_PROCESS, ner_labels=NER_LABELS,
+                        quantise_embeddings=False):
+    '''
+    Extractors for the features that only depend on each document itself: NER (with feature columns for
+    ner_labels), sentence embeddings and keywords (which reuse the embeddings).
+    spaCy NER is spread over n_process worker processes, embeddings use the int8 engine with quantise_embeddings.
+    '''
+    def ner(df, upstream, runner):
+        # Reuse the entities from the preprocessing parse where available
+        if "entity_labels" in df.columns:
+            lists = incremental.parse_list_columns(df[["entity_labels", "entity_texts"]].copy())
+            spans = EntitySpans.from_lists(lists["entity_labels"], lists["entity_texts"])
+        else:
+            spans = EntitySpans.from_entities(cached_map(
+                "entities", SPACY_MODEL_VERSION, df["cleaned_description"],
+                lambda texts: runner.map(extract_entities_batch, texts, batch_size=batch_size)
+            ))
+        return {"ner_df": ner_features(spans, labels=ner_labels, index=df.index), "entity_spans": spans}
+
+    def embeddings(df, upstream, runner):
+        # Sentence embeddings - extract semantic embeddings for cluster analysis
+        engine = get_embedding_engine(quantise_embeddings)
+        embeddings = np.asarray(cached_map(
+            "embeddings", engine.version, df["lemmatized_description"],
+            lambda texts: list(engine.encode(texts, n_threads=runner.n_jobs))
+        ))
+        # Measured once per run, on the first texts encoded (the first chunk when streaming)
+        if quantise_embeddings and engine.drift is None:
+            drift = engine.drift = engine.measure_drift(df["lemmatized_description"])
+            print(f"Quantised embeddings: cosine similarity to float32 {drift['mean']:.4f} mean, "
+                  f"{drift['min']:.4f} min over {drift['n_texts']} texts.")
+        return {"embeddings": embeddings}
+
+    def keywords(df, upstream, runner):
+        # KeyBERT-style keywords - extract keywords and phrases based on semantic similarity,
+        # reusing the sentence embeddings rather than encoding every document again
+        engine = get_embedding_engine(quantise_embeddings)
+        doc_embeddings = dict(zip(df["lemmatized_description"], upstream["embeddings"]))
+        return {"top_keywords": cached_map(
+            "keywords", KEYWORDS_VERSION.format(embeddings=engine.version), df["lemmatized_description"],
+            lambda texts: extract_keywords_batch(
+                texts, np.asarray([doc_embeddings[text] for text in texts]), engine=engine
+            )
+        )}
+
+    return [
+        Extractor("ner", ner, outputs=["ner_df", "entity_spans"], executor="process", n_jobs=n_process),
+        Extractor("embeddings", embeddings, outputs=["embeddings"], n_jobs=None),
+        Extractor("keywords", keywords, outputs=["top_keywords"], requires=["embeddings"], n_jobs=None),
+    ]
+
+def document_features(df, batch_size=SPACY_BATCH_SIZE, n_process=SPACY_N_PROCESS, extractor_jobs=None,
+                      ner_labels=NER_LABELS, quantise_embeddings=False):
+    '''
+    Features that only depend on each document itself, so they can be computed chunk by chunk.
+    Returns the DataFrame with the keyword columns added, the NER features, the entity spans
+    and the sentence embeddings.
+    '''
+    unique, members = dedup.representatives(df)
+    outputs = run_extractors(
+        unique, document_extractors(batch_size, n_process, ner_labels, quantise_embeddings), n_jobs=extractor_jobs
+    )
+    return add_document_features(df, fan_out_outputs(outputs, members, df, ner_labels))
+
+def fan_out_outputs(outputs, members, df, ner_labels=NER_LABELS):
+    '''
+    Copy extractor outputs computed for the group representatives to every row of df, members holding
+    the position of each row's representative (see dedup.representatives). Entities are not copied:
+    each row gets its own entity lists where preprocessing kept them, otherwise the representative's
+    entities that occur in the row's own description.
+    '''
+    if members is None:
+        return outputs
+    outputs = dict(outputs)
+    for name in ["tfidf_matrix", "embeddings", "cluster_ids", "distances"]:
+        if name in outputs:
+            outputs[name] = outputs[name][members]
+    if "top_keywords" in outputs:
+        outputs["top_keywords"] = [outputs["top_keywords"][i] for i in members]
+    if "entity_spans" in outputs:
+        if "entity_labels" in df.columns:
+            lists = incremental.parse_list_columns(df[["entity_labels", "entity_texts"]].copy())
+            spans = EntitySpans.from_lists(lists["entity_labels"], lists["entity_texts"])
+        else:
+            representative = outputs["entity_spans"]
+            spans = EntitySpans.from_entities(dedup.own_entities(
+                [representative.doc(i) for i in members], df["cleaned_description"]
+            ))
+        outputs["entity_spans"] = spans
+        outputs["ner_df"] = ner_features(spans, labels=ner_labels, index=df.index)
+    return outputs
+
+def add_document_features(df, outputs):
+    '''
+    Add the keyword columns from the document extractor outputs, returning them with the NER features,
+    entity spans and embeddings.
+    '''
+    df["top_keywords"] = outputs["top_keywords"]
+    df["keyword_text"] = df["top_keywords"].apply(lambda x: " ".join(x))
+    # The entities live in the span store from here on
+    df = df.drop(columns=["entity_labels", "entity_texts"], errors="ignore")
+    return df, outputs["ner_df"], outputs["entity_spans"], outputs["embeddings"]
+
+def add_cluster_terms(df, tfidf_matrix, tfidf_terms):
+    '''
+    Add the most common KeyBERT keywords of each row's cluster as cluster_top_keywords.
+    Also returns the cluster terms table (top keywords, TF-IDF and c-TF-IDF terms per cluster).
+    '''
+    cluster_top_keywords, table = cluster_terms.cluster_terms(
+        df["cluster_id"], df["top_keywords"], tfidf_matrix, tfidf_terms
+    )
+    df["cluster_top_keywords"] = df["cluster_id"].map(cluster_top_keywords)
+    return df, table
+
+def extract_keywords_batch(texts, doc_embeddings, top_n=5, ngram_range=(1, 2), engine=None):
+    '''
+    Batched equivalent of KeyBERT's extract_keywords (without MMR/MaxSum) over a list of documents.
+    Candidate n-grams are deduplicated across the corpus so each one is embedded once, then every
+    document's candidates are ranked by cosine similarity to its precomputed embedding.
+    Candidates are embedded with engine, which should be the one that produced doc_embeddings.
+    '''
+    if len(texts) == 0:
+        return []
+
+    # Same candidates KeyBERT would pick per document, but from one vocabulary over the whole corpus
+    vectorizer = CountVectorizer(ngram_range=ngram_range, stop_words="english")
+    try:
+        doc_terms = vectorizer.fit_transform(texts).tocsr()
+    except ValueError:
+        # Only stop words in every document
+        return [[] for _ in texts]
+    doc_terms.sort_indices()
+    candidates = vectorizer.get_feature_names_out()
+
+    engine = engine or get_embedding_engine()
+    candidate_embeddings = normalize(engine.encode(list(candidates)))
+    doc_embeddings = normalize(doc_embeddings)
+
+    keywords = []
+    for chunk_start in range(0, doc_terms.shape[0], KEYWORD_SCORING_CHUNK_SIZE):
+        chunk = doc_terms[chunk_start:chunk_start + KEYWORD_SCORING_CHUNK_SIZE]
+        # Score every (document, candidate) pair in the chunk at once
+        rows = np.repeat(np.arange(chunk.shape[0]), np.diff(chunk.indptr))
+        scores = np.einsum(
+            "ij,ij->i", candidate_embeddings[chunk.indices], doc_embeddings[chunk_start + rows]
+        )
+        for i in range(chunk.shape[0]):
+            start, end = chunk.indptr[i], chunk.indptr[i + 1]
+            order = np.argsort(-scores[start:end], kind="stable")[:top_n]
+            keywords.append(candidates[chunk.indices[start:end][order]].tolist())
+
+    return keywords
+
+def extract_entities_batch(texts, batch_size=SPACY_BATCH_SIZE):
+    '''
+    The (label, text) entities of each text, only running the NER component.
+    '''
+    return [
+        [(ent.label_, ent.text) for ent in doc.ents]
+        for doc in pipe_docs(texts, task="ner", batch_size=batch_size)
+    ]
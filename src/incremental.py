@@ -0,0 +1,94 @@
+import ast
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from src import entities
+
+# Columns used to tell whether an ingested row is new or has been edited since the last run
+SNAPSHOT_COLUMNS = ["id", "is_edited", "created_at"]
+
+# List columns that come back from the processed CSV as stringified Python lists
+LIST_COLUMNS = [
+    "top_keywords", "cluster_top_keywords",
+    "masked_url_list", "masked_email_list", "masked_money_list", "masked_date_list",
+    "entity_labels", "entity_texts"
+]
+
+def snapshot_keys(df):
+    '''
+    Reduce ingested data to the columns used to detect new or edited rows, with consistent types.
+    '''
+    keys = df[SNAPSHOT_COLUMNS].copy()
+    keys["id"] = keys["id"].astype(int)
+    keys["is_edited"] = keys["is_edited"].astype(int)
+    keys["created_at"] = pd.to_datetime(keys["created_at"], errors="coerce")
+    return keys
+
+def save_snapshot(keys, SNAPSHOT_PATH):
+    '''
+    Save the ingest snapshot the current artifacts were built from.
+    '''
+    keys.to_csv(SNAPSHOT_PATH, index=False)
+
+def read_snapshot(SNAPSHOT_PATH):
+    '''
+    Read the ingest snapshot from the previous run, if it exists
+    '''
+    try:
+        return snapshot_keys(pd.read_csv(SNAPSHOT_PATH, encoding="utf-8"))
+    except FileNotFoundError:
+        return None
+
+def diff_against_snapshot(incoming, snapshot):
+    '''
+    Compare freshly ingested rows against the previous snapshot by id, is_edited and created_at.
+    Returns the incoming rows that are new or edited, and the set of ids whose existing artifacts
+    are stale (edited or removed from the input) and need dropping before the merge.
+    '''
+    incoming_keys = snapshot_keys(incoming)
+    merged = incoming_keys.merge(
+        snapshot.drop_duplicates(), on=SNAPSHOT_COLUMNS, how="left", indicator=True
+    )
+    is_new = (merged["_merge"] == "left_only").to_numpy()
+    delta = incoming[is_new].copy()
+
+    unchanged_ids = set(merged.loc[~is_new, "id"]) - set(delta["id"])
+    stale_ids = set(snapshot["id"]) - unchanged_ids
+
+    return delta, stale_ids
+
+def parse_list_columns(df):
+    '''
+    Turn stringified list columns read back from CSV into Python lists.
+    '''
+    for col in LIST_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].apply(lambda x: ast.literal_eval(x) if isinstance(x, str) else x)
+    return df
+
+def merge_artifacts(old_df, old_tfidf_matrix, old_embeddings, old_entity_spans, stale_ids, new_features=None):
+    '''
+    Drop the stale rows from the existing artifacts and append the newly computed ones.
+    Rows of the TF-IDF matrix, embeddings and entity spans stay aligned with the rows of the DataFrame.
+    '''
+    keep = ~old_df["id"].isin(stale_ids).to_numpy()
+
+    df = parse_list_columns(old_df[keep].copy())
+    tfidf_matrix = old_tfidf_matrix[keep]
+    embeddings = old_embeddings[keep]
+    entity_spans = old_entity_spans.take(keep)
+
+    if new_features is not None:
+        df = pd.concat([df, new_features["df"]], ignore_index=True)
+        tfidf_matrix = sparse.vstack([tfidf_matrix, new_features["tfidf_matrix"]]).tocsr()
+        embeddings = np.vstack([embeddings, new_features["embeddings"]])
+        entity_spans = entities.concat_spans([entity_spans, new_features["entity_spans"]], labels=entity_spans.labels)
+    else:
+        df = df.reset_index(drop=True)
+
+    return {
+        "df": df,
+        "tfidf_matrix": tfidf_matrix,
+        "embeddings": embeddings,
+        "entity_spans": entity_spans,
+    }
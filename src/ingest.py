@@ -1,88 +1,113 @@
 import pandas as pd
 import numpy as np
+from scipy import sparse
+import joblib
+from src import storage, embedding_store, raw_reader
 
-def initial_ingest(DATA_PATH):
+def initial_ingest(DATA_PATH, block_size=raw_reader.BLOCK_SIZE):
     '''
-    Ingest the data from the CSV file and clean it up a bit.
+    Ingest the data from the CSV file and clean it up a bit. Malformed rows are repaired as the file is read.
     '''
-    df = pd.read_csv(DATA_PATH, engine="python", encoding="utf-8")
+    batches = list(raw_reader.read_batches(DATA_PATH, block_size=block_size))
+    if not batches:
+        # An empty or header-only file
+        batches = [pd.DataFrame(columns=raw_reader.read_header(DATA_PATH))]
+    df = pd.concat(batches, ignore_index=True)
+    return standardise_raw_data(df)
 
+def iter_ingest(DATA_PATH, chunk_size, block_size=raw_reader.BLOCK_SIZE):
+    '''
+    Ingest the data from the CSV file in chunks of chunk_size rows, cleaning each chunk like initial_ingest.
+    Only the blocks needed for the next chunk are held in memory.
+    '''
+    buffered = pd.DataFrame()
+    for batch in raw_reader.read_batches(DATA_PATH, block_size=block_size):
+        buffered = pd.concat([buffered, batch], ignore_index=True)
+        while len(buffered) >= chunk_size:
+            chunk, buffered = buffered.iloc[:chunk_size].copy(), buffered.iloc[chunk_size:].reset_index(drop=True)
+            yield standardise_raw_data(chunk)
+    if not buffered.empty:
+        yield standardise_raw_data(buffered)
+
+def standardise_raw_data(df):
+    '''
+    Clean up raw rows read from the CSV file (the whole file or a chunk of it).
+    '''
     # Sort issues with separators in the company description
     df["company_description"] = df["company_description"].apply(clean_separators)
 
     # Drop the unnamed column
     df.drop(columns=["Unnamed: 0"], inplace=True)
-    
-    # Fix the issue with the broken description for company id 756111
-    df = fix_756111_issue(df)
 
     # Force correct types
     df["company_description"] = df["company_description"].astype(str)
     df["source"] = df["source"].astype(str)
     df["is_edited"] = df["is_edited"].astype(int)
-    df["created_at"] = pd.to_datetime(df["created_at"], errors="coerce")
+    df["created_at"] = raw_reader.parse_timestamps(df["created_at"])
     df["id"] = df["id"].astype(int)
 
     return df
 
-def read_preprocessed_data(PREPROCESSED_PATH):
+def read_preprocessed_data(PREPROCESSED_PATH, columns=None):
     '''
-    Read the preprocessed data, if it exists
+    Read the preprocessed data (Parquet or CSV), if it exists. Only the given columns are read if set.
     '''
     try:
-        df = pd.read_csv(PREPROCESSED_PATH, engine="python", encoding="utf-8")
+        df = storage.read_table(PREPROCESSED_PATH, columns=columns)
         return df
     except FileNotFoundError:
         return None
 
-def read_processed_data(PROCESSED_PATH):
+def read_processed_data(PROCESSED_PATH, columns=None):
     '''
-    Read the processed data, if it exists
+    Read the processed data (Parquet or CSV), if it exists. Only the given columns are read if set.
     '''
     try:
-        df = pd.read_csv(PROCESSED_PATH, engine="python", encoding="utf-8")
+        df = storage.read_table(PROCESSED_PATH, columns=columns)
         return df
     except FileNotFoundError:
         return None
 
 def read_embeddings(EMBEDDINGS_PATH):
     '''
-    Read the embeddings, if they exist
+    Read the embeddings as float32, if they exist. float32 stores stay memory-mapped.
     '''
+    store = read_embedding_store(EMBEDDINGS_PATH)
+    if store is not None:
+        return store.to_array()
     try:
-        embeddings = np.load(EMBEDDINGS_PATH)
-        return embeddings
+        # Saved before the embedding store, without ids
+        return np.load(EMBEDDINGS_PATH, mmap_mode="r")
     except FileNotFoundError:
         return None
 
-def clean_separators(text):
+def read_embedding_store(EMBEDDINGS_PATH):
     '''
-    Clean the text by removing unwanted separators and replacing them with spaces.
+    Open the embedding store (memory-mapped, with id lookups), if it exists
     '''
-    return str(text).replace('\u2028', ' ').replace('\u2029', ' ').replace('\u0085', ' ')
+    return embedding_store.open_store(EMBEDDINGS_PATH)
 
-def fix_756111_issue(df):
+def read_tfidf_matrix(TFIDF_MATRIX_PATH):
     '''
-    Fix the issue with the broken description for company id 756111.
-    The description is split across multiple rows, and we need to combine them into one.
-    The rows with the broken description are from 367 to 381 (inclusive)
+    Read the TF-IDF matrix, if it exists
     '''
-    broken_rows = df.loc[367:381].copy()
-    correct_id = broken_rows.iloc[0]["id"]
-
-    combined_desc_parts = broken_rows["company_description"].dropna().astype(str).tolist()
-    combined_desc_parts += broken_rows["id"][1:].dropna().astype(str).tolist()  # skip first 'id' (which is real ID)
-    combined_description = " ".join(combined_desc_parts)
+    try:
+        return sparse.load_npz(TFIDF_MATRIX_PATH).tocsr()
+    except FileNotFoundError:
+        return None
 
-    corrected_row = {
-        "id": correct_id,
-        "company_description": combined_description,
-        "source": df["source"].mode()[0], # since no other null values, assume it did have a source value
-        "is_edited": 0, # since no other null values, assume is_edited = 0
-        "created_at": broken_rows.iloc[-1]["source"], # use the last source value that was in the wrong place
-    }
+def read_model(MODEL_PATH):
+    '''
+    Read a fitted model saved by the structure stage, if it exists
+    '''
+    try:
+        return joblib.load(MODEL_PATH)
+    except FileNotFoundError:
+        return None
 
-    df_cleaned = df.drop(index=range(367, 382))
-    df_cleaned = pd.concat([df_cleaned, pd.DataFrame([corrected_row])], ignore_index=True)
+def clean_separators(text):
+    '''
+    Clean the text by removing unwanted separators and replacing them with spaces.
+    '''
+    return str(text).replace('\u2028', ' ').replace('\u2029', ' ').replace('\u0085', ' ')
 
-    return df_cleaned
\ No newline at end of file
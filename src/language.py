@@ -0,0 +1,87 @@
+from langdetect import DetectorFactory, detect_langs
+import re
+from src.extractors import spawn_pool
+
+# Seed langdetect so the same text always gets the same result
+DetectorFactory.seed = 0
+
+# Version used to key cached results, bump this when the detection logic changes
+LANG_DETECT_VERSION = "langdetect-seed0-prefix1000-stopwords-v1"
+
+# Only the start of a description is needed to tell its language
+LANG_PREFIX_CHARS = 1000
+
+# Number of texts sent to a worker process at a time
+LANG_CHUNK_SIZE = 500
+
+# Common English function words that are rare as whole words in other languages
+ENGLISH_STOPWORDS = frozenset([
+    "the", "and", "of", "to", "with", "for", "that", "this", "these", "those", "are", "our", "we",
+    "you", "your", "from", "by", "which", "their", "they", "has", "have", "was", "were", "will",
+    "be", "been", "it", "its", "or", "not", "can", "who", "what", "into", "more", "also", "all",
+    "about", "through", "across", "while", "would", "should", "could", "than", "them", "such",
+    "each", "other", "any", "how", "when", "where", "there", "here", "only", "both", "between",
+])
+MIN_STOPWORD_TOKENS = 10
+MIN_STOPWORD_DENSITY = 0.25
+
+WORD_RE = re.compile(r"[a-z]+")
+
+def detect_lang(text):
+    try:
+        if len(text.strip()) < 20:
+            return "short"
+        langs = detect_langs(text)
+        top = langs[0]
+        if top.lang == "en" and top.prob > 0.80:
+            return "en"
+        elif top.prob > 0.80:
+            return top.lang
+        else:
+            return "uncertain"
+    except:
+        return "error"
+
+def is_obviously_english(text):
+    '''
+    Fast check for plain ASCII text with a high density of English function words.
+    '''
+    if not text.isascii():
+        return False
+    words = WORD_RE.findall(text.lower())
+    if len(words) < MIN_STOPWORD_TOKENS:
+        return False
+    return sum(1 for word in words if word in ENGLISH_STOPWORDS) / len(words) >= MIN_STOPWORD_DENSITY
+
+def identify_language(text):
+    '''
+    Identify the language of a description from its prefix, skipping langdetect for obviously English text.
+    '''
+    if len(text.strip()) < 20:
+        return "short"
+    prefix = text[:LANG_PREFIX_CHARS]
+    if is_obviously_english(prefix):
+        return "en"
+    return detect_lang(prefix)
+
+def identify_language_chunk(texts):
+    return [identify_language(text) for text in texts]
+
+def identify_languages(texts, n_process=1, chunk_size=LANG_CHUNK_SIZE):
+    '''
+    Identify the language of each text. Repeated texts are only identified once,
+    and chunks of texts are spread across n_process worker processes.
+    '''
+    texts = list(texts)
+    unique_texts = list(dict.fromkeys(texts))
+    chunks = [unique_texts[i:i + chunk_size] for i in range(0, len(unique_texts), chunk_size)]
+
+    if n_process > 1 and len(chunks) > 1:
+        with spawn_pool(n_process) as executor:
+            results = executor.map(identify_language_chunk, chunks)
+            languages = [lang for chunk in results for lang in chunk]
+    else:
+        languages = [lang for chunk in chunks for lang in identify_language_chunk(chunk)]
+
+    lookup = dict(zip(unique_texts, languages))
+    return [lookup[text] for text in texts]
@@ -0,0 +1,169 @@
+import re
+import pandas as pd
+
+# Patterns are applied in order, each one on the output of the previous substitution
+MASK_AND_EXTRACT_PATTERNS = {
+    "url": r"\b(?:https?://|www\.)?\w[\w.-]*\.\w{2,10}(?:/\S*)?\b",
+    "email": r"[\w\.\+\-]+@[\w\.-]+\.\w+",
+    "money": r"\b((\$|€|£|USD|EUR|GBP)\s?\d+(?:[.,]?\d+)?(?:\s?(million|billion|bn|k|m))?|\d+(?:[.,]?\d+)?\s?(million|billion|bn|k|m))\b",
+    "date": r"\b(?:\d{1,2}[\/\-.]){2}(?:\d{2,4})\b|\b(19|20)\d{2}\b"
+}
+
+JUST_MASK_PATTERNS = {
+    "phone": r"\b(?:\+?\d{1,2}[\s\-]?)?(?:\(?\d{2,4}\)?[\s\-]?)?\d{3}[\s\-]?\d{4}\b",
+    "percent": r"\b\d{1,3}(?:[.,]\d+)?\s?(%|percent)\b",
+    "number": r"\b\d+(?:[.,]\d+)?\b"
+}
+
+# What each built-in pattern can't match without, so its scan can be skipped when it's absent.
+# Mask tokens contain none of these, so checking the original text once is enough.
+DIGIT = "digit"
+REQUIRED_CHARS = {
+    MASK_AND_EXTRACT_PATTERNS["url"]: ".",
+    MASK_AND_EXTRACT_PATTERNS["email"]: "@",
+    MASK_AND_EXTRACT_PATTERNS["money"]: DIGIT,
+    MASK_AND_EXTRACT_PATTERNS["date"]: DIGIT,
+    JUST_MASK_PATTERNS["phone"]: DIGIT,
+    JUST_MASK_PATTERNS["percent"]: DIGIT,
+    JUST_MASK_PATTERNS["number"]: DIGIT,
+}
+
+DIGIT_RE = re.compile(r"\d")
+
+def compile_patterns(patterns):
+    return {key: re.compile(pattern, flags=re.IGNORECASE) for key, pattern in patterns.items()}
+
+COMPILED_EXTRACT_PATTERNS = compile_patterns(MASK_AND_EXTRACT_PATTERNS)
+COMPILED_JUST_MASK_PATTERNS = compile_patterns(JUST_MASK_PATTERNS)
+COMPILED_ALL_PATTERNS = {**COMPILED_EXTRACT_PATTERNS, **COMPILED_JUST_MASK_PATTERNS}
+
+def can_match(pattern, text, has_digit):
+    '''
+    Cheap check for whether a compiled pattern could match the text at all, so the scan can be skipped.
+    '''
+    required = REQUIRED_CHARS.get(pattern.pattern)
+    if required is None:
+        return True
+    if required == DIGIT:
+        return has_digit
+    return required in text
+
+def findall_value(match):
+    '''
+    The value re.findall would return for this match, so extracted lists are unchanged:
+    the whole match without groups, the group with one group, the joined groups otherwise.
+    '''
+    groups = match.groups()
+    if len(groups) == 0:
+        return match.group(0)
+    if len(groups) == 1:
+        return groups[0] or ""
+    return "".join(g or "" for g in groups)
+
+def mask_and_extract(text, patterns=COMPILED_EXTRACT_PATTERNS):
+    '''
+    Mask and extract each pattern in turn, collecting the matches during the substitution itself
+    so every pattern only scans the text once.
+    '''
+    results = {}
+    masked_text = text
+    has_digit = DIGIT_RE.search(text) is not None
+    for key, pattern in patterns.items():
+        matches = []
+        if can_match(pattern, text, has_digit):
+            replacement = f" mask_{key} "
+
+            def replace(match):
+                matches.append(findall_value(match))
+                return replacement
+
+            masked_text = pattern.sub(replace, masked_text)
+        results[f"masked_{key}_list"] = matches
+        results[f"has_masked_{key}"] = len(matches) > 0
+
+    results["masked_description"] = masked_text
+    return results
+
+def mask_only(text, patterns=COMPILED_JUST_MASK_PATTERNS):
+    '''
+    Mask each pattern in turn without extracting the matches.
+    '''
+    masked_text = text
+    has_digit = DIGIT_RE.search(text) is not None
+    for key, pattern in patterns.items():
+        if can_match(pattern, text, has_digit):
+            masked_text = pattern.sub(f" mask_{key} ", masked_text)
+    return masked_text
+
+def mask_document(text, with_spans=False):
+    '''
+    Run the full masking for one document in a single pass: mask and extract, mask the rest, then lowercase.
+    With with_spans the results also hold mask_spans, the character spans of the original text that got
+    masked, as a sorted list of (start, end, mask_token) tuples.
+    '''
+    results = {}
+    current = text
+    has_digit = DIGIT_RE.search(text) is not None
+    # Original offset of every character in the current text, -1 for inserted mask tokens
+    origin = None
+    spans = []
+    for key, pattern in COMPILED_ALL_PATTERNS.items():
+        extract = key in COMPILED_EXTRACT_PATTERNS
+        matches = []
+        if can_match(pattern, text, has_digit):
+            replacement = f" mask_{key} "
+            pieces, new_origin, last = [], [], 0
+            for match in pattern.finditer(current):
+                start, end = match.span()
+                if extract:
+                    matches.append(findall_value(match))
+                pieces.append(current[last:start])
+                pieces.append(replacement)
+                if with_spans:
+                    if origin is None:
+                        origin = list(range(len(text)))
+                    new_origin.extend(origin[last:start])
+                    covered = [o for o in origin[start:end] if o >= 0]
+                    if covered:
+                        spans.append((covered[0], covered[-1] + 1, f"mask_{key}"))
+                    new_origin.extend([-1] * len(replacement))
+                last = end
+            if pieces:
+                pieces.append(current[last:])
+                current = "".join(pieces)
+                if with_spans:
+                    new_origin.extend(origin[last:])
+                    origin = new_origin
+        if extract:
+            results[f"masked_{key}_list"] = matches
+            results[f"has_masked_{key}"] = len(matches) > 0
+
+    results["masked_description"] = current.lower()
+    if with_spans:
+        results["mask_spans"] = sorted(spans)
+    return results
+
+def mask_column(texts, with_spans=False):
+    '''
+    Bulk masking for a whole column of cleaned descriptions.
+    Returns a DataFrame (same index) with the extracted lists, has_masked flags and the final masked description.
+    With with_spans returns (DataFrame, list of each text's mask spans), from the same pass.
+    '''
+    texts = pd.Series(texts)
+    records = [mask_document(text, with_spans=with_spans) for text in texts]
+    columns = [
+        col
+        for key in MASK_AND_EXTRACT_PATTERNS
+        for col in (f"masked_{key}_list", f"has_masked_{key}")
+    ] + ["masked_description"]
+    df = pd.DataFrame.from_records(records, index=texts.index, columns=columns)
+    if with_spans:
+        return df, [record["mask_spans"] for record in records]
+    return df
+
+def mask_spans(text):
+    '''
+    Find the character spans of the original text that get masked, following the same sequential
+    substitutions as mask_document. Returns a sorted list of (start, end, mask_token) tuples.
+    '''
+    return mask_document(text, with_spans=True)["mask_spans"]
@@ -0,0 +1,33 @@
+from functools import lru_cache
+from importlib.metadata import version
+
+# Models are only loaded the first time a stage asks for them, and then shared by every module
+SPACY_MODEL_NAME = "en_core_web_sm"
+BERT_MODEL_NAME = "all-MiniLM-L6-v2"
+
+# Read from the installed package metadata, so cache keys can be built without loading the model
+SPACY_MODEL_VERSION = f"{SPACY_MODEL_NAME}-{version(SPACY_MODEL_NAME)}"
+
+@lru_cache(maxsize=None)
+def get_nlp():
+    '''
+    The shared spaCy pipeline, loaded on first use.
+    '''
+    import spacy
+    return spacy.load(SPACY_MODEL_NAME)
+
+@lru_cache(maxsize=None)
+def get_bert_model():
+    '''
+    The shared sentence embedding model, loaded on first use.
+    '''
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(BERT_MODEL_NAME)
+
+@lru_cache(maxsize=None)
+def get_embedding_engine(quantise=False):
+    '''
+    The shared length-bucketed embedding engine, optionally with int8 linear layers, built on first use.
+    '''
+    from src.embedding_engine import EmbeddingEngine
+    return EmbeddingEngine(get_bert_model(), quantise=quantise)
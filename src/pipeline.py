@@ -0,0 +1,276 @@
+import hashlib
+import inspect
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from src.profiling import span
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Bump this to invalidate every recorded stage, e.g. when the fingerprint layout changes
+PIPELINE_VERSION = "stages-v2"
+HASH_BLOCK_SIZE = 1 << 20
+
+class Artifact:
+    '''
+    Something a stage produces or reads. Artifacts with a path are files on disk, read back with load
+    (or passed as the path itself if there is no loader) when their stage is skipped.
+    Artifacts without a path only live in memory for the current run.
+    '''
+    def __init__(self, name, path=None, load=None):
+        self.name = name
+        self.path = path
+        self.load = load
+
+class Stage:
+    '''
+    A pipeline stage. run(inputs, config) gets a dict of input artifact name -> value and the pipeline
+    config, and returns a dict of output artifact name -> value, writing any file outputs itself.
+
+    The stage fingerprint covers the fingerprints of its inputs, the source of run and of the load functions,
+    the source of the given src modules, the config values it reads and the model names it uses, so any of
+    these changing makes it stale.
+    load overrides how a file input is read when its stage is skipped, e.g. to only read some columns.
+    '''
+    def __init__(self, name, run, inputs=(), outputs=(), modules=(), config_keys=(), models=(), load=None):
+        self.name = name
+        self.run = run
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.modules = list(modules)
+        self.config_keys = list(config_keys)
+        self.models = list(models)
+        self.load = load or {}
+
+def file_digest(path):
+    '''
+    blake2b hex digest of a file's contents, or None if it doesn't exist.
+    '''
+    if not os.path.exists(path):
+        return None
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def file_stat(path):
+    '''
+    (size, mtime) of a file or directory, used to notice outputs that were changed or deleted after a run.
+    '''
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+def function_digest(func):
+    '''
+    blake2b hex digest of a function's source, or of its qualified name if the source isn't available.
+    '''
+    try:
+        source = inspect.getsource(func)
+    except (OSError, TypeError):
+        source = f"{getattr(func, '__module__', None)}.{getattr(func, '__qualname__', repr(func))}"
+    return hashlib.blake2b(source.encode("utf-8"), digest_size=16).hexdigest()
+
+def read_manifest(path):
+    '''
+    Read the record of previous stage runs, if it exists
+    '''
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"stages": {}, "sources": {}}
+
+class Pipeline:
+    '''
+    A graph of stages connected by the artifacts they read and write, with a manifest on disk recording
+    the fingerprint and output file stats of every stage that ran.
+
+    Running a set of target stages only runs those that are stale, plus the upstream stages whose outputs
+    they need: stale ones, and ones whose outputs only live in memory. Stages whose inputs are ready
+    run concurrently in threads.
+    '''
+    def __init__(self, stages, artifacts, manifest_path, config=None):
+        self.stages = {stage.name: stage for stage in stages}
+        self.artifacts = {artifact.name: artifact for artifact in artifacts}
+        self.manifest_path = manifest_path
+        self.config = config or {}
+        self.producers = {}
+        for stage in stages:
+            for name in stage.outputs:
+                self.producers[name] = stage.name
+        self.order = self.topological_order()
+        self.manifest = read_manifest(manifest_path)
+        self.fingerprints = self.compute_fingerprints()
+        self.lock = threading.Lock()
+
+    def topological_order(self):
+        order, seen = [], set()
+        def visit(name, path=()):
+            if name in path:
+                raise ValueError(f"Stage graph has a cycle through {name}")
+            if name in seen:
+                return
+            for artifact in self.stages[name].inputs:
+                if artifact in self.producers:
+                    visit(self.producers[artifact], path + (name,))
+            seen.add(name)
+            order.append(name)
+        for name in self.stages:
+            visit(name)
+        return order
+
+    def source_fingerprint(self, name):
+        '''
+        Content hash of an input file no stage produces, reused from the manifest while its size and mtime match.
+        '''
+        path = self.artifacts[name].path
+        if not os.path.exists(path):
+            return None
+        stat = file_stat(path)
+        recorded = self.manifest["sources"].get(path)
+        if recorded is not None and recorded["stat"] == stat:
+            return recorded["digest"]
+        digest = file_digest(path)
+        self.manifest["sources"][path] = {"stat": stat, "digest": digest}
+        return digest
+
+    def code_fingerprint(self, stage):
+        '''
+        Digests of the stage's own functions and of the source files of its src modules.
+        '''
+        code = {module: file_digest(os.path.join(SRC_DIR, f"{module}.py")) for module in stage.modules}
+        code["run"] = function_digest(stage.run)
+        code.update({f"load:{name}": function_digest(load) for name, load in stage.load.items()})
+        return code
+
+    def compute_fingerprints(self):
+        fingerprints = {}
+        for name in self.order:
+            stage = self.stages[name]
+            inputs = {}
+            for artifact in stage.inputs:
+                producer = self.producers.get(artifact)
+                inputs[artifact] = fingerprints[producer] if producer else self.source_fingerprint(artifact)
+            payload = {
+                "pipeline": PIPELINE_VERSION,
+                "stage": name,
+                "inputs": inputs,
+                "outputs": {artifact: self.artifacts[artifact].path for artifact in stage.outputs},
+                "code": self.code_fingerprint(stage),
+                "config": {key: self.config.get(key) for key in stage.config_keys},
+                "models": stage.models,
+            }
+            encoded = json.dumps(payload, sort_keys=True, default=str).encode("utf-8")
+            fingerprints[name] = hashlib.blake2b(encoded, digest_size=16).hexdigest()
+        return fingerprints
+
+    def file_outputs(self, name):
+        return [self.artifacts[artifact].path for artifact in self.stages[name].outputs if self.artifacts[artifact].path]
+
+    def is_fresh(self, name):
+        '''
+        A stage is fresh if it last ran with the same fingerprint and its output files haven't changed since.
+        '''
+        recorded = self.manifest["stages"].get(name)
+        if recorded is None or recorded["fingerprint"] != self.fingerprints[name]:
+            return False
+        for path in self.file_outputs(name):
+            if not os.path.exists(path) or recorded["outputs"].get(path) != file_stat(path):
+                return False
+        return True
+
+    def plan(self, targets, force=False):
+        '''
+        Stages that need to run for targets, in dependency order. force runs the targets even if fresh.
+        '''
+        run = set()
+        for name in reversed(self.order):
+            if name in targets and (force or not self.is_fresh(name)):
+                run.add(name)
+                continue
+            for consumer in run:
+                needed = set(self.stages[consumer].inputs) & set(self.stages[name].outputs)
+                if any(self.artifacts[a].path is None for a in needed) or (needed and not self.is_fresh(name)):
+                    run.add(name)
+                    break
+        return [name for name in self.order if name in run]
+
+    def record(self, name, seconds):
+        with self.lock:
+            self.manifest["stages"][name] = {
+                "fingerprint": self.fingerprints[name],
+                "outputs": {path: file_stat(path) for path in self.file_outputs(name) if os.path.exists(path)},
+                "seconds": round(seconds, 3),
+                "finished_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            }
+            self.save_manifest()
+
+    def mark_fresh(self, names):
+        '''
+        Record stages as up to date with their current outputs, for runs that write them outside the graph.
+        '''
+        for name in names:
+            self.record(name, 0.0)
+
+    def save_manifest(self):
+        if os.path.dirname(self.manifest_path):
+            os.makedirs(os.path.dirname(self.manifest_path), exist_ok=True)
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def input_value(self, stage, artifact, values):
+        if artifact in values:
+            return values[artifact]
+        path = self.artifacts[artifact].path
+        load = stage.load.get(artifact, self.artifacts[artifact].load)
+        return load(path) if load is not None else path
+
+    def run(self, targets, max_workers=None, force=False):
+        '''
+        Run the target stages and whatever they need, skipping fresh ones (unless force),
+        then print a per-stage summary. Returns the artifact values produced in this run.
+        '''
+        targets = set(targets)
+        to_run = self.plan(targets, force=force)
+        values = {}
+        # Skipped targets show how long they took when they last ran
+        summary = {name: ("cached", self.manifest["stages"].get(name, {}).get("seconds")) for name in self.order
+                   if name in targets and name not in to_run}
+        pending, running = list(to_run), {}
+
+        def run_stage(name):
+            stage = self.stages[name]
+            inputs = {artifact: self.input_value(stage, artifact, values) for artifact in stage.inputs}
+            with span(f"stage.{name}") as timing:
+                outputs = stage.run(inputs, self.config) or {}
+            seconds = timing.seconds
+            self.record(name, seconds)
+            return outputs, seconds
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while pending or running:
+                busy = set(pending) | set(running.values())
+                ready = [name for name in pending
+                         if not any(self.producers.get(artifact) in busy for artifact in self.stages[name].inputs)]
+                for name in ready:
+                    pending.remove(name)
+                    running[executor.submit(run_stage, name)] = name
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    outputs, seconds = future.result()
+                    values.update(outputs)
+                    summary[name] = ("ran", seconds)
+
+        print("Stage summary:")
+        for name in self.order:
+            if name in summary:
+                status, seconds = summary[name]
+                took = f"{seconds:.2f}s" if seconds is not None else "-"
+                print(f"- {name:<10} {status:<6} {took}")
+        return values
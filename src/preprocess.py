@@ -1,55 +1,100 @@
 import pandas as pd
 import re
 from src.preprocess_utils import (
-    ascii_ratio, symbol_ratio, digit_ratio, detect_lang, 
-    mask_and_extract_all, mask_other, lemmatize_text, 
-    advanced_doc_stats
+    lemmatize_record, advanced_doc_stats,
+    SPACY_BATCH_SIZE, SPACY_N_PROCESS
 )
-
-def preprocess_data(df):
+from src.cache import cached_map
+from src.masking import mask_column
+from src.quality import text_quality_metrics, passes_quality_thresholds
+from src.language import identify_languages, LANG_DETECT_VERSION
+from src import dedup
+from src.profiling import span
+
+def preprocess_data(df, batch_size=SPACY_BATCH_SIZE, n_process=SPACY_N_PROCESS, dedup_threshold=dedup.DEFAULT_THRESHOLD):
     """
-    Preprocess the input data to prepare for feature engineering
+    Preprocess the input data to prepare for feature engineering.
+    batch_size and n_process control the batched spaCy parse.
+    Rows whose cleaned descriptions are near-duplicates (estimated Jaccard similarity of at least
+    dedup_threshold, None to turn this off) get the id of their group's first row in duplicate_of,
+    and only that row is parsed with spaCy, its parse (doc stats, lemmas, entities) is shared with the
+    rest of the group. Masking and the extracted values are always per row.
     """
     # Filter the data down to only quality data and add some document stats
-    df = initial_quality_filter(df)
+    with span("preprocess.quality_filter", n_docs=len(df)):
+        df = initial_quality_filter(df, n_process=n_process)
+    if df.empty:
+        return df
 
     # Clean up the company description strings
-    df["cleaned_description"] = df["company_description"].apply(clean_company_description)
-
-    # Add some other document stats
-    df = advanced_doc_stats(df)
+    with span("preprocess.clean", n_docs=len(df)):
+        df["cleaned_description"] = df["company_description"].apply(clean_company_description)
 
-    # Handle values we want to mask, and add features to track them
-    mask_df = df["cleaned_description"].apply(mask_and_extract_all).apply(pd.Series)
+    # Handle values we want to mask, and add features to track them. Other masked values that we
+    # don't want to track are masked too, and the result is lowercased only after masking
+    with span("preprocess.mask", n_docs=len(df)):
+        mask_df, spans = mask_column(df["cleaned_description"], with_spans=True)
 
-    # Put the data back in, replacing the cleaned description with the masked version
+    # Put the data back in, next to the cleaned description
     df = pd.concat([df, mask_df], axis=1)
 
-    # Handle other masked values that we don't want to track
-    df["masked_description"] = df["masked_description"].apply(mask_other)
+    if dedup_threshold is None:
+        return process_descriptions(df, spans, batch_size, n_process)
+
+    with span("preprocess.dedup", n_docs=len(df)):
+        df["duplicate_of"] = dedup.mark_duplicates(df, threshold=dedup_threshold)
+    is_representative = (df["duplicate_of"] == df["id"]).to_numpy()
+    unique = process_descriptions(
+        df[is_representative].copy(), [s for s, keep in zip(spans, is_representative) if keep], batch_size, n_process
+    )
+    df = dedup.fan_out(unique, df)
+
+    # Members only keep the entities of their representative's parse found in their own description
+    entities = dedup.own_entities(
+        [list(zip(labels, texts)) for labels, texts in zip(df["entity_labels"], df["entity_texts"])],
+        df["cleaned_description"]
+    )
+    df["entity_labels"] = [[label for label, _ in row] for row in entities]
+    df["entity_texts"] = [[text for _, text in row] for row in entities]
+    return df
+
+def process_descriptions(df, spans, batch_size=SPACY_BATCH_SIZE, n_process=SPACY_N_PROCESS):
+    """
+    Parse and lemmatize the cleaned descriptions, spans holding the masked spans of each one.
+    """
+    # Add some other document stats (this is the only spaCy parse of each description)
+    with span("preprocess.spacy_parse", n_docs=len(df)):
+        df = advanced_doc_stats(df, batch_size=batch_size, n_process=n_process)
 
-    # Lowercase only after masking
-    df["masked_description"] = df["masked_description"].str.lower()
+    # Lemmatize from the shared parse, masking the spans found by the masking pass
+    with span("preprocess.lemmatize", n_docs=len(df)):
+        df["lemmatized_description"] = [
+            lemmatize_record(record, record_spans) for record, record_spans in zip(df["doc_record"], spans)
+        ]
 
-    # Lemmatize the cleaned description
-    df["lemmatized_description"] = df["masked_description"].apply(lemmatize_text)
+    # Keep the entities for feature engineering as typed list columns and drop the rest of the record
+    df["entity_labels"] = [[label for label, _ in record["entities"]] for record in df["doc_record"]]
+    df["entity_texts"] = [[text for _, text in record["entities"]] for record in df["doc_record"]]
+    df.drop(columns=["doc_record"], inplace=True)
 
     return df
 
-def initial_quality_filter(df):
+def initial_quality_filter(df, n_process=1):
     '''
     Perform initial cleanup on the DataFrame based on text quality and duplicates/missing values.
+    Language detection runs across n_process processes.
     '''
     # Generate additional features for initial filtering
-    df["char_count"] = df["company_description"].apply(len).astype(int)
-    df["word_count"] = df["company_description"].apply(lambda x: len(x.split())).astype(int)
-    df["ascii_ratio"] = df["company_description"].apply(ascii_ratio).astype(float)
-    df["symbol_ratio"] = df["company_description"].apply(symbol_ratio).astype(float)
-    df["digit_ratio"] = df["company_description"].apply(digit_ratio).astype(float)
-    df["language"] = df["company_description"].apply(detect_lang).astype(str)
-
-    # Filter rows based on above thresholds
-    df = df[(df["char_count"] >= 40) & (df["word_count"] >= 10) & (df["ascii_ratio"] >= 0.6) & (df["symbol_ratio"] <= 0.15)]
+    df = pd.concat([df, text_quality_metrics(df["company_description"])], axis=1)
+
+    # Filter rows based on above thresholds, before language detection so it only sees rows that can pass
+    df = df[passes_quality_thresholds(df)].copy()
+
+    df["language"] = cached_map(
+        "language", LANG_DETECT_VERSION, df["company_description"],
+        lambda texts: identify_languages(texts, n_process=n_process)
+    )
+    df["language"] = df["language"].astype(str)
     df = df[df["language"] == "en"]
 
     # Clean up source column values to website & linkedin
@@ -1,20 +1,22 @@
-from langdetect import detect_langs
-import re
-import spacy
-
-nlp = spacy.load("en_core_web_sm")
-
-MASK_AND_EXTRACT_PATTERNS = {
-    "url": r"\b(?:https?://|www\.)?\w[\w.-]*\.\w{2,10}(?:/\S*)?\b",
-    "email": r"[\w\.\+\-]+@[\w\.-]+\.\w+",
-    "money": r"\b((\$|€|£|USD|EUR|GBP)\s?\d+(?:[.,]?\d+)?(?:\s?(million|billion|bn|k|m))?|\d+(?:[.,]?\d+)?\s?(million|billion|bn|k|m))\b",
-    "date": r"\b(?:\d{1,2}[\/\-.]){2}(?:\d{2,4})\b|\b(19|20)\d{2}\b"
-}
-
-JUST_MASK_PATTERNS = {
-    "phone": r"\b(?:\+?\d{1,2}[\s\-]?)?(?:\(?\d{2,4}\)?[\s\-]?)?\d{3}[\s\-]?\d{4}\b",
-    "percent": r"\b\d{1,3}(?:[.,]\d+)?\s?(%|percent)\b",
-    "number": r"\b\d+(?:[.,]\d+)?\b"
+from collections import Counter
+from src.cache import cached_map
+from src.extractors import Runner
+from src.masking import (
+    MASK_AND_EXTRACT_PATTERNS, JUST_MASK_PATTERNS,
+    compile_patterns, mask_and_extract, mask_only
+)
+from src.models import get_nlp, SPACY_MODEL_VERSION
+
+# Defaults for batched spaCy execution via nlp.pipe
+SPACY_BATCH_SIZE = 256
+SPACY_N_PROCESS = 1
+
+# Pipeline components each task needs, None keeps the full pipeline.
+# The tagger listens to the shared tok2vec, so lemmatisation keeps it too.
+TASK_COMPONENTS = {
+    "analyse": None,
+    "lemmatize": ["tok2vec", "tagger", "attribute_ruler", "lemmatizer"],
+    "ner": ["ner"],
 }
 
 SPECIAL_TOKENS = [
@@ -26,27 +28,17 @@ def mask_and_extract_all(text, patterns=MASK_AND_EXTRACT_PATTERNS):
     '''
     Mask sensitive information in the text and extract it into a dictionary.
     '''
-    results = {}
-    masked_text = text
-    for key, pattern in patterns.items():
-        matches = re.findall(pattern, masked_text, flags=re.IGNORECASE)
-        matches = ["".join(m) if isinstance(m, tuple) else m for m in matches]
-        results[f"masked_{key}_list"] = matches
-        results[f"has_masked_{key}"] = len(matches) > 0
-        masked_text = re.sub(pattern, f" mask_{key} ", masked_text, flags=re.IGNORECASE)
-
-    results["masked_description"] = masked_text
-    return results
+    if patterns is MASK_AND_EXTRACT_PATTERNS:
+        return mask_and_extract(text)
+    return mask_and_extract(text, compile_patterns(patterns))
 
 def mask_other(text, patterns=JUST_MASK_PATTERNS):
     '''
     Just mask sensitive information in the text without extracting it.
     '''
-    masked_text = text
-    for key, pattern in patterns.items():
-        masked_text = re.sub(pattern, f" mask_{key} ", masked_text, flags=re.IGNORECASE)
-    return masked_text
-
+    if patterns is JUST_MASK_PATTERNS:
+        return mask_only(text)
+    return mask_only(text, compile_patterns(patterns))
 
 def ascii_ratio(text):
     ascii_count = sum(1 for c in text if ord(c) < 128)
@@ -72,69 +64,149 @@ def digit_ratio(text):
     else:
         return digit_count / text_length
 
-def detect_lang(text):
-    try:
-        if len(text.strip()) < 20:
-            return "short"
-        langs = detect_langs(text)
-        top = langs[0]
-        if top.lang == "en" and top.prob > 0.80:
-            return "en"
-        elif top.prob > 0.80:
-            return top.lang
-        else:
-            return "uncertain"
-    except:
-        return "error"
-
 def lemmatize_text(text):
     '''
     Lemmatize the text using spaCy. Have chosen to keep stop words due to open-ended nature of the project.
     '''
-    doc = nlp(text)
+    doc = get_nlp()(text)
     lemmas = [
         token.text if token.text in SPECIAL_TOKENS else token.lemma_
         for token in doc if not token.is_punct and not token.is_space
     ]
     return " ".join(lemmas)
 
-def advanced_doc_stats(df):
+def pipe_docs(texts, task="analyse", batch_size=SPACY_BATCH_SIZE):
+    '''
+    Run spaCy over the texts in batches with nlp.pipe, disabling the components the task doesn't need.
+    Always in this process: nlp.pipe's own n_process forks, which isn't safe once the stages run in threads.
+    '''
+    nlp = get_nlp()
+    keep = TASK_COMPONENTS[task]
+    disable = [] if keep is None else [name for name in nlp.pipe_names if name not in keep]
+    return nlp.pipe(texts, disable=disable, batch_size=batch_size)
+
+def lemmatize_texts(texts, batch_size=SPACY_BATCH_SIZE, n_process=SPACY_N_PROCESS):
+    '''
+    Batched version of lemmatize_text, only running the components lemmatisation needs.
+    Chunks of texts are spread across n_process spawned worker processes.
+    '''
+    if n_process > 1:
+        return Runner("process", n_jobs=n_process).map(lemmatize_texts, texts, batch_size=batch_size)
+    return [
+        " ".join(
+            token.text if token.text in SPECIAL_TOKENS else token.lemma_
+            for token in doc if not token.is_punct and not token.is_space
+        )
+        for doc in pipe_docs(texts, task="lemmatize", batch_size=batch_size)
+    ]
+
+def analyse_texts(texts, batch_size=SPACY_BATCH_SIZE, n_process=SPACY_N_PROCESS):
+    '''
+    Batched version of analyse_text, returning one document record per text.
+    Chunks of texts are spread across n_process spawned worker processes.
+    '''
+    if n_process > 1:
+        return Runner("process", n_jobs=n_process).map(analyse_texts, texts, batch_size=batch_size)
+    return [analyse_doc(doc) for doc in pipe_docs(texts, task="analyse", batch_size=batch_size)]
+
+def analyse_text(text):
+    '''
+    Parse the text once with spaCy and reduce it to a compact document record.
+    '''
+    return analyse_doc(get_nlp()(text))
+
+def analyse_doc(doc):
+    '''
+    Reduce a spaCy doc to the compact record shared by the doc stats, lemmatisation and NER features.
+    Each token is stored as (text, lemma, char offset, is_alpha, is_stop, is_punct or is_space).
+    '''
+    return {
+        "tokens": [
+            (tok.text, tok.lemma_, tok.idx, tok.is_alpha, tok.is_stop, tok.is_punct or tok.is_space)
+            for tok in doc
+        ],
+        "pos_counts": dict(Counter(tok.pos_ for tok in doc)),
+        "sentence_count": len(list(doc.sents)),
+        "entities": [(ent.label_, ent.text) for ent in doc.ents],
+    }
+
+def lemmatize_record(record, spans):
+    '''
+    Lemmatize from a document record instead of parsing the masked description again.
+    Tokens overlapping a masked span are replaced by a single mask token, everything else is lowercased.
+    '''
+    lemmas = []
+    span_idx = 0
+    emitted = -1
+    for text, lemma, start, _, _, skip in record["tokens"]:
+        end = start + len(text)
+        while span_idx < len(spans) and spans[span_idx][1] <= start:
+            span_idx += 1
+
+        if span_idx == len(spans) or spans[span_idx][0] >= end:
+            if not skip:
+                lemmas.append(lemma.lower())
+            continue
+
+        # Token overlaps one or more masked spans, keep any word characters left outside of them
+        pos = start
+        idx = span_idx
+        while idx < len(spans) and spans[idx][0] < end:
+            span_start, span_end, mask_token = spans[idx]
+            append_fragment(lemmas, text[pos - start:max(span_start, pos) - start])
+            if emitted != idx:
+                lemmas.append(mask_token)
+                emitted = idx
+            pos = min(max(pos, span_end), end)
+            idx += 1
+        append_fragment(lemmas, text[pos - start:])
+    return " ".join(lemmas)
+
+def append_fragment(lemmas, fragment):
+    if any(c.isalnum() for c in fragment):
+        lemmas.append(fragment.lower())
+
+def advanced_doc_stats(df, batch_size=SPACY_BATCH_SIZE, n_process=SPACY_N_PROCESS):
     '''
     Adds some more advanced document stats based on the cleaned and lemmatized descriptions
     '''
-    # Create spacy doc objects for getting advanced stats
-    df["cleaned_doc"] = df["cleaned_description"].apply(lambda x: nlp(x))
+    # Parse each cleaned description once, the record is reused for lemmatisation and NER
+    df["doc_record"] = cached_map(
+        "doc_record", SPACY_MODEL_VERSION, df["cleaned_description"],
+        lambda texts: analyse_texts(texts, batch_size=batch_size, n_process=n_process)
+    )
 
     # Calculate advanced stats
-    df["stopword_ratio"] = df["cleaned_doc"].apply(stopword_ratio)
-    df["unique_word_ratio"] = df["cleaned_doc"].apply(unique_word_ratio)
-    df["noun_verb_ratio"] = df["cleaned_doc"].apply(noun_verb_ratio)
-    df["sentence_count"] = df["cleaned_doc"].apply(sentence_count)
-    df["avg_word_length"] = df["cleaned_doc"].apply(avg_word_length)
+    df["stopword_ratio"] = df["doc_record"].apply(stopword_ratio)
+    df["unique_word_ratio"] = df["doc_record"].apply(unique_word_ratio)
+    df["noun_verb_ratio"] = df["doc_record"].apply(noun_verb_ratio)
+    df["sentence_count"] = df["doc_record"].apply(sentence_count)
+    df["avg_word_length"] = df["doc_record"].apply(avg_word_length)
 
     return df
 
-def stopword_ratio(doc):
-    if len(doc) == 0:
+def stopword_ratio(record):
+    tokens = record["tokens"]
+    if len(tokens) == 0:
         return 0.0
-    return sum(1 for tok in doc if tok.is_stop) / len(doc)
+    return sum(1 for tok in tokens if tok[4]) / len(tokens)
 
-def unique_word_ratio(doc):
-    tokens = [tok.lemma_ for tok in doc if not tok.is_punct and not tok.is_space]
-    if len(tokens) == 0:
+def unique_word_ratio(record):
+    lemmas = [tok[1] for tok in record["tokens"] if not tok[5]]
+    if len(lemmas) == 0:
         return 0.0
-    return len(set(tokens)) / len(tokens)
+    return len(set(lemmas)) / len(lemmas)
 
-def noun_verb_ratio(doc):
-    num_nouns = sum(1 for tok in doc if tok.pos_ == "NOUN")
-    num_verbs = sum(1 for tok in doc if tok.pos_ == "VERB")
+def noun_verb_ratio(record):
+    num_nouns = record["pos_counts"].get("NOUN", 0)
+    num_verbs = record["pos_counts"].get("VERB", 0)
     return num_nouns / (num_verbs + 1)  # Avoid div-by-zero
 
-def sentence_count(doc):
-    return len(list(doc.sents))
+def sentence_count(record):
+    return record["sentence_count"]
 
-def avg_word_length(doc):
-    words = [tok.text for tok in doc if tok.is_alpha]
+def avg_word_length(record):
+    words = [tok[0] for tok in record["tokens"] if tok[3]]
     if len(words) == 0:
         return 0.0
     return sum(len(w) for w in words) / len(words)
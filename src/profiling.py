@@ -0,0 +1,257 @@
+import json
+import os
+import platform
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Seconds between memory samples while any span is open
+MEMORY_SAMPLE_INTERVAL = 0.1
+PROFILERS = ["cprofile", "py-spy"]
+
+def rss_mb(include_children=True):
+    '''
+    Resident memory of this process in MB, plus its worker processes (spaCy, plotting) if psutil is installed.
+    '''
+    try:
+        import psutil
+    except ImportError:
+        try:
+            with open("/proc/self/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) / 1024
+        except OSError:
+            pass
+        import resource
+        # Only the peak is available here, Linux reports kilobytes and macOS bytes
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    process = psutil.Process()
+    rss = process.memory_info().rss
+    if include_children:
+        for child in process.children(recursive=True):
+            try:
+                rss += child.memory_info().rss
+            except psutil.Error:
+                pass
+    return rss / (1024 * 1024)
+
+class Span:
+    '''
+    One timed step: how long it took, how many documents it handled and the peak memory while it ran.
+    '''
+    def __init__(self, name, n_docs=None, start=0.0, rss=0.0):
+        self.name = name
+        self.n_docs = n_docs
+        self.thread = threading.current_thread().name
+        self.start = start
+        self.seconds = None
+        self.start_rss_mb = rss
+        self.peak_rss_mb = rss
+
+    @property
+    def docs_per_second(self):
+        if not self.n_docs or not self.seconds:
+            return None
+        return self.n_docs / self.seconds
+
+    def to_dict(self):
+        return {
+            "name": self.name, "thread": self.thread, "start": round(self.start, 4),
+            "seconds": round(self.seconds, 4) if self.seconds is not None else None,
+            "n_docs": self.n_docs, "docs_per_second": self.docs_per_second,
+            "start_rss_mb": round(self.start_rss_mb, 1), "peak_rss_mb": round(self.peak_rss_mb, 1),
+        }
+
+class Recorder:
+    '''
+    Collects the spans of a run from every thread. While any span is open a background thread samples
+    the memory, so each span gets the peak it reached rather than only its start and end values.
+    '''
+    def __init__(self, sample_interval=MEMORY_SAMPLE_INTERVAL):
+        self.sample_interval = sample_interval
+        self.created_at = time.strftime("%Y-%m-%dT%H:%M:%S")
+        self.origin = time.perf_counter()
+        self.lock = threading.Lock()
+        self.spans = []
+        self.open = set()
+        self.peak_rss_mb = 0.0
+        self.sampler = None
+        self.stopped = threading.Event()
+
+    def observe(self, rss):
+        with self.lock:
+            self.peak_rss_mb = max(self.peak_rss_mb, rss)
+            for span in self.open:
+                span.peak_rss_mb = max(span.peak_rss_mb, rss)
+
+    def sample(self):
+        while not self.stopped.wait(self.sample_interval):
+            if self.open:
+                self.observe(rss_mb())
+
+    @contextmanager
+    def span(self, name, n_docs=None):
+        '''
+        Time the block as the span name. n_docs can be passed in, or set on the yielded span once known.
+        '''
+        rss = rss_mb()
+        span = Span(name, n_docs=n_docs, start=time.perf_counter() - self.origin, rss=rss)
+        with self.lock:
+            self.open.add(span)
+            # The sampler is only started by the first span, so importing this module costs nothing
+            if self.sampler is None:
+                self.sampler = threading.Thread(target=self.sample, name="memory-sampler", daemon=True)
+                self.sampler.start()
+        self.observe(rss)
+        try:
+            yield span
+        finally:
+            span.seconds = time.perf_counter() - self.origin - span.start
+            self.observe(rss_mb())
+            with self.lock:
+                self.open.discard(span)
+                self.spans.append(span)
+
+    def totals(self):
+        '''
+        Spans aggregated by name (steps that run once per chunk appear once), in order of first start.
+        '''
+        totals = defaultdict(lambda: {"count": 0, "seconds": 0.0, "n_docs": 0, "peak_rss_mb": 0.0})
+        for span in sorted(self.spans, key=lambda span: span.start):
+            total = totals[span.name]
+            total["count"] += 1
+            total["seconds"] += span.seconds
+            total["n_docs"] += span.n_docs or 0
+            total["peak_rss_mb"] = max(total["peak_rss_mb"], span.peak_rss_mb)
+        for total in totals.values():
+            total["docs_per_second"] = total["n_docs"] / total["seconds"] if total["n_docs"] and total["seconds"] else None
+            total["seconds"] = round(total["seconds"], 4)
+            total["peak_rss_mb"] = round(total["peak_rss_mb"], 1)
+        return dict(totals)
+
+    def report(self, **extra):
+        '''
+        The machine-readable run report: environment, totals per span name and every span.
+        '''
+        with self.lock:
+            spans = sorted(self.spans, key=lambda span: span.start)
+        return {
+            "created_at": self.created_at,
+            "argv": sys.argv,
+            "machine": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+            "seconds": round(time.perf_counter() - self.origin, 4),
+            "peak_rss_mb": round(max(self.peak_rss_mb, rss_mb()), 1),
+            **extra,
+            "totals": self.totals(),
+            "spans": [span.to_dict() for span in spans],
+        }
+
+    def write_report(self, path, **extra):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(**extra), f, indent=2, default=str)
+
+    def print_summary(self):
+        print("Timings:")
+        for name, total in self.totals().items():
+            rate = f"{total['docs_per_second']:10.1f} docs/s" if total["docs_per_second"] else " " * 17
+            print(f"- {name:<28} {total['seconds']:9.2f}s {rate} {total['peak_rss_mb']:8.1f} MB peak")
+
+    def close(self):
+        self.stopped.set()
+
+_recorder = None
+
+def get_recorder():
+    global _recorder
+    if _recorder is None:
+        _recorder = Recorder()
+    return _recorder
+
+def span(name, n_docs=None):
+    '''
+    Time a step of the run under name, recorded in the run report. Usable from any thread.
+    '''
+    return get_recorder().span(name, n_docs=n_docs)
+
+class ThreadProfiler:
+    '''
+    cProfile for the main thread and every thread started while it runs (extractors and stages run in threads).
+    From Python 3.12 one profiler already sees every thread.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.profiles = []
+
+    def start(self):
+        import cProfile
+        if sys.version_info < (3, 12):
+            threading.setprofile(self.start_thread)
+        self.add_profile(cProfile.Profile())
+
+    def start_thread(self, frame, event, arg):
+        # Called once at the start of each new thread, which then gets its own profiler instead of this hook
+        import cProfile
+        sys.setprofile(None)
+        self.add_profile(cProfile.Profile())
+
+    def add_profile(self, profile):
+        with self.lock:
+            self.profiles.append(profile)
+        profile.enable()
+
+    def stop(self, path):
+        import pstats
+        threading.setprofile(None)
+        with self.lock:
+            for profile in self.profiles:
+                profile.disable()
+            pstats.Stats(*self.profiles).dump_stats(path)
+
+@contextmanager
+def capture_profile(profiler, path):
+    '''
+    Profile the block with cProfile (a .prof file for pstats or snakeviz) or by attaching py-spy
+    (a speedscope JSON, including worker processes). profiler None does nothing.
+    '''
+    if profiler is None:
+        yield
+        return
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    if profiler == "cprofile":
+        thread_profiler = ThreadProfiler()
+        thread_profiler.start()
+        try:
+            yield
+        finally:
+            thread_profiler.stop(path)
+            print(f"cProfile stats saved to {path}.")
+        return
+    if profiler != "py-spy":
+        raise ValueError(f"Unknown profiler {profiler!r}, expected one of {PROFILERS}")
+
+    import shutil
+    import signal
+    import subprocess
+    executable = shutil.which("py-spy")
+    if executable is None:
+        print("py-spy is not on the PATH, running without profiling.")
+        yield
+        return
+    recorder = subprocess.Popen(
+        [executable, "record", "--pid", str(os.getpid()), "--subprocesses", "--format", "speedscope", "--output", path],
+        stdout=subprocess.DEVNULL
+    )
+    try:
+        yield
+    finally:
+        # py-spy writes its output when interrupted
+        recorder.send_signal(signal.SIGINT)
+        recorder.wait()
+        print(f"py-spy profile saved to {path}.")
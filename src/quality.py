@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+
+# Thresholds a description has to pass before any expensive processing
+MIN_CHAR_COUNT = 40
+MIN_WORD_COUNT = 10
+MIN_ASCII_RATIO = 0.6
+MAX_SYMBOL_RATIO = 0.15
+
+# Number of texts encoded into one code point buffer, bounds memory at ~4 bytes per character
+QUALITY_BATCH_SIZE = 20_000
+
+def char_classes(codepoints):
+    '''
+    Classify code points as (is_space, is_symbol, is_digit), using the same str methods as the
+    original per-character loops. Only the distinct code points present are checked in Python.
+    '''
+    unique, inverse = np.unique(codepoints, return_inverse=True)
+    chars = [chr(cp) for cp in unique]
+    is_space = np.fromiter((c.isspace() for c in chars), dtype=bool, count=len(chars))
+    is_symbol = np.fromiter((not c.isalnum() and not c.isspace() for c in chars), dtype=bool, count=len(chars))
+    is_digit = np.fromiter((c.isdigit() for c in chars), dtype=bool, count=len(chars))
+    return is_space[inverse], is_symbol[inverse], is_digit[inverse]
+
+def segment_sums(flags, starts, ends):
+    '''
+    Count the True flags in each [start, end) segment of the buffer.
+    '''
+    cumulative = np.concatenate([[0], np.cumsum(flags, dtype=np.int64)])
+    return cumulative[ends] - cumulative[starts]
+
+def batch_quality_metrics(texts):
+    '''
+    Compute the quality metrics for a list of texts in one pass over a shared UTF-32 code point buffer.
+    '''
+    lengths = np.fromiter((len(text) for text in texts), dtype=np.int64, count=len(texts))
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+    codepoints = np.frombuffer("".join(texts).encode("utf-32-le", "surrogatepass"), dtype=np.uint32)
+
+    is_space, is_symbol, is_digit = char_classes(codepoints)
+
+    # A word starts at a non-space character that follows a space or the start of its text, like str.split()
+    follows_space = np.concatenate([[True], is_space[:-1]])
+    follows_space[starts[lengths > 0]] = True
+    word_starts = ~is_space & follows_space
+
+    safe_lengths = np.maximum(lengths, 1)
+    has_text = lengths > 0
+    return {
+        "char_count": lengths,
+        "word_count": segment_sums(word_starts, starts, ends),
+        "ascii_ratio": np.where(has_text, segment_sums(codepoints < 128, starts, ends) / safe_lengths, 0.0),
+        "symbol_ratio": np.where(has_text, segment_sums(is_symbol, starts, ends) / safe_lengths, 0.0),
+        "digit_ratio": np.where(has_text, segment_sums(is_digit, starts, ends) / safe_lengths, 0.0),
+    }
+
+def text_quality_metrics(texts, batch_size=QUALITY_BATCH_SIZE):
+    '''
+    Vectorised char_count, word_count, ascii_ratio, symbol_ratio and digit_ratio for a column of texts.
+    Returns a DataFrame with the same index as texts.
+    '''
+    texts = pd.Series(texts)
+    values = texts.tolist()
+    batches = [
+        batch_quality_metrics(values[i:i + batch_size])
+        for i in range(0, len(values), batch_size)
+    ]
+    columns = ["char_count", "word_count", "ascii_ratio", "symbol_ratio", "digit_ratio"]
+    if not batches:
+        return pd.DataFrame(columns=columns, index=texts.index)
+    metrics = pd.DataFrame(
+        {col: np.concatenate([batch[col] for batch in batches]) for col in columns},
+        index=texts.index
+    )
+    metrics["char_count"] = metrics["char_count"].astype(int)
+    metrics["word_count"] = metrics["word_count"].astype(int)
+    return metrics
+
+def passes_quality_thresholds(metrics):
+    '''
+    Boolean mask of the rows that pass the length, ASCII and symbol thresholds.
+    '''
+    return (
+        (metrics["char_count"] >= MIN_CHAR_COUNT)
+        & (metrics["word_count"] >= MIN_WORD_COUNT)
+        & (metrics["ascii_ratio"] >= MIN_ASCII_RATIO)
+        & (metrics["symbol_ratio"] <= MAX_SYMBOL_RATIO)
+    )
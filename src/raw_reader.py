@@ -0,0 +1,314 @@
+import bisect
+import csv
+import io
+import os
+import re
+import threading
+from collections import Counter
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+
+# Bytes of CSV parsed at a time, each block comes back as one batch of rows
+BLOCK_SIZE = 16 << 20
+# Columns of the raw CSV, for files without a header
+RAW_COLUMNS = ["Unnamed: 0", "id", "company_description", "source", "is_edited", "created_at"]
+# The free-text column, separators found inside a broken record are kept as part of it
+TEXT_COLUMN = "company_description"
+INTEGER_PATTERN = r"^\s*-?\d+\s*$"
+# Patterns a value has to match for its row to count as well-formed
+PATTERNS = {
+    "Unnamed: 0": INTEGER_PATTERN,
+    "id": INTEGER_PATTERN,
+    "is_edited": r"^\s*[01]\s*$",
+    "created_at": r"^\s*\d{4}-\d{2}-\d{2}([ T]\d{2}:\d{2}(:\d{2}(\.\d+)?)?)?(Z|[+-]\d{2}:?\d{2})?\s*$",
+}
+# Values outside the pattern are still accepted here if pandas can parse them as a timestamp
+TIMESTAMP_COLUMNS = ["created_at"]
+# Columns whose value has to be one already seen in well-formed rows
+CATEGORICAL_COLUMNS = ["source"]
+# Values given to trailing fields a repaired record lacks, categorical columns get their most common value
+FILL_VALUES = {"is_edited": "0"}
+# A broken record is closed after this many continuation lines
+MAX_CONTINUATION_LINES = 100
+# Repairs printed as they are made, the rest are only counted
+MAX_REPAIRS_PRINTED = 20
+
+def parse_timestamps(values):
+    '''
+    Parse a Series of strings as timestamps, NaT where they can't be parsed. ISO 8601 values are parsed
+    in one vectorised pass, only the values that fail it are parsed one at a time.
+    '''
+    parsed = pd.to_datetime(values, errors="coerce", format="ISO8601")
+    retry = (parsed.isna() & values.notna()).to_numpy()
+    if retry.any():
+        parsed[retry] = pd.to_datetime(values[retry], errors="coerce", format="mixed")
+    return parsed
+
+def valid_rows(batch):
+    '''
+    Boolean mask of the rows of a record batch whose values all pass PATTERNS, checked with Arrow kernels.
+    '''
+    mask = np.ones(batch.num_rows, dtype=bool)
+    for column, pattern in PATTERNS.items():
+        if column not in batch.schema.names:
+            continue
+        values = batch.column(column)
+        matches = pc.fill_null(pc.match_substring_regex(values, pattern), False).to_numpy(zero_copy_only=False).copy()
+        if column in TIMESTAMP_COLUMNS and not matches.all():
+            retry = np.flatnonzero(~matches)
+            matches[retry] = parse_timestamps(values.take(retry).to_pandas()).notna().to_numpy()
+        mask &= matches
+    return mask
+
+def read_header(path):
+    '''
+    The column names of the CSV, RAW_COLUMNS for an empty file.
+    '''
+    with open(path, newline="", encoding="utf-8") as f:
+        header = next(csv.reader(f), None)
+    if header is None:
+        return list(RAW_COLUMNS)
+    # Unnamed columns get the names pandas gives them
+    return [name or f"Unnamed: {i}" for i, name in enumerate(header)]
+
+def split_fields(text):
+    '''
+    The CSV fields of a line, or of several lines joined together. Line breaks outside quotes are
+    read as spaces within the field they fall in.
+    '''
+    rows = list(csv.reader(io.StringIO(text))) or [[]]
+    fields = rows[0]
+    for row in rows[1:]:
+        if fields and row:
+            fields[-1] = f"{fields[-1]} {row[0]}"
+            row = row[1:]
+        fields += row
+    return fields
+
+def to_csv_line(values):
+    line = io.StringIO()
+    csv.writer(line, lineterminator="").writerow(["" if value is None else value for value in values])
+    return line.getvalue()
+
+class RecordRepairer:
+    '''
+    Rebuilds the records the parser couldn't read, from the rows with the wrong number of fields and the
+    rows whose values fail PATTERNS, taken in file order.
+
+    A row starting with a valid index and id opens a record, the rows straight after it are continuation
+    lines (a description broken over several lines) and are joined onto it with a space until its last
+    fields validate. Fields beyond the expected count stay in the description, they come from separators
+    in the text. A record still incomplete when the next well-formed row or record starts is closed with
+    its missing trailing fields filled in. Rows that belong to no record are dropped.
+    Every repair and dropped row is recorded in repairs.
+    '''
+    def __init__(self, columns, text_column=TEXT_COLUMN):
+        self.columns = list(columns)
+        self.n_leading = self.columns.index(text_column)
+        self.trailing = self.columns[self.n_leading + 1:]
+        self.seen = {column: Counter() for column in CATEGORICAL_COLUMNS if column in self.columns}
+        # (row number, text) of the rows waiting to be resolved
+        self.waiting = []
+        # Row numbers and lines of the open record
+        self.numbers = []
+        self.lines = []
+        self.repairs = []
+
+    def observe(self, batch):
+        '''
+        Count the categorical values of well-formed rows, broken records are checked against them.
+        '''
+        for column, counts in self.seen.items():
+            for entry in pc.value_counts(batch.column(column)).to_pylist():
+                if entry["values"] is not None:
+                    counts[entry["values"]] += entry["counts"]
+
+    def add(self, number, text):
+        self.waiting.append((number, text))
+
+    def valid(self, column, value):
+        if value is None:
+            return False
+        if column in PATTERNS:
+            if re.match(PATTERNS[column], value):
+                return True
+            return column in TIMESTAMP_COLUMNS and parse_timestamps(pd.Series([value])).notna().iloc[0]
+        if column in self.seen:
+            return value in self.seen[column]
+        return True
+
+    def fill_value(self, column):
+        if column in FILL_VALUES:
+            return FILL_VALUES[column]
+        if self.seen.get(column):
+            return self.seen[column].most_common(1)[0][0]
+        return None
+
+    def starts_record(self, fields):
+        return len(fields) > self.n_leading and all(
+            self.valid(column, value) for column, value in zip(self.columns[:self.n_leading], fields)
+        )
+
+    def assemble(self, fields, fill=False):
+        '''
+        The record held by fields as {column: value}: the leading and trailing fields are its columns before
+        and after the text column, whatever lies between is the text. Returns (record, filled columns), the
+        record is None when a trailing field doesn't validate, unless fill gives it a default value.
+        '''
+        rest = list(fields[self.n_leading:])
+        trailing, filled = {}, []
+        # With the right number of fields every field is in its place, only the invalid ones are filled
+        in_place = fill and len(fields) == len(self.columns)
+        for column in reversed(self.trailing):
+            if in_place and not self.valid(column, rest[-1]):
+                rest.pop()
+                trailing[column] = self.fill_value(column)
+                filled.append(column)
+            elif len(rest) > 1 and self.valid(column, rest[-1]):
+                trailing[column] = rest.pop()
+            elif fill:
+                trailing[column] = self.fill_value(column)
+                filled.append(column)
+            else:
+                return None, []
+        record = dict(zip(self.columns, fields[:self.n_leading]))
+        record[self.columns[self.n_leading]] = ",".join(rest).strip()
+        record.update(trailing)
+        return record, filled[::-1]
+
+    def close(self, force=True):
+        '''
+        Close the open record if it is complete (any time with force). Returns [(row number, record)].
+        '''
+        if not self.numbers:
+            return []
+        record, filled = self.assemble(split_fields(" ".join(self.lines)), fill=force)
+        if record is None:
+            return []
+        numbers = self.numbers
+        self.report({"id": record["id"], "rows": [numbers[0], numbers[-1]], "lines": len(numbers), "filled": filled})
+        self.numbers, self.lines = [], []
+        return [(numbers[0], record)]
+
+    def resolve(self, upto=None):
+        '''
+        Resolve the waiting rows numbered up to upto (all of them if None). A record still open at upto
+        stays open, its continuation lines can be in the next batch. Returns [(row number, record)].
+        '''
+        self.waiting.sort()
+        split = len(self.waiting) if upto is None else bisect.bisect_right(self.waiting, (upto, chr(0x10ffff)))
+        ready, self.waiting = self.waiting[:split], self.waiting[split:]
+        records = []
+        for number, text in ready:
+            fields = split_fields(text)
+            starts = self.starts_record(fields)
+            if self.numbers and number == self.numbers[-1] + 1 and not starts:
+                self.numbers.append(number)
+                self.lines.append(text)
+                records += self.close(force=len(self.lines) > MAX_CONTINUATION_LINES)
+                continue
+            records += self.close()
+            if starts:
+                self.numbers, self.lines = [number], [text]
+                records += self.close(force=False)
+            else:
+                self.report({"id": None, "rows": [number, number], "lines": 1, "text": text})
+        # The row after the open record is well-formed, so the record can't go on
+        if self.numbers and (upto is None or self.numbers[-1] < upto):
+            records += self.close()
+        return records
+
+    def report(self, repair):
+        self.repairs.append(repair)
+        if len(self.repairs) <= MAX_REPAIRS_PRINTED:
+            print(describe_repair(repair))
+        elif len(self.repairs) == MAX_REPAIRS_PRINTED + 1:
+            print("Further repairs are only counted.")
+
+    def print_summary(self):
+        if not self.repairs:
+            return
+        dropped = sum(repair["id"] is None for repair in self.repairs)
+        print(f"Repaired {len(self.repairs) - dropped} malformed records, dropped {dropped} rows belonging to none.")
+
+def describe_repair(repair):
+    first, last = repair["rows"]
+    if repair["id"] is None:
+        return f"Dropped row {first}, not part of any record: {repair['text'][:60]!r}"
+    rows = f"rows {first}-{last}" if last > first else f"row {first}"
+    filled = f", filled in {', '.join(repair['filled'])}" if repair["filled"] else ""
+    return f"Repaired record id {repair['id'].strip()} from {rows}{filled}"
+
+def merge_repaired(df, numbers, repaired, columns):
+    '''
+    Put the repaired records into the well-formed rows of a batch, each at the row its record started on.
+    '''
+    if not repaired:
+        return df
+    extra = pd.DataFrame([record for _, record in repaired], columns=columns)
+    order = np.argsort(np.concatenate([numbers, [number for number, _ in repaired]]), kind="stable")
+    return pd.concat([df, extra], ignore_index=True).iloc[order].reset_index(drop=True)
+
+def read_batches(path, block_size=BLOCK_SIZE, repairer=None):
+    '''
+    Read a raw CSV as DataFrames of string columns, one per block of block_size bytes, in file order.
+
+    Arrow's multithreaded parser reads the file, well-formed rows never go through Python. Rows with the
+    wrong number of fields are handed back by the parser and rows failing PATTERNS are found with vectorised
+    checks, only those go to the RecordRepairer (pass one in to look at its repairs afterwards).
+    '''
+    columns = read_header(path)
+    if os.path.getsize(path) == 0:
+        return
+    repairer = repairer or RecordRepairer(columns)
+    failed, lock = [], threading.Lock()
+
+    def on_invalid(row):
+        with lock:
+            failed.append((row.number, row.text))
+        return "skip"
+
+    reader = pa_csv.open_csv(
+        path,
+        read_options=pa_csv.ReadOptions(block_size=block_size, column_names=columns, skip_rows=1),
+        parse_options=pa_csv.ParseOptions(newlines_in_values=True, invalid_row_handler=on_invalid),
+        convert_options=pa_csv.ConvertOptions(
+            column_types={column: pa.string() for column in columns}, strings_can_be_null=True
+        ),
+    )
+    # Rows are numbered from 1 with the header, the parser numbers the rows it skips the same way
+    next_number = 2
+    skipped = np.empty(0, dtype=np.int64)
+    for batch in reader:
+        with lock:
+            new, failed[:] = failed[:], []
+        for number, text in new:
+            repairer.add(number, text)
+        skipped = np.union1d(skipped, [number for number, _ in new]).astype(np.int64)
+        if batch.num_rows == 0:
+            continue
+        # A batch's rows take the next numbers the parser didn't skip, every skipped row up to the end
+        # of the batch has been handed back by the time it arrives
+        skipped = skipped[skipped >= next_number]
+        numbers = np.setdiff1d(
+            np.arange(next_number, next_number + batch.num_rows + len(skipped)), skipped, assume_unique=True
+        )[:batch.num_rows]
+        next_number = numbers[-1] + 1
+
+        mask = valid_rows(batch)
+        repairer.observe(batch.filter(mask))
+        for number, row in zip(numbers[~mask], batch.filter(~mask).to_pylist()):
+            repairer.add(int(number), to_csv_line(row.values()))
+        df = batch.filter(mask).to_pandas()
+        yield merge_repaired(df, numbers[mask], repairer.resolve(upto=int(numbers[-1])), columns)
+
+    with lock:
+        for number, text in failed:
+            repairer.add(number, text)
+    repaired = repairer.resolve()
+    if repaired:
+        yield merge_repaired(pd.DataFrame(columns=columns), np.empty(0, dtype=np.int64), repaired, columns)
+    repairer.print_summary()
@@ -0,0 +1,295 @@
+import numpy as np
+import pandas as pd
+
+# Queries and index rows scored together in one matrix multiply, bounds each score block at 1024 x 65536 floats
+QUERY_BLOCK_SIZE = 1024
+INDEX_BLOCK_SIZE = 65_536
+
+# Below this many rows exact search is fast enough, above it an IVF index is built by default
+IVF_MIN_ROWS = 100_000
+# Inverted lists scanned per query, more probes give better recall and slower queries
+DEFAULT_N_PROBE = 8
+# Rows used to fit the IVF centroids
+IVF_TRAINING_SAMPLE = 100_000
+
+def normalise_rows(vectors):
+    '''
+    Unit-length float32 rows, so a dot product is the cosine similarity.
+    '''
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+def top_k(scores, k):
+    '''
+    Column positions and scores of the k highest scores in each row, best first.
+    '''
+    k = min(k, scores.shape[1])
+    if k == 0:
+        return np.empty((len(scores), 0), dtype=np.int64), np.empty((len(scores), 0), dtype=np.float32)
+    if k < scores.shape[1]:
+        positions = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        positions = np.broadcast_to(np.arange(scores.shape[1]), scores.shape).copy()
+    values = np.take_along_axis(scores, positions, axis=1)
+    order = np.argsort(-values, axis=1, kind="stable")
+    return np.take_along_axis(positions, order, axis=1), np.take_along_axis(values, order, axis=1)
+
+class SimilarityIndex:
+    '''
+    Cosine similarity search over the sentence embeddings, keyed by company id.
+
+    Without centroids every query is scored against every row, block by block (exact search).
+    With centroids the rows are split into inverted lists by their closest centroid and a query only
+    scans the n_probe lists closest to it (IVF), trading a little recall for much faster queries.
+    '''
+    def __init__(self, ids, vectors, centroids=None, assignments=None, n_probe=DEFAULT_N_PROBE):
+        self.ids = np.asarray(ids)
+        self.vectors = normalise_rows(vectors) if len(ids) else np.empty((0, 0), dtype=np.float32)
+        self.centroids = centroids
+        self.assignments = assignments
+        self.n_probe = n_probe
+        self.refresh()
+
+    def refresh(self):
+        self.id_to_row = {id_: row for row, id_ in enumerate(self.ids.tolist())}
+        self.lists = None
+        if self.centroids is not None:
+            order = np.argsort(self.assignments, kind="stable")
+            bounds = np.searchsorted(self.assignments[order], np.arange(len(self.centroids) + 1))
+            self.lists = [order[bounds[i]:bounds[i + 1]] for i in range(len(self.centroids))]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def assign(self, vectors):
+        return (vectors @ self.centroids.T).argmax(axis=1)
+
+    def add(self, ids, embeddings):
+        '''
+        Insert new companies. Ids already in the index have their embedding replaced.
+        '''
+        ids = np.asarray(ids)
+        vectors = normalise_rows(embeddings)
+        if len(self) == 0:
+            self.ids, self.vectors = ids, vectors
+            if self.centroids is not None:
+                self.assignments = self.assign(vectors)
+            self.refresh()
+            return
+
+        rows = np.array([self.id_to_row.get(id_, -1) for id_ in ids.tolist()], dtype=np.int64)
+        existing = rows >= 0
+        self.vectors[rows[existing]] = vectors[existing]
+        self.ids = np.concatenate([self.ids, ids[~existing]])
+        self.vectors = np.vstack([self.vectors, vectors[~existing]])
+        if self.centroids is not None:
+            self.assignments[rows[existing]] = self.assign(vectors[existing])
+            self.assignments = np.concatenate([self.assignments, self.assign(vectors[~existing])])
+        self.refresh()
+
+    def remove(self, ids):
+        '''
+        Drop companies from the index, ids that aren't in it are ignored.
+        '''
+        keep = ~np.isin(self.ids, list(ids))
+        self.ids = self.ids[keep]
+        self.vectors = self.vectors[keep]
+        if self.centroids is not None:
+            self.assignments = self.assignments[keep]
+        self.refresh()
+
+    def search(self, embeddings, k=10, exclude_rows=None):
+        '''
+        Top k rows for each query embedding. exclude_rows holds one row per query to leave out
+        (the query's own row when searching by id), -1 for none.
+        Returns (rows, scores) arrays of shape (n_queries, k), padded with -1 and -inf when the index is smaller.
+        '''
+        queries = normalise_rows(embeddings)
+        if exclude_rows is None:
+            exclude_rows = np.full(len(queries), -1, dtype=np.int64)
+        rows = np.full((len(queries), k), -1, dtype=np.int64)
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+
+        for start in range(0, len(queries), QUERY_BLOCK_SIZE):
+            block = slice(start, start + QUERY_BLOCK_SIZE)
+            if self.lists is None:
+                block_rows, block_scores = self.exact_search(queries[block], k, exclude_rows[block])
+            else:
+                block_rows, block_scores = self.ivf_search(queries[block], k, exclude_rows[block])
+            rows[block, :block_rows.shape[1]] = block_rows
+            scores[block, :block_scores.shape[1]] = block_scores
+        return rows, scores
+
+    def exact_search(self, queries, k, exclude_rows):
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        for start in range(0, len(self), INDEX_BLOCK_SIZE):
+            scores = queries @ self.vectors[start:start + INDEX_BLOCK_SIZE].T
+            excluded = exclude_rows[:, None] - start == np.arange(scores.shape[1])
+            scores[excluded] = -np.inf
+            positions, values = top_k(scores, k)
+            # Merge the block's best with the best so far
+            merged_rows = np.concatenate([best_rows, positions + start], axis=1)
+            merged_scores = np.concatenate([best_scores, values], axis=1)
+            positions, best_scores = top_k(merged_scores, k)
+            best_rows = np.take_along_axis(merged_rows, positions, axis=1)
+        return drop_excluded(best_rows, best_scores)
+
+    def ivf_search(self, queries, k, exclude_rows):
+        probes, _ = top_k(queries @ self.centroids.T, self.n_probe)
+        rows = np.full((len(queries), k), -1, dtype=np.int64)
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        for i, query in enumerate(queries):
+            candidates = np.concatenate([self.lists[p] for p in probes[i]])
+            candidates = candidates[candidates != exclude_rows[i]]
+            candidate_scores = (self.vectors[candidates] @ query).reshape(1, -1)
+            positions, values = top_k(candidate_scores, k)
+            rows[i, :positions.shape[1]] = candidates[positions[0]]
+            scores[i, :values.shape[1]] = values[0]
+        return rows, scores
+
+    def query_ids(self, ids, k=10):
+        '''
+        The k most similar companies to each of the given company ids, the company itself left out.
+        '''
+        query_rows = np.array([self.id_to_row[id_] for id_ in ids], dtype=np.int64)
+        rows, scores = self.search(self.vectors[query_rows], k=k, exclude_rows=query_rows)
+        return self.results_frame(list(ids), rows, scores)
+
+    def query_texts(self, texts, k=10):
+        '''
+        The k most similar companies to each raw text, encoded with the sentence embedding model.
+        '''
+        from src.models import get_embedding_engine
+        texts = list(texts)
+        rows, scores = self.search(get_embedding_engine().encode(texts), k=k)
+        return self.results_frame(texts, rows, scores)
+
+    def results_frame(self, queries, rows, scores):
+        '''
+        Long-format results: one row per (query, rank) pair, with the similar company id and its score.
+        '''
+        found = rows >= 0
+        query_index, rank = np.nonzero(found)
+        return pd.DataFrame({
+            "query": np.asarray(queries, dtype=object)[query_index],
+            "rank": rank + 1,
+            "id": self.ids[rows[found]],
+            "score": scores[found],
+        })
+
+    def save(self, path):
+        np.savez(
+            path,
+            ids=self.ids,
+            vectors=self.vectors,
+            centroids=self.centroids if self.centroids is not None else np.empty((0, 0), dtype=np.float32),
+            assignments=self.assignments if self.assignments is not None else np.empty(0, dtype=np.int64),
+            n_probe=self.n_probe,
+        )
+
+def drop_excluded(rows, scores):
+    '''
+    Mark positions that only hold excluded or missing rows (score -inf) as -1.
+    '''
+    rows = rows.copy()
+    rows[np.isneginf(scores)] = -1
+    return rows, scores
+
+def build_index(ids, embeddings, method="auto", n_lists=None, n_probe=DEFAULT_N_PROBE):
+    '''
+    Build a similarity index. method is "exact", "ivf" or "auto" (IVF from IVF_MIN_ROWS rows).
+    n_lists defaults to about sqrt(rows) inverted lists.
+    '''
+    vectors = normalise_rows(embeddings)
+    if method == "auto":
+        method = "ivf" if len(vectors) >= IVF_MIN_ROWS else "exact"
+    if method == "exact":
+        return SimilarityIndex(ids, vectors)
+
+    # Only needed for IVF, kept out of the module imports so loading an index for queries stays quick
+    from sklearn.cluster import MiniBatchKMeans
+    n_lists = n_lists or max(1, int(np.sqrt(len(vectors))))
+    rng = np.random.default_rng(42)
+    sample = vectors[rng.choice(len(vectors), min(len(vectors), IVF_TRAINING_SAMPLE), replace=False)]
+    kmeans = MiniBatchKMeans(n_clusters=n_lists, random_state=42, n_init=1, batch_size=4096).fit(sample)
+    centroids = normalise_rows(kmeans.cluster_centers_)
+    assignments = (vectors @ centroids.T).argmax(axis=1)
+    return SimilarityIndex(ids, vectors, centroids=centroids, assignments=assignments, n_probe=n_probe)
+
+def read_index(path):
+    '''
+    Read a similarity index saved with SimilarityIndex.save, if it exists
+    '''
+    try:
+        data = np.load(path, allow_pickle=False)
+    except FileNotFoundError:
+        return None
+    centroids = data["centroids"] if data["centroids"].size else None
+    return SimilarityIndex(
+        data["ids"], data["vectors"],
+        centroids=centroids,
+        assignments=data["assignments"] if centroids is not None else None,
+        n_probe=int(data["n_probe"]),
+    )
+
+def most_similar(index, ids):
+    '''
+    The most similar other company and its score for each id, as a DataFrame of
+    most_similar_id and most_similar_score in the order of ids.
+    '''
+    row_index = ids.index if isinstance(ids, pd.Series) else None
+    query_rows = np.array([index.id_to_row[id_] for id_ in np.asarray(ids).tolist()], dtype=np.int64)
+    rows, scores = index.search(index.vectors[query_rows], k=1, exclude_rows=query_rows)
+    found = rows[:, 0] >= 0
+    similar_ids = pd.array([None] * len(query_rows), dtype="Int64")
+    similar_ids[found] = index.ids[rows[found, 0]]
+    return pd.DataFrame({
+        "most_similar_id": similar_ids,
+        "most_similar_score": np.where(found, scores[:, 0], np.nan),
+    }, index=row_index)
+
+def add_most_similar(df, index):
+    '''
+    Add the most_similar_id and most_similar_score columns for every row of df.
+    '''
+    for col, values in most_similar(index, df["id"]).items():
+        df[col] = values
+    return df
+
+def update_most_similar(df, index, changed_ids, removed_ids):
+    '''
+    Bring most_similar_id/most_similar_score up to date after an incremental run.
+    Rows in changed_ids are expected to be up to date already. Rows whose neighbour was changed or removed
+    are searched again, the rest only need comparing against the changed rows.
+    '''
+    df = df.copy()
+    changed_ids = set(changed_ids)
+    if "most_similar_id" not in df.columns:
+        return add_most_similar(df, index)
+
+    is_changed = df["id"].isin(changed_ids).to_numpy()
+    stale = ~is_changed & (
+        df["most_similar_id"].isin(changed_ids | set(removed_ids)).to_numpy()
+        | df["most_similar_id"].isna().to_numpy()
+    )
+    if stale.any():
+        refreshed = most_similar(index, df.loc[stale, "id"])
+        df.loc[stale, "most_similar_id"] = refreshed["most_similar_id"]
+        df.loc[stale, "most_similar_score"] = refreshed["most_similar_score"]
+
+    # A changed row can only take over as the neighbour of the remaining rows if it scores higher
+    rest = ~is_changed & ~stale
+    changed_rows = np.array([index.id_to_row[id_] for id_ in changed_ids if id_ in index.id_to_row], dtype=np.int64)
+    if rest.any() and len(changed_rows):
+        changed_index = SimilarityIndex(index.ids[changed_rows], index.vectors[changed_rows])
+        rest_rows = np.array([index.id_to_row[id_] for id_ in df.loc[rest, "id"]], dtype=np.int64)
+        rows, scores = changed_index.search(index.vectors[rest_rows], k=1)
+        better = scores[:, 0] > df.loc[rest, "most_similar_score"].to_numpy()
+        targets = df.index[rest][better]
+        df.loc[targets, "most_similar_id"] = changed_index.ids[rows[better, 0]]
+        df.loc[targets, "most_similar_score"] = scores[better, 0]
+    return df
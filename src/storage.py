@@ -0,0 +1,37 @@
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Rows per Parquet row group, readers can skip whole row groups and only decode the columns they ask for
+PARQUET_ROW_GROUP_SIZE = 50_000
+
+def write_table(df, path, row_group_size=PARQUET_ROW_GROUP_SIZE):
+    '''
+    Save a DataFrame as Parquet, keeping list, bool and datetime columns typed.
+    Paths ending in .csv are written as CSV instead.
+    '''
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    if path.endswith(".csv"):
+        df.to_csv(path, index=False)
+        return
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    pq.write_table(table, path, row_group_size=row_group_size)
+
+def read_table(path, columns=None):
+    '''
+    Read a DataFrame saved by write_table, optionally only the given columns.
+    The path can be a single file or a directory of Parquet partitions.
+    '''
+    if path.endswith(".csv"):
+        return pd.read_csv(path, usecols=columns, encoding="utf-8")
+
+    table = pq.read_table(path, columns=columns)
+    df = table.to_pandas()
+
+    # Arrow hands list columns back as numpy arrays, the pipeline works with Python lists
+    for name in table.column_names:
+        if pa.types.is_list(table.schema.field(name).type):
+            df[name] = table.column(name).to_pylist()
+    return df
@@ -0,0 +1,175 @@
+import os
+import shutil
+from collections import Counter, defaultdict
+import joblib
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from src import ingest, storage, clustering, cluster_terms, dedup
+
+STREAM_CHUNK_SIZE = 10_000
+STREAM_SAMPLE_SIZE = 50_000
+
+class Reservoir:
+    '''
+    Fixed-size uniform sample of (lemmatized description, embedding) pairs over a stream of chunks.
+    The whole-corpus models (TF-IDF vocabulary and KMeans centroids) are fitted on this sample.
+    '''
+    def __init__(self, size, seed=42):
+        self.size = size
+        self.rng = np.random.default_rng(seed)
+        self.seen = 0
+        self.texts = []
+        self.embeddings = []
+
+    def add(self, texts, embeddings):
+        for text, embedding in zip(texts, embeddings):
+            if len(self.texts) < self.size:
+                self.texts.append(text)
+                self.embeddings.append(np.array(embedding))
+            else:
+                j = self.rng.integers(0, self.seen + 1)
+                if j < self.size:
+                    self.texts[j] = text
+                    self.embeddings[j] = np.array(embedding)
+            self.seen += 1
+
+def part_paths(directory, extension):
+    return sorted(
+        os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(extension)
+    )
+
+def run_streaming_pipeline(data_path, stream_dir, tfidf_terms_path, tfidf_model_path, kmeans_model_path,
+                           chunk_size=STREAM_CHUNK_SIZE, sample_size=STREAM_SAMPLE_SIZE,
+                           batch_size=256, n_process=1, artifact_format="parquet",
+                           n_clusters=clustering.DEFAULT_N_CLUSTERS, cluster_method="auto", tfidf_mode="vocabulary",
+                           extractor_jobs=None, ner_labels=None, quantise_embeddings=False,
+                           dedup_threshold=dedup.DEFAULT_THRESHOLD):
+    '''
+    Run ingest to features chunk by chunk so peak memory depends on chunk_size rather than the corpus size.
+
+    Pass 1 streams the CSV through ingest, preprocessing and the per-document features (NER, keywords,
+    embeddings), writing each chunk to disk and keeping a reservoir sample of sample_size rows.
+    The TF-IDF vectorizer and KMeans model are then fitted on the sample, except in the "hashing"
+    tfidf_mode where the TF-IDF statistics are accumulated over every chunk during pass 1.
+    Pass 2 assigns clusters and counts cluster keywords over every chunk, and pass 3 writes the final
+    partitioned artifacts: processed/part-*.parquet (or .csv), tfidf/part-*.npz and embeddings/part-*.npy,
+    plus cluster_terms.csv. The entity spans of each chunk are written to entities/part-*.npz in pass 1.
+    The only state kept across chunks apart from the sample is the set of ids seen so far.
+    Near-duplicate descriptions are grouped within each chunk, with dedup_threshold as in preprocess_data.
+    '''
+    # Imported here so main can read the streaming defaults without importing the NLP stages
+    from src import preprocess, feature_engineering
+
+    features_dir = os.path.join(stream_dir, "features")
+    processed_dir = os.path.join(stream_dir, "processed")
+    tfidf_dir = os.path.join(stream_dir, "tfidf")
+    embeddings_dir = os.path.join(stream_dir, "embeddings")
+    entities_dir = os.path.join(stream_dir, "entities")
+    for directory in [features_dir, processed_dir, tfidf_dir, embeddings_dir, entities_dir]:
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+
+    # Pass 1: per-document work, one chunk at a time
+    reservoir = Reservoir(sample_size)
+    tfidf_vectorizer = feature_engineering.make_tfidf_vectorizer(tfidf_mode)
+    seen_ids = set()
+    for i, chunk in enumerate(ingest.iter_ingest(data_path, chunk_size)):
+        df = preprocess.preprocess_data(chunk, batch_size=batch_size, n_process=n_process, dedup_threshold=dedup_threshold)
+        if df.empty:
+            continue
+        # Duplicate ids are dropped across the whole file, not just within a chunk
+        df = df[~df["id"].isin(seen_ids)].copy()
+        if df.empty:
+            continue
+        seen_ids.update(df["id"])
+
+        df, ner_df, entity_spans, embeddings = feature_engineering.document_features(
+            df, batch_size=batch_size, n_process=n_process, extractor_jobs=extractor_jobs,
+            ner_labels=ner_labels or feature_engineering.NER_LABELS, quantise_embeddings=quantise_embeddings
+        )
+        reservoir.add(df["lemmatized_description"], embeddings)
+        if tfidf_mode == "hashing":
+            tfidf_vectorizer.partial_fit(df["lemmatized_description"])
+
+        part = f"part-{i:05d}"
+        pd.to_pickle((df, ner_df), os.path.join(features_dir, f"{part}.pkl"))
+        np.save(os.path.join(embeddings_dir, f"{part}.npy"), embeddings)
+        entity_spans.save(os.path.join(entities_dir, f"{part}.npz"))
+        print(f"Chunk {i}: {len(df)} rows processed ({reservoir.seen} so far).")
+
+    if reservoir.seen == 0:
+        print("Streaming aborted: no rows passed preprocessing.")
+        return
+
+    # Fit the whole-corpus models on the sample
+    print(f"Fitting TF-IDF and KMeans on a sample of {len(reservoir.texts)} of {reservoir.seen} rows...")
+    if tfidf_mode != "hashing":
+        tfidf_vectorizer.fit(reservoir.texts)
+    kmeans = clustering.fit_clusters(np.asarray(reservoir.embeddings), n_clusters=n_clusters, method=cluster_method)
+
+    # Pass 2: cluster keyword counts over every row
+    keyword_counts = defaultdict(Counter)
+    for path in part_paths(features_dir, ".pkl"):
+        df, _ = pd.read_pickle(path)
+        embeddings = np.load(os.path.join(embeddings_dir, os.path.basename(path).replace(".pkl", ".npy")))
+        for cluster_id, keywords in zip(clustering.assign(kmeans, embeddings)[0], df["top_keywords"]):
+            keyword_counts[cluster_id].update(keywords)
+    cluster_top_keywords = {
+        cluster_id: [keyword for keyword, _ in counts.most_common(5)]
+        for cluster_id, counts in keyword_counts.items()
+    }
+
+    counts = pd.DataFrame(
+        [(cluster_id, term, count) for cluster_id in sorted(keyword_counts)
+         for term, count in keyword_counts[cluster_id].most_common()],
+        columns=["cluster_id", "term", "count"]
+    )
+
+    # Pass 3: corpus-level features for each chunk, written as the final partitions.
+    # Per-cluster TF-IDF sums are added up across chunks for the cluster terms table
+    n_terms = len(tfidf_vectorizer.get_feature_names_out())
+    weights = np.zeros((kmeans.n_clusters, n_terms))
+    doc_freq = np.zeros((kmeans.n_clusters, n_terms))
+    sizes = np.zeros(kmeans.n_clusters, dtype=np.int64)
+    for path in part_paths(features_dir, ".pkl"):
+        part = os.path.basename(path).replace(".pkl", "")
+        df, ner_df = pd.read_pickle(path)
+        embeddings = np.load(os.path.join(embeddings_dir, f"{part}.npy"))
+
+        df["cluster_id"], df["distance_to_centroid"] = clustering.assign(kmeans, embeddings)
+        df["cluster_top_keywords"] = df["cluster_id"].map(cluster_top_keywords)
+
+        tfidf_matrix = tfidf_vectorizer.transform(df["lemmatized_description"])
+        chunk_weights, chunk_doc_freq, chunk_sizes = cluster_terms.cluster_term_sums(
+            df["cluster_id"], tfidf_matrix, kmeans.n_clusters
+        )
+        weights += chunk_weights
+        doc_freq += chunk_doc_freq
+        sizes += chunk_sizes
+
+        sparse.save_npz(os.path.join(tfidf_dir, f"{part}.npz"), tfidf_matrix)
+        storage.write_table(pd.concat([df, ner_df], axis=1), os.path.join(processed_dir, f"{part}.{artifact_format}"))
+        os.remove(path)
+
+    shutil.rmtree(features_dir, ignore_errors=True)
+
+    pd.Series(tfidf_vectorizer.get_feature_names_out()).to_csv(tfidf_terms_path, index=False)
+    cluster_terms_path = os.path.join(stream_dir, "cluster_terms.csv")
+    cluster_terms.cluster_term_table(
+        weights, doc_freq, sizes, tfidf_vectorizer.get_feature_names_out(), counts=counts
+    ).to_csv(cluster_terms_path, index=False)
+    os.makedirs(os.path.dirname(tfidf_model_path), exist_ok=True)
+    joblib.dump(tfidf_vectorizer, tfidf_model_path)
+    os.makedirs(os.path.dirname(kmeans_model_path), exist_ok=True)
+    joblib.dump(kmeans, kmeans_model_path)
+
+    print("Saved:")
+    print(f"- Partitioned DataFrame: {processed_dir}")
+    print(f"- Partitioned TF-IDF Matrix: {tfidf_dir}")
+    print(f"- Partitioned Embeddings: {embeddings_dir}")
+    print(f"- Partitioned Entity Spans: {entities_dir}")
+    print(f"- TF-IDF Terms: {tfidf_terms_path}")
+    print(f"- Cluster Terms: {cluster_terms_path}")
+    print(f"- TF-IDF Model: {tfidf_model_path}")
+    print(f"- KMeans Model: {kmeans_model_path}")
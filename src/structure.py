@@ -1,21 +1,35 @@
 import pandas as pd
-import numpy as np
 from scipy import sparse
+import joblib
 import os
+from src import storage, embedding_store
+from src.profiling import span
 
 def save_structured_data(features: dict,
                          processed_path: str,
                          tfidf_matrix_path: str,
                          tfidf_terms_path: str,
-                         embeddings_path: str):
+                         embeddings_path: str,
+                         cluster_terms_path: str = None,
+                         tfidf_model_path: str = None,
+                         kmeans_model_path: str = None,
+                         similarity_index_path: str = None,
+                         entity_spans_path: str = None,
+                         embedding_dtype: str = "float32"):
     """
     Save outputs from the feature_engineering pipeline to disk.
 
     Args:
         features (dict): Dictionary from feature_engineering().
-        processed_path (str): Path to save enriched DataFrame (.csv).
+        processed_path (str): Path to save enriched DataFrame (.parquet, or .csv).
         tfidf_path (str): Path to save TF-IDF matrix (.npz) — terms saved as _terms.csv.
-        embeddings_path (str): Path to save sentence embeddings (.npy).
+        embeddings_path (str): Path to save sentence embeddings (.npy), with their ids next to them.
+        cluster_terms_path (str): Optional path to save the top terms per cluster (.csv).
+        tfidf_model_path (str): Optional path to save the fitted TF-IDF vectorizer (.joblib).
+        kmeans_model_path (str): Optional path to save the fitted KMeans model (.joblib).
+        similarity_index_path (str): Optional path to save the similarity index (.npz).
+        entity_spans_path (str): Optional path to save the entity spans of each row (.npz).
+        embedding_dtype (str): Storage dtype of the embeddings: float32, float16 or int8.
     """
     # Ensure output directories exist
     os.makedirs(os.path.dirname(processed_path), exist_ok=True)
@@ -23,18 +37,54 @@ def save_structured_data(features: dict,
     os.makedirs(os.path.dirname(tfidf_terms_path), exist_ok=True)
     os.makedirs(os.path.dirname(embeddings_path), exist_ok=True)
 
+    n_docs = len(features["df"])
+
     # Save enriched DataFrame
-    features["df"].to_csv(processed_path, index=False)
+    with span("structure.processed", n_docs=n_docs):
+        storage.write_table(features["df"], processed_path)
 
     # Save TF-IDF matrix and terms
-    sparse.save_npz(tfidf_matrix_path, features["tfidf_matrix"])
-    pd.Series(features["tfidf_terms"]).to_csv(tfidf_terms_path, index=False)
+    with span("structure.tfidf", n_docs=n_docs):
+        sparse.save_npz(tfidf_matrix_path, features["tfidf_matrix"])
+        pd.Series(features["tfidf_terms"]).to_csv(tfidf_terms_path, index=False)
+
+    # Save embeddings as a memory-mappable store keyed by company id
+    with span("structure.embeddings", n_docs=n_docs):
+        embedding_store.write_store(embeddings_path, features["df"]["id"], features["embeddings"], dtype=embedding_dtype)
+
+    # Save the top keywords, TF-IDF and c-TF-IDF terms of each cluster
+    if cluster_terms_path is not None and "cluster_terms" in features:
+        features["cluster_terms"].to_csv(cluster_terms_path, index=False)
+
+    # Save fitted models so later runs can transform/predict without refitting
+    with span("structure.models"):
+        if tfidf_model_path is not None and "tfidf_vectorizer" in features:
+            os.makedirs(os.path.dirname(tfidf_model_path), exist_ok=True)
+            joblib.dump(features["tfidf_vectorizer"], tfidf_model_path)
+        if kmeans_model_path is not None and "kmeans" in features:
+            os.makedirs(os.path.dirname(kmeans_model_path), exist_ok=True)
+            joblib.dump(features["kmeans"], kmeans_model_path)
+        if similarity_index_path is not None and "similarity_index" in features:
+            os.makedirs(os.path.dirname(similarity_index_path), exist_ok=True)
+            features["similarity_index"].save(similarity_index_path)
 
-    # Save embeddings
-    np.save(embeddings_path, features["embeddings"])
+    # Save the entities of each row, aligned with the rows of the DataFrame
+    if entity_spans_path is not None and "entity_spans" in features:
+        with span("structure.entity_spans", n_docs=n_docs):
+            features["entity_spans"].save(entity_spans_path)
 
     print("Saved:")
     print(f"- DataFrame: {processed_path}")
     print(f"- TF-IDF Matrix: {tfidf_matrix_path}")
     print(f"- TF-IDF Terms: {tfidf_terms_path}")
-    print(f"- Embeddings: {embeddings_path}")
\ No newline at end of file
+    print(f"- Embeddings: {embeddings_path}")
+    if cluster_terms_path is not None and "cluster_terms" in features:
+        print(f"- Cluster Terms: {cluster_terms_path}")
+    if tfidf_model_path is not None and "tfidf_vectorizer" in features:
+        print(f"- TF-IDF Model: {tfidf_model_path}")
+    if kmeans_model_path is not None and "kmeans" in features:
+        print(f"- KMeans Model: {kmeans_model_path}")
+    if similarity_index_path is not None and "similarity_index" in features:
+        print(f"- Similarity Index: {similarity_index_path}")
+    if entity_spans_path is not None and "entity_spans" in features:
+        print(f"- Entity Spans: {entity_spans_path}")
\ No newline at end of file
@@ -0,0 +1,131 @@
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.preprocessing import normalize
+
+# Same settings as the vocabulary-based TfidfVectorizer in feature engineering
+MAX_FEATURES = 1000
+NGRAM_RANGE = (1, 2)
+STOP_WORDS = "english"
+
+# Hash buckets for the terms, collisions are rare at this size and the per-bucket stats stay small (~16MB)
+N_HASH_FEATURES = 2 ** 20
+# Documents hashed at a time, bounds the memory of the intermediate count matrix
+TFIDF_CHUNK_SIZE = 20_000
+
+def identity(tokens):
+    return tokens
+
+class HashingTfidfVectorizer:
+    '''
+    TF-IDF without building an in-memory vocabulary. Terms are hashed into N_HASH_FEATURES buckets
+    chunk by chunk, and each chunk only updates running per-bucket statistics (term counts and document
+    frequencies), so partial_fit can be called on any number of chunks.
+
+    Close to TfidfVectorizer(max_features=...): the max_features buckets with the highest total term count
+    are kept, weighted by smoothed IDF and L2 normalised. It differs in that terms sharing a bucket are
+    counted together, the columns are in bucket order rather than alphabetical, and ties at the
+    max_features cut are broken by bucket rather than by term. Each bucket is named after the first term
+    seen in it. The weights are computed once, on the first transform after fitting. Once fitted it can be
+    saved with joblib and reused to transform new rows consistently.
+    '''
+    def __init__(self, max_features=MAX_FEATURES, ngram_range=NGRAM_RANGE, stop_words=STOP_WORDS,
+                 n_features=N_HASH_FEATURES, chunk_size=TFIDF_CHUNK_SIZE):
+        self.max_features = max_features
+        self.ngram_range = ngram_range
+        self.stop_words = stop_words
+        self.n_features = n_features
+        self.chunk_size = chunk_size
+        self.reset()
+
+    def reset(self):
+        '''
+        Forget the statistics of everything fitted so far.
+        '''
+        self.n_docs = 0
+        self.term_counts = np.zeros(self.n_features, dtype=np.int64)
+        self.doc_freq = np.zeros(self.n_features, dtype=np.int64)
+        self.bucket_names = np.empty(self.n_features, dtype=object)
+        self.columns = None
+        self.idf_ = None
+
+    def hasher(self, **kwargs):
+        params = dict(
+            n_features=self.n_features, ngram_range=self.ngram_range, stop_words=self.stop_words,
+            alternate_sign=False, norm=None
+        )
+        params.update(kwargs)
+        return HashingVectorizer(**params)
+
+    def chunks(self, texts):
+        texts = list(texts)
+        for start in range(0, len(texts), self.chunk_size):
+            yield texts[start:start + self.chunk_size]
+
+    def partial_fit(self, texts):
+        '''
+        Add the term counts and document frequencies of a chunk of texts to the running statistics.
+        '''
+        for chunk in self.chunks(texts):
+            counts = self.hasher().transform(chunk)
+            self.term_counts += np.asarray(counts.sum(axis=0)).ravel().astype(np.int64)
+            self.doc_freq += np.bincount(counts.indices, minlength=self.n_features)
+            self.n_docs += len(chunk)
+            self.name_buckets(chunk)
+        # The statistics changed, the weights are recomputed when next needed
+        self.columns = None
+        self.idf_ = None
+        return self
+
+    def name_buckets(self, texts):
+        '''
+        Name any bucket seen for the first time after its term, hashed the same way as the documents.
+        '''
+        analyzer = self.hasher().build_analyzer()
+        terms = sorted({term for text in texts for term in analyzer(text)})
+        if not terms:
+            return
+        buckets = self.hasher(analyzer=identity).transform([[term] for term in terms]).indices
+        unnamed = self.bucket_names[buckets] == None  # noqa: E711 - elementwise check on an object array
+        for term, bucket in zip(np.asarray(terms, dtype=object)[unnamed], buckets[unnamed]):
+            if self.bucket_names[bucket] is None:
+                self.bucket_names[bucket] = term
+
+    def update_weights(self):
+        '''
+        Pick the max_features most frequent buckets and compute their smoothed IDF, if not done since the
+        last partial_fit. The IDF uses the same smoothed formula as TfidfVectorizer.
+        '''
+        if self.columns is not None:
+            return
+        if self.n_docs == 0:
+            raise ValueError("HashingTfidfVectorizer is not fitted yet, call fit or partial_fit first.")
+        seen = np.flatnonzero(self.term_counts)
+        order = np.lexsort((seen, -self.term_counts[seen]))
+        self.columns = np.sort(seen[order[:self.max_features]])
+        self.idf_ = np.log((1 + self.n_docs) / (1 + self.doc_freq[self.columns])) + 1
+
+    def fit(self, texts):
+        '''
+        Fit from scratch on texts, like the other vectorizers. Use partial_fit to add to the statistics.
+        '''
+        self.reset()
+        return self.partial_fit(texts)
+
+    def transform(self, texts):
+        self.update_weights()
+        blocks = [
+            normalize(self.hasher().transform(chunk)[:, self.columns].multiply(self.idf_).tocsr())
+            for chunk in self.chunks(texts)
+        ]
+        if not blocks:
+            return sparse.csr_matrix((0, len(self.columns)))
+        return sparse.vstack(blocks).tocsr()
+
+    def fit_transform(self, texts):
+        texts = list(texts)
+        return self.fit(texts).transform(texts)
+
+    def get_feature_names_out(self):
+        self.update_weights()
+        return self.bucket_names[self.columns].astype(str)
@@ -1,50 +1,208 @@
+import matplotlib
+matplotlib.use("Agg")
 import matplotlib.pyplot as plt
+from sklearn.decomposition import PCA
 from sklearn.manifold import TSNE
 from sklearn.metrics.pairwise import cosine_similarity
 from wordcloud import WordCloud
-from collections import defaultdict
 import seaborn as sns
+import numpy as np
+import hashlib
 import os
+from src.embedding_store import EmbeddingStore
+from src.extractors import spawn_pool
+from src.profiling import span
 
-def generate_visualisations(df, embeddings, PLOTS_DIR):
+# Columns of the processed data the plots use, so only these need reading
+REQUIRED_COLUMNS = ["id", "cluster_id", "distance_to_centroid", "lemmatized_description"]
+
+# Output settings: "final" for the report, "preview" for quick looks while iterating
+PRESETS = {
+    "final": {"dpi": 300, "file_format": "png"},
+    "preview": {"dpi": 72, "file_format": "png"},
+    "vector": {"dpi": 300, "file_format": "svg"},
+}
+
+# t-SNE only runs on a stratified sample of each cluster, the other rows are placed next to
+# their most similar sampled neighbours, so the cost doesn't grow with the corpus
+TSNE_SAMPLE_SIZE = 2000
+MIN_SAMPLE_PER_CLUSTER = 50
+PCA_COMPONENTS = 50
+PLACEMENT_NEIGHBOURS = 10
+PLACEMENT_BLOCK_SIZE = 50_000
+# t-SNE needs a perplexity of at least 1, so fewer rows are laid out with PCA alone
+MIN_TSNE_ROWS = 4
+# Version used to key cached projections, bump this when the projection settings change
+PROJECTION_VERSION = "tsne-p30-pca50-sample2000-knn10-v2"
+
+# Upper bounds on what a single plot draws or reads
+SCATTER_MAX_POINTS = 20_000
+WORDCLOUD_MAX_DOCS = 5000
+
+def generate_visualisations(df, embeddings, PLOTS_DIR, preset="final", n_jobs=None, projection_cache_dir=None):
     """
     Generate visualisations for the processed data.
+    The plots are independent, so they are rendered in parallel in n_jobs worker processes (all cores by default).
+    The 2-D projection is cached in projection_cache_dir (PLOTS_DIR by default) and reused while the
+    embeddings and clusters stay the same.
+    embeddings is an EmbeddingStore, whose rows are looked up by company id, or an array in the order of df.
     """
-    # Plot clusters
-    plot_cluster_scatter(df, embeddings, PLOTS_DIR)
+    os.makedirs(PLOTS_DIR, exist_ok=True)
+    settings = PRESETS[preset]
+    cluster_ids = df["cluster_id"].to_numpy()
+    rows = embedding_rows(df, embeddings)
+
+    # Only the rows drawn in the scatter plot are projected, once in this process, the workers only draw
+    shown = stratified_sample(cluster_ids, SCATTER_MAX_POINTS)
+    with span("visualise.projection", n_docs=len(shown)):
+        reduced = cached_projection(embeddings, rows[shown], cluster_ids[shown], projection_cache_dir or PLOTS_DIR)
 
-    # Plot cluster sizes
-    plot_cluster_sizes(df, PLOTS_DIR)
+    tasks = [
+        (plot_cluster_scatter, (reduced, cluster_ids[shown], PLOTS_DIR)),
+        (plot_cluster_sizes, (df[["cluster_id"]], PLOTS_DIR)),
+        (plot_distance_to_centroid, (df[["distance_to_centroid"]].iloc[shown], PLOTS_DIR)),
+    ]
+    # Word clouds for each cluster
+    for cluster_id in sorted(df["cluster_id"].unique())[:7]:
+        tasks.append((plot_wordcloud, (cluster_id, cluster_wordcloud_text(df, cluster_id), PLOTS_DIR)))
+    # Similarity heatmap within each cluster
+    with span("visualise.similarity_samples", n_docs=len(df)):
+        for cluster_id in df["cluster_id"].unique():
+            sim_matrix, labels = cluster_similarity_sample(df, embeddings, rows, cluster_id)
+            tasks.append((plot_similarity_heatmap, (sim_matrix, labels, cluster_id, PLOTS_DIR)))
 
-    # Plot word clouds for each cluster
-    plot_wordclouds(df, PLOTS_DIR)
+    with span("visualise.render"):
+        if n_jobs == 1:
+            for plot, args in tasks:
+                plot(*args, **settings)
+            return
+        with spawn_pool(n_jobs) as executor:
+            futures = [executor.submit(plot, *args, **settings) for plot, args in tasks]
+            for future in futures:
+                future.result()
+
+def embedding_rows(df, embeddings):
+    """
+    Row of each company of df in embeddings: looked up by id in a store, positional for a plain array.
+    """
+    if isinstance(embeddings, EmbeddingStore):
+        return embeddings.lookup(df["id"].to_numpy())
+    return np.arange(len(df))
+
+def stratified_sample(cluster_ids, size, seed=42):
+    """
+    Sorted row positions of a sample of about size rows, drawn from each cluster in proportion to its size
+    with at least MIN_SAMPLE_PER_CLUSTER rows per cluster (or the whole cluster if smaller).
+    """
+    cluster_ids = np.asarray(cluster_ids)
+    if len(cluster_ids) <= size:
+        return np.arange(len(cluster_ids))
+    rng = np.random.default_rng(seed)
+    picked = []
+    for cluster_id in np.unique(cluster_ids):
+        members = np.flatnonzero(cluster_ids == cluster_id)
+        n = max(min(len(members), MIN_SAMPLE_PER_CLUSTER), round(len(members) / len(cluster_ids) * size))
+        picked.append(rng.choice(members, min(n, len(members)), replace=False))
+    return np.sort(np.concatenate(picked))
+
+def project_embeddings(embeddings, rows, cluster_ids):
+    """
+    2-D projection of the given embedding rows. t-SNE runs on a stratified sample (after PCA), every other
+    row is placed at the similarity-weighted mean position of its nearest sampled rows in the PCA space.
+    Fewer than MIN_TSNE_ROWS rows are placed by PCA alone.
+    """
+    if len(rows) < MIN_TSNE_ROWS:
+        reduced = np.zeros((len(rows), 2), dtype=np.float32)
+        if len(rows) > 1:
+            n_components = min(2, len(rows))
+            reduced[:, :n_components] = PCA(n_components=n_components).fit_transform(
+                np.asarray(embeddings[rows], dtype=np.float32)
+            )
+        return reduced
+    sample = stratified_sample(cluster_ids, TSNE_SAMPLE_SIZE)
+    pca = PCA(n_components=min(PCA_COMPONENTS, embeddings.shape[1], len(sample)), random_state=42)
+    sample_vectors = pca.fit_transform(np.asarray(embeddings[rows[sample]], dtype=np.float32))
+    tsne = TSNE(n_components=2, perplexity=min(30, (len(sample) - 1) / 3), random_state=42, init="pca")
+
+    reduced = np.empty((len(rows), 2), dtype=np.float32)
+    reduced[sample] = tsne.fit_transform(sample_vectors)
+
+    rest = np.setdiff1d(np.arange(len(rows)), sample)
+    if len(rest) == 0:
+        return reduced
+    sample_unit = sample_vectors / np.maximum(np.linalg.norm(sample_vectors, axis=1, keepdims=True), 1e-12)
+    k = min(PLACEMENT_NEIGHBOURS, len(sample))
+    for start in range(0, len(rest), PLACEMENT_BLOCK_SIZE):
+        block = rest[start:start + PLACEMENT_BLOCK_SIZE]
+        vectors = pca.transform(np.asarray(embeddings[rows[block]], dtype=np.float32))
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        similarity = vectors @ sample_unit.T
+        neighbours = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+        weights = np.maximum(np.take_along_axis(similarity, neighbours, axis=1), 0) + 1e-6
+        reduced[block] = (weights[:, :, None] * reduced[sample][neighbours]).sum(axis=1) / weights.sum(axis=1, keepdims=True)
+    return reduced
+
+def cached_projection(embeddings, rows, cluster_ids, cache_dir):
+    """
+    project_embeddings, cached on disk under a hash of the embeddings, the clusters and the projection settings.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(PROJECTION_VERSION.encode("utf-8"))
+    for start in range(0, len(rows), PLACEMENT_BLOCK_SIZE):
+        block = rows[start:start + PLACEMENT_BLOCK_SIZE]
+        digest.update(np.ascontiguousarray(embeddings[block], dtype=np.float32).tobytes())
+    digest.update(np.ascontiguousarray(cluster_ids, dtype=np.int64).tobytes())
+    path = os.path.join(cache_dir, f"projection_{digest.hexdigest()}.npy")
+    if os.path.exists(path):
+        print(f"Reusing the cached 2-D projection {path}.")
+        return np.load(path)
 
-    # Plot distance to centroid
-    plot_distance_to_centroid(df, PLOTS_DIR)
+    reduced = project_embeddings(embeddings, rows, cluster_ids)
+    # Older projections are for other embeddings and won't be read again
+    for name in os.listdir(cache_dir):
+        if name.startswith("projection_") and name.endswith(".npy"):
+            os.remove(os.path.join(cache_dir, name))
+    np.save(path, reduced)
+    return reduced
 
-    # Plot similarity heatmap within a cluster
-    for cluster_id in df["cluster_id"].unique():
-        plot_similarity_heatmap_within_cluster(df, embeddings, cluster_id, PLOTS_DIR)
+def cluster_wordcloud_text(df, cluster_id, seed=42):
+    """
+    The lemmatized descriptions of a cluster joined into one text, sampled down to WORDCLOUD_MAX_DOCS.
+    """
+    texts = df.loc[df["cluster_id"] == cluster_id, "lemmatized_description"]
+    if len(texts) > WORDCLOUD_MAX_DOCS:
+        texts = texts.sample(WORDCLOUD_MAX_DOCS, random_state=seed)
+    return " ".join(texts)
 
-def plot_cluster_scatter(df, embeddings, PLOTS_DIR):
+def cluster_similarity_sample(df, embeddings, rows, cluster_id):
     """
-    Visualise clusters using t-SNE on sentence embeddings.
+    Cosine similarity between up to 15 sampled companies of a cluster, with their ids as labels.
     """
-    # Run t-SNE
-    tsne = TSNE(n_components=2, perplexity=30, random_state=42, init="pca")
-    reduced = tsne.fit_transform(embeddings)
+    # Filter to chosen cluster
+    cluster_df = df[df["cluster_id"] == cluster_id]
+
+    sample_df = cluster_df.sample(min(15, len(cluster_df)), random_state=42)
+    sample_embeddings = embeddings[rows[df.index.get_indexer(sample_df.index)]]
+    labels = sample_df["id"].astype(str).tolist()
+
+    # Compute cosine similarity
+    return cosine_similarity(sample_embeddings), labels
 
-    # Plot
+def plot_cluster_scatter(reduced, cluster_ids, PLOTS_DIR, dpi=300, file_format="png"):
+    """
+    Visualise clusters using the t-SNE projection of the sentence embeddings.
+    """
     plt.figure(figsize=(10, 8))
-    sns.scatterplot(x=reduced[:, 0], y=reduced[:, 1], hue=df["cluster_id"].values, palette="tab10", s=40, alpha=0.8, edgecolor="k")
+    sns.scatterplot(x=reduced[:, 0], y=reduced[:, 1], hue=cluster_ids, palette="tab10", s=40, alpha=0.8, edgecolor="k")
     plt.title("t-SNE Scatter Plot of Clusters (on Sentence Embeddings)")
     plt.xlabel("TSNE-1")
     plt.ylabel("TSNE-2")
     plt.legend(title="Cluster", bbox_to_anchor=(1.05, 1), loc='upper left')
-    plt.savefig(os.path.join(PLOTS_DIR, "tsne_clusters.png"), dpi=300, bbox_inches="tight")
+    plt.savefig(os.path.join(PLOTS_DIR, f"tsne_clusters.{file_format}"), dpi=dpi, bbox_inches="tight")
     plt.close()
 
-def plot_cluster_sizes(df, PLOTS_DIR):
+def plot_cluster_sizes(df, PLOTS_DIR, dpi=300, file_format="png"):
     """
     Plot the distribution of cluster sizes.
     """
@@ -57,34 +215,27 @@ def plot_cluster_sizes(df, PLOTS_DIR):
     plt.ylabel("Number of Companies")
     plt.xticks(rotation=0)
     plt.tight_layout()
-    plt.savefig(os.path.join(PLOTS_DIR, "cluster_sizes.png"), dpi=300, bbox_inches="tight")
+    plt.savefig(os.path.join(PLOTS_DIR, f"cluster_sizes.{file_format}"), dpi=dpi, bbox_inches="tight")
     plt.close()
 
-def plot_wordclouds(df, PLOTS_DIR):
+def plot_wordcloud(cluster_id, text, PLOTS_DIR, dpi=300, file_format="png"):
     """
-    Generate word clouds for each cluster based on the lemmatized descriptions.
+    Generate the word cloud of a cluster from its lemmatized descriptions.
     """
-    # Create a mapping: cluster_id to list of descriptions
-    cluster_texts = defaultdict(list)
-    for cluster_id, text in zip(df["cluster_id"], df["lemmatized_description"]):
-        cluster_texts[cluster_id].append(text)
-    
-    # Generate word clouds for each cluster
-    for cluster_id in sorted(cluster_texts.keys())[:7]:
-        text = " ".join(cluster_texts[cluster_id])
-        wordcloud = WordCloud(width=800, height=400, background_color="white",
-                              max_words=100, colormap="tab10").generate(text)
-        plt.figure(figsize=(10, 5))
-        plt.imshow(wordcloud, interpolation="bilinear")
-        plt.axis("off")
-        plt.title(f"Cluster {cluster_id} Word Cloud")
-        plt.tight_layout()
-        plt.savefig(os.path.join(PLOTS_DIR, f"wordcloud_cluster_{cluster_id}.png"), dpi=300, bbox_inches="tight")
-        plt.close()
+    wordcloud = WordCloud(width=800, height=400, background_color="white",
+                          max_words=100, colormap="tab10").generate(text)
+    plt.figure(figsize=(10, 5))
+    plt.imshow(wordcloud, interpolation="bilinear")
+    plt.axis("off")
+    plt.title(f"Cluster {cluster_id} Word Cloud")
+    plt.tight_layout()
+    plt.savefig(os.path.join(PLOTS_DIR, f"wordcloud_cluster_{cluster_id}.{file_format}"), dpi=dpi, bbox_inches="tight")
+    plt.close()
 
-def plot_distance_to_centroid(df, PLOTS_DIR):
+def plot_distance_to_centroid(df, PLOTS_DIR, dpi=300, file_format="png"):
     """
-    Plot the distribution of distances to the centroid for each cluster.
+    Plot the distribution of distances to the centroid for each cluster, from a sample of the rows
+    (the KDE's cost grows with the number of rows).
     """
     plt.figure(figsize=(10, 8))
     sns.histplot(df["distance_to_centroid"], bins=30, kde=True, color="steelblue")
@@ -92,27 +243,17 @@ def plot_distance_to_centroid(df, PLOTS_DIR):
     plt.xlabel("Distance")
     plt.ylabel("Count")
     plt.tight_layout()
-    plt.savefig(os.path.join(PLOTS_DIR, "distance_to_centroid.png"), dpi=300, bbox_inches="tight")
+    plt.savefig(os.path.join(PLOTS_DIR, f"distance_to_centroid.{file_format}"), dpi=dpi, bbox_inches="tight")
     plt.close()
 
-def plot_similarity_heatmap_within_cluster(df, embeddings, cluster_id, PLOTS_DIR):
+def plot_similarity_heatmap(sim_matrix, labels, cluster_id, PLOTS_DIR, dpi=300, file_format="png"):
     """
     Plot a heatmap of cosine similarity within a specific cluster.
     """
-    # Filter to chosen cluster
-    cluster_df = df[df["cluster_id"] == cluster_id]
-
-    sample_df = cluster_df.sample(15, random_state=42)
-    sample_embeddings = embeddings[sample_df.index]
-    labels = sample_df["id"].astype(str).tolist()
-
-    # Compute cosine similarity
-    sim_matrix = cosine_similarity(sample_embeddings)
-
     plt.figure(figsize=(10, 8))
     sns.heatmap(sim_matrix, xticklabels=labels, yticklabels=labels,
                 cmap="coolwarm", annot=True, fmt=".2f", square=True)
     plt.title(f"Cosine Similarity Within Cluster {cluster_id}")
     plt.tight_layout()
-    plt.savefig(os.path.join(PLOTS_DIR, f"similarity_heatmap_sample_cluster_{cluster_id}.png"), dpi=300, bbox_inches="tight")
+    plt.savefig(os.path.join(PLOTS_DIR, f"similarity_heatmap_sample_cluster_{cluster_id}.{file_format}"), dpi=dpi, bbox_inches="tight")
     plt.close()
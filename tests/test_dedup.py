@@ -0,0 +1,101 @@
+import re
+import numpy as np
+import pandas as pd
+from src import dedup, preprocess, feature_engineering
+from src.entities import EntitySpans
+
+BOILERPLATE = (
+    "We are a leading provider of warehouse robots and supply chain software for retailers, manufacturers "
+    "and logistics providers across the UK and Europe. Our team designs, builds and maintains autonomous "
+    "picking systems that help customers cut costs, reduce errors and ship orders faster than ever before. "
+    "Founded by engineers with decades of experience in automation, the company works closely with clients "
+    "from the first site survey to installation, training and round the clock support for every system. "
+    "Customers include grocery chains, fashion brands and parcel carriers in more than twenty countries."
+)
+
+def near_duplicates():
+    return pd.DataFrame({
+        "id": [1, 2],
+        "company_description": [
+            f"{BOILERPLATE} Visit www.acme-robotics.com or email sales@acme-robotics.com for a demo.",
+            f"{BOILERPLATE} Visit www.bolt-logistics.co.uk or email hello@bolt-logistics.co.uk for a demo.",
+        ],
+        "source": ["website", "website"],
+    })
+
+def fake_doc_stats(parsed):
+    '''
+    Stands in for the spaCy parse: whitespace tokens, web addresses as ORG entities. Records what it parsed.
+    '''
+    def doc_stats(df, batch_size=None, n_process=None):
+        parsed.extend(df["id"])
+        records = []
+        for text in df["cleaned_description"]:
+            tokens = [(m.group(), m.group().lower(), m.start(), m.group().isalpha(), False, False)
+                      for m in re.finditer(r"\S+", text)]
+            entities = [("ORG", token[0].rstrip(".")) for token in tokens if "www." in token[0] or "@" in token[0]]
+            records.append({"tokens": tokens, "pos_counts": {}, "sentence_count": 1, "entities": entities})
+        df["doc_record"] = records
+        return df
+    return doc_stats
+
+def test_near_duplicates_share_the_parse_but_keep_their_own_values(monkeypatch):
+    parsed = []
+    monkeypatch.setattr(preprocess, "initial_quality_filter", lambda df, n_process=1: df)
+    monkeypatch.setattr(preprocess, "advanced_doc_stats", fake_doc_stats(parsed))
+
+    df = preprocess.preprocess_data(near_duplicates(), dedup_threshold=0.7)
+
+    assert df["duplicate_of"].tolist() == [1, 1]
+    assert parsed == [1]
+    first, second = df.iloc[0], df.iloc[1]
+    # The URL pattern runs first, so the email domains are masked as URLs
+    assert first["masked_url_list"] == ["www.acme-robotics.com", "acme-robotics.com"]
+    assert second["masked_url_list"] == ["www.bolt-logistics.co.uk", "bolt-logistics.co.uk"]
+    assert "hello@" in second["masked_description"] and "sales@" not in second["masked_description"]
+    # Only the representative's own entities were parsed, none of them are in the member's description
+    assert first["entity_texts"] == ["www.acme-robotics.com", "sales@acme-robotics.com"]
+    assert second["entity_texts"] == []
+    assert second["lemmatized_description"] == first["lemmatized_description"]
+
+def test_members_get_entity_features_from_their_own_text():
+    df = pd.DataFrame({
+        "id": [1, 2, 3],
+        "duplicate_of": [1, 1, 1],
+        "cleaned_description": ["Acme builds robots in Leeds", "Bolt builds robots in Leeds", "Acme builds robots"],
+    })
+    _, members = dedup.representatives(df)
+    outputs = {
+        "embeddings": np.ones((1, 4), dtype=np.float32),
+        "top_keywords": [["robots"]],
+        "entity_spans": EntitySpans.from_entities([[("ORG", "Acme"), ("GPE", "Leeds")]]),
+    }
+    # Without entity lists from preprocessing, members keep the representative's entities they mention
+    out = feature_engineering.fan_out_outputs(outputs, members, df)
+    assert [out["entity_spans"].doc(i) for i in range(3)] == [
+        [("ORG", "Acme"), ("GPE", "Leeds")], [("GPE", "Leeds")], [("ORG", "Acme")]
+    ]
+    assert out["ner_df"]["num_org"].tolist() == [1, 0, 1]
+    assert out["embeddings"].shape == (3, 4)
+    assert out["top_keywords"] == [["robots"]] * 3
+
+    # With them, every row uses its own
+    df["entity_labels"] = [["ORG"], ["ORG"], []]
+    df["entity_texts"] = [["Acme"], ["Bolt"], []]
+    out = feature_engineering.fan_out_outputs(outputs, members, df)
+    assert out["ner_df"]["first_org"].tolist()[:2] == ["Acme", "Bolt"]
+    assert out["ner_df"]["num_org"].tolist() == [1, 1, 0]
+
+def test_every_pair_in_a_bucket_is_a_candidate():
+    # Rows 0-3 share the first band, row 4 only the second with row 0
+    signatures = np.array([[1, 1, 7, 7], [1, 1, 8, 8], [1, 1, 9, 9], [1, 1, 5, 5], [2, 2, 7, 7]], dtype=np.uint32)
+    pairs = dedup.candidate_pairs(signatures, n_bands=2, rows_per_band=2)
+    assert pairs.tolist() == [[0, 1], [0, 2], [0, 3], [0, 4], [1, 2], [1, 3], [2, 3]]
+
+    # Above the cap a bucket only links each row to the previous and first one
+    pairs = dedup.candidate_pairs(signatures, n_bands=2, rows_per_band=2, bucket_pair_cap=3)
+    assert pairs.tolist() == [[0, 1], [0, 2], [0, 3], [0, 4], [1, 2], [2, 3]]
+
+def test_texts_without_words_are_not_grouped():
+    texts = ["!!!", "???", "", "Acme builds warehouse robots in Leeds", "Acme builds warehouse robots in Leeds"]
+    assert dedup.near_duplicate_groups(texts).tolist() == [0, 1, 2, 3, 3]
@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import sparse
+from src import embedding_store, incremental, ingest
+from src.entities import EntitySpans
+
+# Largest round-trip error of each storage dtype, for unit-scale vectors
+TOLERANCE = {"float32": 0, "float16": 1e-3, "int8": 1e-2}
+
+def vectors(n, seed=0):
+    return np.random.default_rng(seed).uniform(-1, 1, size=(n, 8)).astype(np.float32)
+
+@pytest.mark.parametrize("dtype", embedding_store.STORE_DTYPES)
+def test_write_and_read(tmp_path, dtype):
+    path = str(tmp_path / "embeddings.npy")
+    ids, values = np.array([30, 10, 20]), vectors(3)
+    embedding_store.write_store(path, ids, values, dtype=dtype)
+
+    store = embedding_store.open_store(path)
+    assert store.dtype == dtype
+    assert isinstance(store.values, np.memmap)
+    np.testing.assert_allclose(store.to_array(), values, atol=TOLERANCE[dtype])
+    np.testing.assert_allclose(store.get([20, 30]), values[[2, 0]], atol=TOLERANCE[dtype])
+    with pytest.raises(KeyError):
+        store.get([40])
+    assert embedding_store.open_store(str(tmp_path / "missing.npy")) is None
+
+@pytest.mark.parametrize("dtype", embedding_store.STORE_DTYPES)
+def test_append_keeps_the_dtype_and_ids(tmp_path, dtype):
+    path = str(tmp_path / "embeddings.npy")
+    old, new = vectors(5), vectors(2, seed=1) * 0.5
+    embedding_store.write_store(path, range(5), old, dtype=dtype)
+    store = embedding_store.open_store(path)
+    store.append([7, 8], new)
+
+    reopened = embedding_store.open_store(path)
+    assert reopened.dtype == dtype
+    assert len(reopened) == 7
+    np.testing.assert_allclose(reopened.get([8, 0]), np.vstack([new[1], old[0]]), atol=TOLERANCE[dtype])
+
+@pytest.mark.parametrize("dtype", embedding_store.STORE_DTYPES)
+def test_incremental_rewrite_over_the_mapped_store(tmp_path, dtype):
+    path = str(tmp_path / "embeddings.npy")
+    old = vectors(6)
+    embedding_store.write_store(path, np.arange(6), old, dtype=dtype)
+    old_embeddings = ingest.read_embeddings(path)
+    old_store = ingest.read_embedding_store(path)
+    before = np.array(old_store[:])
+
+    # Two rows go stale, one is edited and one is new, as in the incremental run
+    old_df = pd.DataFrame({"id": np.arange(6)})
+    new = vectors(2, seed=1)
+    new_features = {
+        "df": pd.DataFrame({"id": [2, 6]}), "tfidf_matrix": sparse.csr_matrix((2, 3)), "embeddings": new,
+        "entity_spans": EntitySpans.from_entities([[], []]),
+    }
+    merged = incremental.merge_artifacts(
+        old_df, sparse.csr_matrix((6, 3)), old_embeddings, EntitySpans.from_entities([[]] * 6), [2, 4], new_features
+    )
+    embedding_store.write_store(path, merged["df"]["id"], merged["embeddings"], dtype=old_store.dtype)
+
+    store = embedding_store.open_store(path)
+    assert store.dtype == dtype
+    assert store.ids.tolist() == [0, 1, 3, 5, 2, 6]
+    np.testing.assert_allclose(store.get([0, 1, 3, 5]), old[[0, 1, 3, 5]], atol=2 * TOLERANCE[dtype])
+    np.testing.assert_allclose(store.get([2, 6]), new, atol=TOLERANCE[dtype])
+    # Readers still holding the old mapping keep seeing the old rows
+    np.testing.assert_array_equal(old_store[:], before)
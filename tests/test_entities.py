@@ -0,0 +1,58 @@
+import numpy as np
+from src.entities import EntitySpans, concat_spans, read_spans, ner_features
+
+DOCS = [
+    [("ORG", "Acme Robotics"), ("GPE", "Zürich")],
+    [],
+    [("MONEY", "$5 million"), ("ORG", "Bolt"), ("ORG", "Ünïcode GmbH")],
+    [("DATE", "2015")],
+]
+
+def spans_of(docs):
+    return EntitySpans.from_entities(docs)
+
+def docs_of(spans):
+    return [spans.doc(i) for i in range(len(spans))]
+
+def test_ragged_documents_round_trip():
+    spans = spans_of(DOCS)
+    assert len(spans) == 4
+    assert spans.n_entities == 6
+    assert docs_of(spans) == DOCS
+    assert spans.doc_index().tolist() == [0, 0, 2, 2, 2, 3]
+
+def test_save_and_read(tmp_path):
+    path = tmp_path / "entity_spans.npz"
+    spans_of(DOCS).save(path)
+    assert docs_of(read_spans(path)) == DOCS
+    assert read_spans(tmp_path / "missing.npz") is None
+
+def test_save_and_read_without_entities(tmp_path):
+    path = tmp_path / "entity_spans.npz"
+    spans_of([[], []]).save(path)
+    spans = read_spans(path)
+    assert len(spans) == 2
+    assert docs_of(spans) == [[], []]
+
+def test_slice_and_take():
+    spans = spans_of(DOCS)
+    assert docs_of(spans.slice(1, 3)) == DOCS[1:3]
+    assert docs_of(spans.slice(2, 2)) == []
+    assert docs_of(spans.take([3, 0, 2])) == [DOCS[3], DOCS[0], DOCS[2]]
+    assert docs_of(spans.take(np.array([False, True, True, False]))) == DOCS[1:3]
+    assert docs_of(spans.take([])) == []
+
+def test_concat_remaps_labels():
+    first, second = spans_of(DOCS[:2]), spans_of(DOCS[2:])
+    assert first.labels != second.labels
+    merged = concat_spans([first, second], labels=["DATE"])
+    assert merged.labels[0] == "DATE"
+    assert docs_of(merged) == DOCS
+    assert docs_of(concat_spans([spans_of(DOCS).slice(2, 4), spans_of(DOCS).take([1, 0])])) == DOCS[2:] + [DOCS[1], DOCS[0]]
+
+def test_ner_features_count_each_label():
+    features = ner_features(spans_of(DOCS), index=[10, 11, 12, 13])
+    assert features["num_org"].tolist() == [1, 0, 2, 0]
+    assert features["has_money"].tolist() == [False, False, True, False]
+    assert features.loc[12, "first_org"] == "Bolt"
+    assert features["num_entities"].tolist() == [2, 0, 3, 1]
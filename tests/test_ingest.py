@@ -0,0 +1,12 @@
+import pytest
+from src import ingest
+
+@pytest.mark.parametrize("content", ["", ",id,company_description,source,is_edited,created_at\n"])
+def test_empty_files_give_an_empty_frame(tmp_path, content):
+    path = tmp_path / "raw.csv"
+    path.write_text(content, encoding="utf-8")
+
+    df = ingest.initial_ingest(str(path))
+    assert df.empty
+    assert list(df.columns) == ["id", "company_description", "source", "is_edited", "created_at"]
+    assert list(ingest.iter_ingest(str(path), chunk_size=10)) == []
@@ -0,0 +1,16 @@
+from src import pipeline
+
+def build(run, tmp_path):
+    artifacts = [pipeline.Artifact("out")]
+    stages = [pipeline.Stage("stage", run, outputs=["out"], modules=["pipeline"])]
+    return pipeline.Pipeline(stages, artifacts, str(tmp_path / "manifest.json"))
+
+def first(inputs, config):
+    return {"out": 1}
+
+def second(inputs, config):
+    return {"out": 2}
+
+def test_fingerprint_covers_the_stage_function(tmp_path):
+    assert build(first, tmp_path).fingerprints == build(first, tmp_path).fingerprints
+    assert build(first, tmp_path).fingerprints != build(second, tmp_path).fingerprints
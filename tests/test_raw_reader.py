@@ -0,0 +1,64 @@
+import pandas as pd
+import pytest
+from src import raw_reader
+
+HEADER = ",id,company_description,source,is_edited,created_at\n"
+
+def row(i):
+    return f"{i},{100 + i},Company {i} makes things,web,0,2023-01-0{i % 9 + 1} 10:00:00\n"
+
+def read(tmp_path, body, block_size=raw_reader.BLOCK_SIZE):
+    path = tmp_path / "raw.csv"
+    path.write_text(HEADER + body, encoding="utf-8")
+    repairer = raw_reader.RecordRepairer(raw_reader.read_header(str(path)))
+    batches = list(raw_reader.read_batches(str(path), block_size=block_size, repairer=repairer))
+    return pd.concat(batches, ignore_index=True).set_index("id"), repairer
+
+@pytest.fixture(params=[raw_reader.BLOCK_SIZE, 64], ids=["one-block", "small-blocks"])
+def block_size(request):
+    return request.param
+
+def test_multi_line_records_are_joined(tmp_path, block_size):
+    df, repairer = read(tmp_path, row(0) + "1,101,Acme builds robots\nfor warehouses\nand ports,web,1,2023-02-01\n" + row(2), block_size)
+    assert list(df.index) == ["100", "101", "102"]
+    assert df.loc["101", "company_description"] == "Acme builds robots for warehouses and ports"
+    assert df.loc["101", ["source", "is_edited", "created_at"]].tolist() == ["web", "1", "2023-02-01"]
+    assert repairer.repairs == [{"id": "101", "rows": [3, 5], "lines": 3, "filled": []}]
+
+def test_extra_commas_stay_in_the_description(tmp_path, block_size):
+    df, repairer = read(tmp_path, row(0) + "1,101,Bolt ships freight, parcels, and pallets,web,0,2023-02-02\n" + row(2), block_size)
+    assert df.loc["101", "company_description"] == "Bolt ships freight, parcels, and pallets"
+    assert df.loc["101", "created_at"] == "2023-02-02"
+    assert [repair["id"] for repair in repairer.repairs] == ["101"]
+
+def test_continuation_lines_starting_with_digits(tmp_path, block_size):
+    df, repairer = read(tmp_path, row(0) + "1,101,Founded in\n2015 by two engineers,web,0,2023-02-03\n" + row(2), block_size)
+    assert list(df.index) == ["100", "101", "102"]
+    assert df.loc["101", "company_description"] == "Founded in 2015 by two engineers"
+    assert repairer.repairs[0]["rows"] == [3, 4]
+
+def test_truncated_final_record_is_filled_in(tmp_path, block_size):
+    df, repairer = read(tmp_path, row(0) + row(1) + "2,102,Truncated description", block_size)
+    assert list(df.index) == ["100", "101", "102"]
+    assert df.loc["102", "company_description"] == "Truncated description"
+    # The categorical column gets its most common value, the rest their fill values
+    assert df.loc["102", ["source", "is_edited"]].tolist() == ["web", "0"]
+    assert pd.isna(df.loc["102", "created_at"])
+    assert repairer.repairs[-1]["filled"] == ["source", "is_edited", "created_at"]
+
+def test_stray_trailing_lines_are_dropped_and_reported(tmp_path, block_size, capsys):
+    df, repairer = read(tmp_path, row(0) + row(1) + "stray text\nmore stray text\n", block_size)
+    assert list(df.index) == ["100", "101"]
+    assert repairer.repairs == [
+        {"id": None, "rows": [4, 4], "lines": 1, "text": "stray text"},
+        {"id": None, "rows": [5, 5], "lines": 1, "text": "more stray text"},
+    ]
+    out = capsys.readouterr().out
+    assert "Dropped row 4, not part of any record: 'stray text'" in out
+    assert "Repaired 0 malformed records, dropped 2 rows belonging to none." in out
+
+def test_well_formed_rows_keep_their_order_around_repairs(tmp_path, block_size):
+    body = row(0) + "1,101,Split\nrecord,web,0,2023-02-01\n" + row(2) + "stray text\n" + row(3)
+    df, repairer = read(tmp_path, body, block_size)
+    assert list(df.index) == ["100", "101", "102", "103"]
+    assert [repair["id"] for repair in repairer.repairs] == ["101", None]
@@ -0,0 +1,18 @@
+from src.tfidf import HashingTfidfVectorizer
+
+TEXTS = [f"company {i % 13 + 10} builds robots and trucks for warehouse {i % 7 + 30}" for i in range(300)]
+
+def test_partial_fit_in_chunks_matches_fit():
+    chunked = HashingTfidfVectorizer(max_features=20)
+    for start in range(0, len(TEXTS), 100):
+        chunked.partial_fit(TEXTS[start:start + 100])
+    whole = HashingTfidfVectorizer(max_features=20).fit(TEXTS)
+    assert (chunked.transform(TEXTS) != whole.transform(TEXTS)).nnz == 0
+
+def test_weights_are_computed_when_first_needed():
+    vectorizer = HashingTfidfVectorizer(max_features=20).partial_fit(TEXTS[:100]).partial_fit(TEXTS[100:])
+    assert vectorizer.columns is None
+    assert len(vectorizer.get_feature_names_out()) == 20
+    columns = vectorizer.columns
+    vectorizer.transform(TEXTS[:5])
+    assert vectorizer.columns is columns